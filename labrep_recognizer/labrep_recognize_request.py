@@ -5,10 +5,20 @@ from enum import Enum
 import pandas as pd
 from tika import parser
 
-from labrep_recognizer.labrep_types.labrep_interface import laboratory_types
+from labrep_recognizer.labrep_types.labrep_registry import get_labrep_registry
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import read_abbyy_output
 from labrep_recognizer.recognition_tools.abbyy_tools import AbbyyTools
 from labrep_recognizer.recognition_tools.google_tools import GoogleTools
-from openpyxl import load_workbook
+from labrep_recognizer.shared.round_trips import count_round_trips
+from labrep_recognizer.shared.utils import stream_to_sha256, transfer_stream_file
+from labrep_recognizer.shared.stage_executor import (
+    StageGroup,
+    RecognitionStageError,
+    RecognitionStageCancelled,
+    STAGE_BACKEND_ABBYY,
+    STAGE_BACKEND_GOOGLE,
+    STAGE_BACKEND_LOCAL,
+)
 
 log = get_logger(__name__)
 
@@ -32,56 +42,120 @@ class LabrepRecognizeRequest:
 
         # Extracted common intermediate data
         self.input_pdf_file_uri = None
+        self.input_pdf_sha256 = None
+        self.input_pdf_stream = None
         self.ocred_file = None
         self.google_ocred_document = None
         self.df_abbyy_extracted = None
         self.tika_extracted_text = None
+        self.abbyy_conversion_ok = None
+        self.abbyy_error_message = ""
+        # Set when the report type is known before ABBYY OCR starts, otherwise the registry wide output type is used
+        self.abbyy_output_type = None
 
         # Extracted results
         self.df_header = None
         self.df_details = None
 
+        # External API calls made for this request, by operation
+        self.round_trips = dict()
+
+        # Set when one of the parallel stages fails, the other stages stop at their next check
+        self.stages_cancelled = threading.Event()
+
     def _get_uploaded_pdf_uri(self):
         # Assume there is only one input file; type is PDF and location on Google Cloud Storage
         assert len(self.input_files) == 1
         assert self.input_files[0]["FILE_TYPE"] == IOFileType.INPUT_GS_PDF_RAW_LAB_REPORT
         return self.input_files[0]["FILE_PATH"]
 
+    def _get_uploaded_pdf_sha256(self):
+        # Content hash is only used for cache keys, so it is not computed when the cache is disabled
+        content_sha256 = self.input_files[0].get("FILE_SHA256")
+        if content_sha256 is None and self.recognizer_infrastructure._cache is not None:
+            content_sha256 = stream_to_sha256(self._get_input_pdf_stream())
+        return content_sha256
+
+    def _get_input_pdf_stream(self):
+        # Downloaded once per request, read by the content hash and by Tika
+        if self.input_pdf_stream is None:
+            self.input_pdf_stream = self.recognizer_infrastructure.download_stream_from_google_bucket(
+                self.input_pdf_file_uri
+            )
+        self.input_pdf_stream.seek(0)
+        return self.input_pdf_stream
+
+    def _check_stages_cancelled(self, stage):
+        if self.stages_cancelled.is_set():
+            log.info(f"Stage {stage} cancelled.")
+            raise RecognitionStageCancelled(f"Stage {stage} cancelled")
+
     def run_google(self):
+        self._check_stages_cancelled("google")
         log.info("Starring Google OCR...")
-        self.google_ocred_document = self.recognizer_infrastructure.ocr_google(self.input_pdf_file_uri)
+        self.google_ocred_document = self.recognizer_infrastructure.ocr_google(
+            self.input_pdf_file_uri, self.input_pdf_sha256
+        )
+        self._check_stages_cancelled("google")
         self.google_tools = GoogleTools(self.google_ocred_document)
         log.info("Finished Google OCR.")
         return None
 
     def run_abbyy(self):
+        self._check_stages_cancelled("abbyy")
         log.info("Starring ABBYY OCR...")
+        if self.abbyy_output_type is None:
+            self.abbyy_output_type = get_labrep_registry().abbyy_output_type()
         (
             self.abbyy_conversion_ok,
             self.abbyy_error_message,
             self.ocred_file,
-        ) = self.recognizer_infrastructure.ocr_abbyy_fr_engine(self.input_pdf_file_uri)
+        ) = self.recognizer_infrastructure.ocr_abbyy_fr_engine(
+            self.input_pdf_file_uri, self.input_pdf_sha256, self.abbyy_output_type
+        )
         if self.abbyy_conversion_ok:
             log.info("Finished ABBYY OCR.")
             log.info("Starting DF extraction...")
-            self.df_abbyy_extracted = self.read_fix_excel(self.ocred_file, "Sheet1")
+            self.df_abbyy_extracted = read_abbyy_output(self.ocred_file, self.abbyy_output_type)
             self.df_abbyy_extracted = self.df_abbyy_extracted.fillna("").astype(str)
             self.abbyy_tools = AbbyyTools(self.df_abbyy_extracted)
             log.info("Finished DF extraction.")
+        elif self.parallel_execution:
+            # Fatal for the request, it returns the error without waiting for the other stages
+            raise RecognitionStageError(self.abbyy_error_message)
         return None
 
     def run_local_processing(self):
+        self._check_stages_cancelled("local")
         log.info("Starting local processing...")
-        log.info("Downloading local PDF copy...")
-        local_pdf_copy = self.recognizer_infrastructure.download_file_from_google_bucket(
-            self.input_pdf_file_uri, "data/local_input_copy"
-        )
+        log.info("Downloading PDF...")
+        input_pdf_stream = self._get_input_pdf_stream()
+        self._check_stages_cancelled("local")
         log.info("Starting Tika parser...")
-        self.tika_extracted_text = str(parser.from_file(local_pdf_copy)["content"])
+        self.tika_extracted_text = str(parser.from_buffer(transfer_stream_file(input_pdf_stream))["content"])
+        # Tika is the last reader
+        self._close_input_pdf_stream()
         log.info("Finished Tika parser...")
         log.info("Finished local processing.")
 
+    def _close_input_pdf_stream(self):
+        # Also called by an abandoned local stage, closing twice is harmless
+        input_pdf_stream, self.input_pdf_stream = self.input_pdf_stream, None
+        if input_pdf_stream is not None:
+            input_pdf_stream.close()
+
     def recognize(self):
+        with count_round_trips() as round_trips:
+            try:
+                recognition_result = self._recognize()
+            finally:
+                # Not read by Tika when a stage failed first
+                self._close_input_pdf_stream()
+        self.round_trips = round_trips.counts()
+        log.info(f"Round trips: {round_trips.total()} {self.round_trips}")
+        return recognition_result
+
+    def _recognize(self):
 
         recognition_status_ok = False
         recognition_error = ""
@@ -92,33 +166,35 @@ class LabrepRecognizeRequest:
 
         self.input_pdf_file_uri = self._get_uploaded_pdf_uri()
         log.info(f"input_pdf_file_uri: {self.input_pdf_file_uri}")
+        self.input_pdf_sha256 = self._get_uploaded_pdf_sha256()
+        log.info(f"input_pdf_sha256: {self.input_pdf_sha256}")
 
+        laboratory = None
         if self.parallel_execution:
-            # Run in parallel
-            thread_abbyy = threading.Thread(target=self.run_abbyy)
-            thread_google = threading.Thread(target=self.run_google)
-            thread_local = threading.Thread(target=self.run_local_processing)
-            thread_abbyy.start()
-            thread_google.start()
-            thread_local.start()
-            thread_google.join()
-            thread_abbyy.join()
-            thread_local.join()
+            # Run in parallel on the shared per backend executors
+            try:
+                laboratory = self.run_staged_extraction()
+            except RecognitionStageError as e:
+                log.info(f"Recognition stage failed: {e}")
+                return False, f"{e} "
         else:
-            # Run 1 by 1
+            # Run 1 by 1, other stages are skipped when ABBYY conversion fails
             self.run_abbyy()
+            if not self.abbyy_conversion_ok:
+                return False, f"{self.abbyy_error_message} "
             self.run_google()
             self.run_local_processing()
 
         # TODO add status check from Google as well
-        if self.abbyy_conversion_ok:
+        if self.abbyy_conversion_ok is not False:
 
             ###########################################################################
             # Identify LabRep type                                                    #
             ###########################################################################
 
             log.info("Starting report type identification...")
-            laboratory = self.identify()
+            if laboratory is None:
+                laboratory = self.identify()
             log.info(laboratory)
             log.info("Finished report type identification.")
 
@@ -132,15 +208,13 @@ class LabrepRecognizeRequest:
             log.info("Starting recognition...")
             if sum(laboratory.values()) == 1:
 
-                for laboratory_type in laboratory_types:
+                for laboratory_type in get_labrep_registry().laboratory_types:
                     if laboratory[laboratory_type[2]]:
-                        mod = __import__(
-                            "labrep_recognizer.labrep_types." + laboratory_type[0], fromlist=[laboratory_type[1]]
-                        )
-                        labrep = getattr(mod, laboratory_type[1])
+                        labrep = get_labrep_registry().get_class(laboratory_type)
 
                         # Disable debug
-                        self.google_tools.debug_draw_image = False
+                        if self.google_tools is not None:
+                            self.google_tools.debug_draw_image = False
 
                         parsing_function = labrep(
                             self.df_abbyy_extracted,
@@ -175,14 +249,93 @@ class LabrepRecognizeRequest:
 
         return recognition_status_ok, recognition_error
 
-    def identify(self):
-        laboratory = dict()
-        for laboratory_type in laboratory_types:
-            mod = __import__("labrep_recognizer.labrep_types." + laboratory_type[0], fromlist=[laboratory_type[1]])
-            LabrepClass = getattr(mod, laboratory_type[1])
+    def run_staged_extraction(self):
+        # Tika text is extracted first and identifies the report type where it can. Then only the stages producing
+        # what identification and the identified type's parser need are run. Stages every type needs are started
+        # right away, so a report needing all of them is not delayed.
+        stage_functions = {
+            STAGE_BACKEND_ABBYY: self.run_abbyy,
+            STAGE_BACKEND_GOOGLE: self.run_google,
+            STAGE_BACKEND_LOCAL: self.run_local_processing,
+        }
+        stage_group = StageGroup(self.stages_cancelled)
+
+        def start_stages(backends):
+            for backend in backends:
+                if backend not in stage_group.started():
+                    stage_group.start(backend, stage_functions[backend])
+
+        start_stages([STAGE_BACKEND_LOCAL] + get_labrep_registry().common_stages())
+        stage_group.wait([STAGE_BACKEND_LOCAL])
+
+        laboratory_type = self.identify_text()
+        if laboratory_type is not None:
+            log.info(f"Identified from text: {laboratory_type[0]}")
+            labrep_class = get_labrep_registry().get_class(laboratory_type)
+            if STAGE_BACKEND_ABBYY not in stage_group.started():
+                self.abbyy_output_type = labrep_class.abbyy_output_type
+            # Confirmed with the OCR based identification of the same type. The cheap marker pass of all marker based
+            # types runs too, so the result is accepted only when no other type matches, as in full identification.
+            confirming_types = [laboratory_type] + [
+                marker_type for marker_type in get_labrep_registry().marker_types() if marker_type != laboratory_type
+            ]
+            start_stages(
+                [
+                    stage
+                    for confirming_type in confirming_types
+                    for stage in get_labrep_registry().get_class(confirming_type).identification_stages()
+                ]
+                + labrep_class.parsing_stages()
+            )
+            stage_group.wait()
+            laboratory = self.identify(confirming_types)
+            if laboratory[laboratory_type[2]] and sum(laboratory.values()) == 1:
+                return laboratory
+            log.info("Identification from text not confirmed, identifying by OCR.")
+            if self.abbyy_output_type != get_labrep_registry().abbyy_output_type():
+                # Other types are identified and parsed from the output they are written for
+                self.abbyy_output_type = None
+                if STAGE_BACKEND_ABBYY in stage_group.started():
+                    stage_group.restart(STAGE_BACKEND_ABBYY, stage_functions[STAGE_BACKEND_ABBYY])
+
+        start_stages(get_labrep_registry().identification_stages())
+        stage_group.wait()
+        laboratory = self.identify()
+        identified = [
+            laboratory_type
+            for laboratory_type in get_labrep_registry().laboratory_types
+            if laboratory[laboratory_type[2]]
+        ]
+        if len(identified) == 1:
+            start_stages(get_labrep_registry().get_class(identified[0]).parsing_stages())
+            stage_group.wait()
+        return laboratory
+
+    def identify_text(self):
+        identified = get_labrep_registry().identify_text(self.tika_extracted_text)
+        return identified[0] if len(identified) == 1 else None
+
+    def identify(self, laboratory_types_to_identify=None):
+        registry = get_labrep_registry()
+        if laboratory_types_to_identify is None:
+            laboratory_types_to_identify = registry.laboratory_types
+        laboratory = {laboratory_type[2]: False for laboratory_type in registry.laboratory_types}
+
+        # Marker based types are identified in one pass over the ABBYY extracted fields
+        found_by_markers = []
+        if self.abbyy_tools is not None:
+            found_by_markers = registry.find_markers(self.abbyy_tools.extracted_text())
+
+        for laboratory_type in laboratory_types_to_identify:
+            if registry.is_identified_by_markers(laboratory_type):
+                laboratory[laboratory_type[2]] = laboratory_type in found_by_markers
+                continue
+
+            LabrepClass = registry.get_class(laboratory_type)
 
             # Disable debug
-            self.google_tools.debug_draw_image = False
+            if self.google_tools is not None:
+                self.google_tools.debug_draw_image = False
 
             labrep = LabrepClass(
                 self.df_abbyy_extracted,
@@ -193,17 +346,3 @@ class LabrepRecognizeRequest:
             )
             laboratory[laboratory_type[2]] = labrep.identify()
         return laboratory
-
-    def read_fix_excel(self, file_name, sheet_name):
-        wb = load_workbook(file_name, data_only=True)
-        sh = wb[sheet_name]
-        for row in sh:
-            for cell in row:
-                # print(f"{cell.number_format}: {cell.value}")
-                if cell.number_format == "#,##0":
-                    # print(f"Updating cell {cell}...")
-                    value = cell.value
-                    cell.number_format = "General"
-                    cell.value = f"{value:,}"
-        df = pd.DataFrame(sh.values)
-        return df
@@ -1,7 +1,12 @@
 from copy import copy
 import string
 
-from labrep_recognizer.labrep_types.labrep_interface import LabrepInterface
+from labrep_recognizer.labrep_types.labrep_interface import (
+    LabrepInterface,
+    PRODUCT_ABBYY_TOOLS,
+    PRODUCT_DF_ABBYY_EXTRACTED,
+    PRODUCT_GOOGLE_OCRED_DOCUMENT,
+)
 from functools import partial
 import pandas as pd
 from labrep_recognizer.recognition_tools.ocr_tolerance import (
@@ -12,14 +17,15 @@ from labrep_recognizer.shared.utils import is_valid_iso_date_time_str
 
 
 class LabrepAnteja2021(LabrepInterface):
+    identification_markers = ["300598351"]
+    identification_products = [PRODUCT_ABBYY_TOOLS]
+    parsing_products = [PRODUCT_DF_ABBYY_EXTRACTED, PRODUCT_ABBYY_TOOLS, PRODUCT_GOOGLE_OCRED_DOCUMENT]
+
     def anteja_2021_corrector_rezult(self, s):
         if isinstance(s, str):
             s = s.replace("∕", "/")
         return s
 
-    def identify(self):
-        return self.abbyy_tools.find_anywhere("300598351")
-
     # Header methods
 
     def header_laboratory_name(self):
@@ -1,3 +1,28 @@
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import ABBYY_OUTPUT_XLSX
+from labrep_recognizer.shared.stage_executor import (
+    STAGE_BACKEND_ABBYY,
+    STAGE_BACKEND_GOOGLE,
+    STAGE_BACKEND_LOCAL,
+    STAGE_BACKENDS,
+)
+
+# Extraction products passed to LabrepInterface
+PRODUCT_DF_ABBYY_EXTRACTED = "df_abbyy_extracted"
+PRODUCT_ABBYY_TOOLS = "abbyy_tools"
+PRODUCT_GOOGLE_OCRED_DOCUMENT = "google_ocred_document"
+PRODUCT_GOOGLE_TOOLS = "google_tools"
+PRODUCT_TIKA_EXTRACTED_TEXT = "tika_extracted_text"
+
+# Extraction stage producing each product
+PRODUCT_STAGES = {
+    PRODUCT_DF_ABBYY_EXTRACTED: STAGE_BACKEND_ABBYY,
+    PRODUCT_ABBYY_TOOLS: STAGE_BACKEND_ABBYY,
+    PRODUCT_GOOGLE_OCRED_DOCUMENT: STAGE_BACKEND_GOOGLE,
+    PRODUCT_GOOGLE_TOOLS: STAGE_BACKEND_GOOGLE,
+    PRODUCT_TIKA_EXTRACTED_TEXT: STAGE_BACKEND_LOCAL,
+}
+ALL_PRODUCTS = list(PRODUCT_STAGES.keys())
+
 laboratory_types = [
     ("labrep_anteja_2021", "LabrepAnteja2021", "is_anteja_2021", "Anteja"),
     ("labrep_medicina_practica_2021", "LabrepMedicinaPractica2021", "is_medicina_practica_2021", "MedicinaPractica"),
@@ -6,6 +31,15 @@ laboratory_types = [
 
 
 class LabrepInterface:
+    # Strings identifying the report in the Tika and ABBYY extracted text, empty when identify() is overridden
+    identification_markers = []
+    # Extraction products used by identify() and by parse(), only these are produced for the identified type. Tika text
+    # is always extracted first, for identification from text, so it need not be listed.
+    identification_products = ALL_PRODUCTS
+    parsing_products = ALL_PRODUCTS
+    # ABBYY output the parser is written for, used when the type is known before ABBYY OCR starts
+    abbyy_output_type = ABBYY_OUTPUT_XLSX
+
     def __init__(
         self,
         df_abbyy_extracted,
@@ -20,6 +54,17 @@ class LabrepInterface:
         self.google_tools = google_tools
         self.tika_extracted_text = tika_extracted_text
 
+    @classmethod
+    def identification_stages(cls):
+        return get_product_stages(cls.identification_products)
+
+    @classmethod
+    def parsing_stages(cls):
+        return get_product_stages(cls.parsing_products)
+
+    def identify(self):
+        return any([self.abbyy_tools.find_anywhere(marker) for marker in self.identification_markers])
+
     def parse(self):
         header = dict()
 
@@ -76,3 +121,7 @@ class LabrepInterface:
 
     def details(self):
         pass
+
+
+def get_product_stages(products):
+    return [stage for stage in STAGE_BACKENDS if stage in [PRODUCT_STAGES[product] for product in products]]
@@ -1,10 +1,19 @@
 import pandas as pd
 
 from labrep_recognizer.labrep_types.labrep_anteja_2021 import get_corpus_dfs
-from labrep_recognizer.labrep_types.labrep_interface import LabrepInterface
+from labrep_recognizer.labrep_types.labrep_interface import (
+    LabrepInterface,
+    PRODUCT_ABBYY_TOOLS,
+    PRODUCT_DF_ABBYY_EXTRACTED,
+    PRODUCT_GOOGLE_TOOLS,
+)
 
 
 class LabrepMedicinaPractica2021(LabrepInterface):
+    identification_markers = ["Medicina practica laboratorija, UAB"]
+    identification_products = [PRODUCT_ABBYY_TOOLS]
+    parsing_products = [PRODUCT_DF_ABBYY_EXTRACTED, PRODUCT_ABBYY_TOOLS, PRODUCT_GOOGLE_TOOLS]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # self.google_tools.debug_draw_image = False
@@ -14,9 +23,6 @@ class LabrepMedicinaPractica2021(LabrepInterface):
             s = s.replace("∕", "/")
         return s
 
-    def identify(self):
-        return self.abbyy_tools.find_anywhere("Medicina practica laboratorija, UAB")
-
     # Header methods
 
     def header_laboratory_name(self):
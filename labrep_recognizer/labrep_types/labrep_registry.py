@@ -0,0 +1,92 @@
+import threading
+
+from labrep_recognizer.labrep_types.labrep_interface import LabrepInterface, laboratory_types
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import ABBYY_OUTPUT_XLSX
+from labrep_recognizer.shared.stage_executor import STAGE_BACKENDS
+from labrep_recognizer.recognition_tools.marker_index import MarkerIndex
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+# Parser classes of laboratory_types imported once, with a marker index identifying all marker based types in a single
+# pass over the extracted text
+class LabrepRegistry:
+    def __init__(self, laboratory_types_registered):
+        self.laboratory_types = laboratory_types_registered
+        self._classes = dict()
+        for laboratory_type in self.laboratory_types:
+            mod = __import__("labrep_recognizer.labrep_types." + laboratory_type[0], fromlist=[laboratory_type[1]])
+            self._classes[laboratory_type[0]] = getattr(mod, laboratory_type[1])
+
+        markers = dict()
+        for laboratory_type in self.laboratory_types:
+            for marker in self.get_class(laboratory_type).identification_markers:
+                markers.setdefault(marker, []).append(laboratory_type[0])
+        self._marker_index = MarkerIndex({marker: tuple(names) for marker, names in markers.items()})
+
+    def get_class(self, laboratory_type):
+        return self._classes[laboratory_type[0]]
+
+    def find_markers(self, text):
+        # Laboratory types with a marker found in text, in laboratory_types order
+        found_names = set([name for names in self._marker_index.find(text) for name in names])
+        return [laboratory_type for laboratory_type in self.laboratory_types if laboratory_type[0] in found_names]
+
+    def identify_text(self, text):
+        # Tika text is matched with whitespace normalized, markers can be broken over lines there
+        return self.find_markers(" ".join(text.split()))
+
+    def identification_stages(self):
+        # Stages needed to run identify() of every laboratory type
+        return [
+            stage
+            for stage in STAGE_BACKENDS
+            if any(
+                [
+                    stage in self.get_class(laboratory_type).identification_stages()
+                    for laboratory_type in self.laboratory_types
+                ]
+            )
+        ]
+
+    def common_stages(self):
+        # Stages needed by every laboratory type, they are started before the type is known
+        return [
+            stage
+            for stage in STAGE_BACKENDS
+            if all(
+                [
+                    stage in self.get_class(laboratory_type).identification_stages()
+                    or stage in self.get_class(laboratory_type).parsing_stages()
+                    for laboratory_type in self.laboratory_types
+                ]
+            )
+        ]
+
+    def abbyy_output_type(self):
+        # ABBYY output requested before the type is known, XLSX unless every laboratory type is written for another
+        output_types = set(
+            [self.get_class(laboratory_type).abbyy_output_type for laboratory_type in self.laboratory_types]
+        )
+        return output_types.pop() if len(output_types) == 1 else ABBYY_OUTPUT_XLSX
+
+    def is_identified_by_markers(self, laboratory_type):
+        # Types not overriding identify() are identified by markers in the ABBYY extracted fields
+        return self.get_class(laboratory_type).identify is LabrepInterface.identify
+
+    def marker_types(self):
+        return [
+            laboratory_type
+            for laboratory_type in self.laboratory_types
+            if self.is_identified_by_markers(laboratory_type)
+        ]
+
+
+def get_labrep_registry():
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = LabrepRegistry(laboratory_types)
+        return _registry
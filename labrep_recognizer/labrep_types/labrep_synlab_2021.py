@@ -2,13 +2,21 @@ from functools import partial
 import pandas as pd
 
 from labrep_recognizer.labrep_types.labrep_anteja_2021 import get_corpus_dfs, find_urine_block
-from labrep_recognizer.labrep_types.labrep_interface import LabrepInterface
+from labrep_recognizer.labrep_types.labrep_interface import (
+    LabrepInterface,
+    PRODUCT_DF_ABBYY_EXTRACTED,
+    PRODUCT_GOOGLE_OCRED_DOCUMENT,
+    PRODUCT_GOOGLE_TOOLS,
+)
 from labrep_recognizer.recognition_tools.image_debug import debug_img
 from labrep_recognizer.recognition_tools.ocr_tolerance import correct_ocr_error_by_two_corpus
 from labrep_recognizer.shared.utils import split_cell
 
 
 class LabrepSynlab2021(LabrepInterface):
+    identification_products = [PRODUCT_GOOGLE_TOOLS]
+    parsing_products = [PRODUCT_DF_ABBYY_EXTRACTED, PRODUCT_GOOGLE_OCRED_DOCUMENT, PRODUCT_GOOGLE_TOOLS]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
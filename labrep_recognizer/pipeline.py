@@ -1,4 +1,7 @@
+import json
 import os
+import threading
+import time
 from pathlib import Path
 import pandas as pd
 
@@ -7,18 +10,27 @@ from openpyxl.utils import get_column_letter
 from labrep_recognizer.labrep_recognize_request import IOFileType, LabrepRecognizeRequest
 from labrep_recognizer.normalization.normalization_survey_burnout import normalize_survey_burnout
 from labrep_recognizer.shared.pdf_parser_logging import get_logger
-from labrep_recognizer.shared.recognizer_cache import RecognizerCache
+from labrep_recognizer.shared.recognizer_cache import RecognizerCache, CACHE_POLICY_LRU
 from labrep_recognizer.recognizer_infrastructure import RecognizerInfrastructure
-from labrep_recognizer.shared.utils import make_dirs, file_to_sha256
+from labrep_recognizer.shared.utils import make_dirs, file_to_sha256, environ_int
 
 log = get_logger(__name__)
 
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_CACHE_MAX_LOG_BYTES = 1024 * 1024 * 1024
+DEFAULT_HEALTH_CHECK_INTERVAL = 60
 
-def process_single_pdf_in_gs(uploaded_file_uri, recognizer_infrastructure):
+_shared_infrastructure = None
+_shared_infrastructure_pid = None
+_shared_infrastructure_checked_at = 0.0
+_shared_infrastructure_lock = threading.Lock()
+
+
+def process_single_pdf_in_gs(uploaded_file_uri, recognizer_infrastructure, content_sha256=None):
 
     SAFE_EXECUTION = False
 
-    input_files = single_pdf_gs_to_input_files_param(uploaded_file_uri)
+    input_files = single_pdf_gs_to_input_files_param(uploaded_file_uri, content_sha256)
 
     labrep_recognize_request = LabrepRecognizeRequest(
         recognizer_infrastructure=recognizer_infrastructure,
@@ -67,7 +79,16 @@ def initialize_infrastructure():
     if cache_file is None or cache_file == "":
         cache = None
     else:
-        cache = RecognizerCache(cache_file, 0)
+        cache = RecognizerCache(
+            cache_file,
+            0,
+            max_entries=environ_int("recognizer_cache_max_entries"),
+            max_bytes=environ_int("recognizer_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES),
+            policy=os.environ.get("recognizer_cache_policy", CACHE_POLICY_LRU),
+            ttl=environ_int("recognizer_cache_ttl"),
+            namespace_quotas=json.loads(os.environ.get("recognizer_cache_namespace_quotas", "{}")),
+            max_log_bytes=environ_int("recognizer_cache_max_log_bytes", DEFAULT_CACHE_MAX_LOG_BYTES),
+        )
 
     recognizer_infrastructure = RecognizerInfrastructure(
         project_id=os.environ.get("recognizer_project_id"),
@@ -79,11 +100,42 @@ def initialize_infrastructure():
     return recognizer_infrastructure
 
 
-def single_pdf_gs_to_input_files_param(uploaded_file_uri):
+def get_shared_infrastructure():
+    # One RecognizerInfrastructure per worker process, shared by all requests. Rebuilt after fork, clients are
+    # reconnected when the periodic health check fails.
+    global _shared_infrastructure, _shared_infrastructure_pid, _shared_infrastructure_checked_at
+
+    with _shared_infrastructure_lock:
+        if _shared_infrastructure is None or _shared_infrastructure_pid != os.getpid():
+            log.info(f"Initializing shared infrastructure for process {os.getpid()}...")
+            _shared_infrastructure = initialize_infrastructure()
+            _shared_infrastructure_pid = os.getpid()
+            _shared_infrastructure_checked_at = time.monotonic()
+            return _shared_infrastructure
+        infrastructure = _shared_infrastructure
+        check_due = time.monotonic() - _shared_infrastructure_checked_at > environ_int(
+            "recognizer_health_check_interval", DEFAULT_HEALTH_CHECK_INTERVAL
+        )
+        if check_due:
+            # Only this request checks, the others go on with the infrastructure meanwhile
+            _shared_infrastructure_checked_at = time.monotonic()
+
+    if check_due:
+        # Network calls are made without the lock. A failed reconnect is tried again at the next check.
+        try:
+            if not infrastructure.is_healthy():
+                infrastructure.reconnect()
+        except Exception as e:
+            log.error(f"Reconnecting shared infrastructure failed: {str(e)}")
+    return infrastructure
+
+
+def single_pdf_gs_to_input_files_param(uploaded_file_uri, content_sha256=None):
     input_files = [
         {
             "FILE_TYPE": IOFileType.INPUT_GS_PDF_RAW_LAB_REPORT,
             "FILE_PATH": uploaded_file_uri,
+            "FILE_SHA256": content_sha256,
         }
     ]
     return input_files
@@ -101,7 +153,7 @@ def recognize_single_local_pdf(raw_pdf):
     uploaded_file_uri = upload_pdf_to_gs(raw_pdf, recognizer_infrastructure)
     log.info(f"uploaded_file_uri: {uploaded_file_uri}")
     recognition_status_ok, recognition_error, df_header, df_details = process_single_pdf_in_gs(
-        uploaded_file_uri, recognizer_infrastructure
+        uploaded_file_uri, recognizer_infrastructure, file_to_sha256(raw_pdf)
     )
     return recognition_status_ok, recognition_error, df_header, df_details
 
@@ -0,0 +1,58 @@
+import csv
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Output types of the ABBYY wrapper, the file it writes to the bucket
+ABBYY_OUTPUT_XLSX = "OUTPUT_GS_XLSX_OCRED_LAB_REPORT"
+ABBYY_OUTPUT_CSV = "OUTPUT_GS_CSV_OCRED_LAB_REPORT"
+ABBYY_OUTPUT_TYPES = [ABBYY_OUTPUT_XLSX, ABBYY_OUTPUT_CSV]
+
+ABBYY_XLSX_SHEET_NAME = "Sheet1"
+
+# ABBYY writes thousands as integers formatted with a separator, recognition expects the text as shown
+THOUSANDS_NUMBER_FORMAT = "#,##0"
+
+
+def read_abbyy_xlsx(file_name, sheet_name):
+    # Rows are streamed from the sheet XML (read-only workbook), the number format fix is applied per cell while the
+    # rows are collected, the workbook is never modified
+    wb = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        sh = wb[sheet_name]
+        # Declared sheet dimensions are not trusted, the frame spans the cells present as with a loaded workbook
+        sh.reset_dimensions()
+        rows = []
+        last_row_with_cells = 0
+        max_columns = 0
+        for row in sh.iter_rows():
+            rows.append([fix_cell_value(cell) for cell in row])
+            if row:
+                last_row_with_cells = len(rows)
+                max_columns = max(max_columns, len(row))
+    finally:
+        wb.close()
+
+    values = [row + [None] * (max_columns - len(row)) for row in rows[:last_row_with_cells]]
+    return pd.DataFrame(values)
+
+
+def fix_cell_value(cell):
+    if (cell.value is not None) and (cell.number_format == THOUSANDS_NUMBER_FORMAT):
+        return f"{cell.value:,}"
+    return cell.value
+
+
+def read_abbyy_csv(file_name):
+    # Cell texts as recognized, no number formats to fix. Rows are padded to the widest row, as sheet rows are.
+    with open(file_name, newline="", encoding="utf-8-sig") as f:
+        rows = [[None if cell == "" else cell for cell in row] for row in csv.reader(f)]
+    max_columns = max([len(row) for row in rows], default=0)
+    return pd.DataFrame([row + [None] * (max_columns - len(row)) for row in rows])
+
+
+def read_abbyy_output(file_name, output_type):
+    if output_type == ABBYY_OUTPUT_CSV:
+        return read_abbyy_csv(file_name)
+    assert output_type == ABBYY_OUTPUT_XLSX
+    return read_abbyy_xlsx(file_name, ABBYY_XLSX_SHEET_NAME)
@@ -1,11 +1,18 @@
-import numpy as np
-from copy import copy
+from labrep_recognizer.recognition_tools.text_index import TokenTextIndex
 
 
 class AbbyyTools:
     def __init__(self, df_extract):
         self._df_extract = df_extract
-        self._extracted_all_fields = list(sorted(set(self._df_extract.to_numpy().flatten())))
+        # Unique cell texts are never modified, spans removed by lookups are kept in an overlay by field position
+        self._fields = tuple(sorted(set(self._df_extract.to_numpy().flatten())))
+        self._removed = dict()
+        # Cells in row-major order, a flat position maps back to (row, column) with divmod
+        self._cells = self._df_extract.to_numpy()
+        self._flat_cells = self._cells.ravel().tolist()
+        all_strings = all(isinstance(cell, str) for cell in self._flat_cells)
+        self._cell_text_index = TokenTextIndex(self._flat_cells) if all_strings else None
+        self._field_text_index = TokenTextIndex(self._fields) if all_strings else None
 
     def find_at_offset(
         self,
@@ -29,51 +36,80 @@ class AbbyyTools:
         if isinstance(search_strings, str):
             search_strings = (search_strings,)
         found_values = []
+        columns = self._cells.shape[1]
         for search_string in search_strings:
-            found_at = np.where(self._df_extract.applymap(lambda cell: search_string in cell).to_numpy())
-            for i in range(len(found_at[0])):
-                x = found_at[1][i]
-                y = found_at[0][i]
-                found_values.append(self._df_extract.iloc[y + offset_y, x + offset_x])
+            for position in self._cells_containing(search_string):
+                y, x = divmod(position, columns)
+                found_values.append(self._cells[y + offset_y, x + offset_x])
         return sorted(list(set(found_values)))
 
+    def _cells_containing(self, search_string):
+        # Flat positions of the cells containing the search string, ascending
+        if (self._cell_text_index is not None) and self._cell_text_index.can_search(search_string):
+            return self._cell_text_index.rows_containing(search_string)
+        return [position for position, cell in enumerate(self._flat_cells) if search_string in cell]
+
+    @property
+    def _extracted_all_fields(self):
+        return [self._removed.get(position, field) for position, field in enumerate(self._fields)]
+
+    def extracted_text(self):
+        return "\n".join(self._extracted_all_fields)
+
     def find_anywhere(self, search_string):
-        return any([search_string in field for field in self._extracted_all_fields])
+        return self._find_field(search_string, self._removed) is not None
 
     def find_till_the_end(self, search_string, remove=False):
-        found_at = [i for i, field in enumerate(self._extracted_all_fields) if search_string in field][0]
-        found_inside_at = self._extracted_all_fields[found_at].find(search_string)
-        found_value = self._extracted_all_fields[found_at][found_inside_at + len(search_string) :].strip()
-        if remove:
-            self._extracted_all_fields[found_at] = self._extracted_all_fields[found_at][:found_inside_at]
-        return found_value
+        return self._find_till_the_end(search_string, self._removed, remove)
 
     def find_whole_word(self, search_string, remove=False):
-        found_at = [i for i, field in enumerate(self._extracted_all_fields) if search_string in field][0]
-        found_inside_at = self._extracted_all_fields[found_at].find(search_string)
-        found_value = self._extracted_all_fields[found_at][found_inside_at + len(search_string) :].strip().split(" ")[0]
-        found_value_inside_at = self._extracted_all_fields[found_at].find(found_value)
+        found_at = self._get_field(search_string, self._removed)
+        field = self._removed.get(found_at, self._fields[found_at])
+        found_inside_at = field.find(search_string)
+        found_value = field[found_inside_at + len(search_string) :].strip().split(" ")[0]
+        found_value_inside_at = field.find(found_value)
         found_end_value = found_value_inside_at + len(found_value)
         if remove:
-            self._extracted_all_fields[found_at] = (
-                self._extracted_all_fields[found_at][:found_inside_at]
-                + self._extracted_all_fields[found_at][found_end_value:]
-            )
+            self._removed[found_at] = field[:found_inside_at] + field[found_end_value:]
 
         return found_value
 
-    # TODO refactor to avoid copying
-    def find_till_the_end_in_copy(self, search_string, extracted_copy, remove=False):
-        found_at = [i for i, field in enumerate(extracted_copy) if search_string in field][0]
-        found_inside_at = extracted_copy[found_at].find(search_string)
-        found_value = extracted_copy[found_at][found_inside_at + len(search_string) :].strip()
+    def find_between_keywords(self, before, after):
+        # Removal of the after keyword is only visible to this lookup, so it goes to a copy of the overlay
+        removed = dict(self._removed)
+        _ = self._find_till_the_end(after, removed, remove=True)
+        return self._find_till_the_end(before, removed, remove=False)
+
+    def _find_till_the_end(self, search_string, removed, remove):
+        found_at = self._get_field(search_string, removed)
+        field = removed.get(found_at, self._fields[found_at])
+        found_inside_at = field.find(search_string)
+        found_value = field[found_inside_at + len(search_string) :].strip()
         if remove:
-            extracted_copy[found_at] = extracted_copy[found_at][:found_inside_at]
+            removed[found_at] = field[:found_inside_at]
         return found_value
 
-    # TODO refactor to avoid copying
-    def find_between_keywords(self, before, after):
-        # TODO refactor to avoid copying
-        extracted_copy = copy(self._extracted_all_fields)
-        _ = self.find_till_the_end_in_copy(after, extracted_copy, remove=True)
-        return self.find_till_the_end_in_copy(before, extracted_copy, remove=False)
+    def _get_field(self, search_string, removed):
+        found_at = self._find_field(search_string, removed)
+        if found_at is None:
+            raise IndexError(f"Not found: {search_string}")
+        return found_at
+
+    def _find_field(self, search_string, removed):
+        # Position of the first field containing the search string, fields with removed spans are checked as they are
+        # now, the others through the index of the unchanged fields
+        found_at = None
+        for position, field in removed.items():
+            if (search_string in field) and ((found_at is None) or (position < found_at)):
+                found_at = position
+        for position in self._fields_containing(search_string):
+            if (found_at is not None) and (position >= found_at):
+                break
+            if position not in removed:
+                return position
+        return found_at
+
+    def _fields_containing(self, search_string):
+        if (self._field_text_index is not None) and self._field_text_index.can_search(search_string):
+            return self._field_text_index.iter_rows_containing(search_string)
+        return (position for position, field in enumerate(self._fields) if search_string in field)
@@ -2,13 +2,43 @@ import PIL
 from shapely.geometry import Point, Polygon
 
 from labrep_recognizer.recognition_tools.image_debug import ImageDebug
+from labrep_recognizer.recognition_tools.line_clustering import cluster_rows
+from labrep_recognizer.recognition_tools.spatial_index import PageSpatialIndex
+from labrep_recognizer.recognition_tools.text_index import TokenTextIndex, TokenOffsetIndex
+from labrep_recognizer.recognition_tools.token_table import (
+    TokenTable,
+    same_row_mask,
+    token_lengths,
+    in_rectangle_mask,
+    is_axis_aligned_rectangle,
+)
 from labrep_recognizer.shared.utils import find_all_strings
 
+# Shorter token lists, e.g. the tokens to the right of a keyword, are scanned directly: a search of the text index
+# goes over the text of the whole document
+TEXT_INDEX_MIN_TOKENS = 64
+
 
 class GoogleTools(ImageDebug):
     def __init__(self, google_ocred_document):
         super().__init__()
         self.google_ocred_document = google_ocred_document
+        # Token geometry converted once per document, spatial indexes built on the first query of a page
+        self.token_table = TokenTable(google_ocred_document)
+        self._page_spatial_indexes = dict()
+        self._token_text_index = None
+        self._page_offset_indexes = dict()
+
+    def get_page_tokens(self, page_index):
+        return self.token_table.page_tokens(page_index)
+
+    def get_page_spatial_index(self, page_index):
+        if page_index not in self._page_spatial_indexes:
+            page_rows = self.token_table.page_rows(page_index)
+            self._page_spatial_indexes[page_index] = PageSpatialIndex(
+                self.token_table.x[page_rows], self.token_table.y[page_rows]
+            )
+        return self._page_spatial_indexes[page_index]
 
     def extract_text_from_rectangle_to_left_between_keys(
         self,
@@ -51,7 +81,7 @@ class GoogleTools(ImageDebug):
         search_keywords,
     ):
         tokens_current = self.gd_find_token_by_text_from_token_list(
-            self.google_ocred_document.pages[page_index].tokens,
+            self.get_page_tokens(page_index),
             search_keywords[0],
         )
 
@@ -76,56 +106,38 @@ class GoogleTools(ImageDebug):
         return line_separator.join([" ".join([self.get_token_text(token).strip() for token in line]) for line in lines])
 
     def organize_tokens_box(self, tokens):
-        lines = []
-        tokens = sorted(
-            tokens, key=(lambda token_internal: token_internal.layout.bounding_poly.normalized_vertices[0].x)
-        )
-        token_is_available = [True] * len(tokens)
-        while any(token_is_available):
-            available_range = [i for i, x in enumerate(token_is_available) if x]
-            token_from = tokens[available_range[0]]
-            line_tokens = []
-            lines.append(line_tokens)
-            for i in available_range:
-                token = tokens[i]
-                if self.is_same_row(token_from, token):
-                    lines[-1].append(token)
-                    token_is_available[i] = False
-        lines = sorted(lines, key=(lambda line: line[0].layout.bounding_poly.normalized_vertices[0].y))
-        return lines
-
-    def is_same_row(self, token_1, token_2):
-        tolerance = 0.25
-
-        tokens = sorted([token_1, token_2], key=self.get_token_height)
+        x, y, height = self.token_table.geometry(tokens)
+        return [[tokens[i] for i in line] for line in cluster_rows(x[:, 0], y[:, 0], y[:, 3], height)]
 
-        y_small_0 = tokens[0].layout.bounding_poly.normalized_vertices[0].y
-        y_small_1 = tokens[0].layout.bounding_poly.normalized_vertices[3].y
-
-        y_large_0 = tokens[1].layout.bounding_poly.normalized_vertices[0].y
-        y_large_1 = tokens[1].layout.bounding_poly.normalized_vertices[3].y
-        y_large_sorted = sorted([y_large_0, y_large_1])
+    def get_token_text_index(self):
+        if self._token_text_index is None:
+            text = self.google_ocred_document.text
+            self._token_text_index = TokenTextIndex(
+                [
+                    text[start:end]
+                    for start, end in zip(self.token_table.text_start.tolist(), self.token_table.text_end.tolist())
+                ]
+            )
+        return self._token_text_index
 
-        y_small_fit_0 = y_small_0 + ((y_small_1 - y_small_0) * tolerance)
-        y_small_fit_1 = y_small_1 - ((y_small_1 - y_small_0) * tolerance)
+    def get_page_offset_index(self, page_index):
+        if page_index not in self._page_offset_indexes:
+            page_rows = self.token_table.page_rows(page_index)
+            self._page_offset_indexes[page_index] = TokenOffsetIndex(
+                self.token_table.text_start[page_rows], self.token_table.text_end[page_rows]
+            )
+        return self._page_offset_indexes[page_index]
 
-        return (y_large_sorted[0] < y_small_fit_0 < y_large_sorted[1]) and (
-            y_large_sorted[0] < y_small_fit_1 < y_large_sorted[1]
-        )
+    def is_same_row(self, token_1, token_2):
+        x, y, height = self.token_table.geometry([token_1, token_2])
+        return bool(same_row_mask(y[0, 0], y[0, 3], height[0], y[1:, 0], y[1:, 3], height[1:])[0])
 
     def get_token_height(self, token):
-        token_height = (
-            Point(self.get_point_from_token(token, 0)).distance(Point(self.get_point_from_token(token, 3)))
-            + Point(self.get_point_from_token(token, 1)).distance(Point(self.get_point_from_token(token, 2)))
-        ) / 2.0
-        return token_height
+        return float(self.token_table.geometry([token])[2][0])
 
     def get_token_length(self, token):
-        token_length = (
-            Point(self.get_point_from_token(token, 0)).distance(Point(self.get_point_from_token(token, 1)))
-            + Point(self.get_point_from_token(token, 2)).distance(Point(self.get_point_from_token(token, 3)))
-        ) / 2.0
-        return token_length
+        x, y, _ = self.token_table.geometry([token])
+        return float(token_lengths(x, y)[0])
 
     def get_point_from_token(self, token, index):
         point = (
@@ -140,7 +152,14 @@ class GoogleTools(ImageDebug):
         ]
 
     def gd_find_token_by_text_from_token_list(self, tokens, search_string):
-        found_tokens = [token for token in tokens if search_string in self.get_token_text(token)]
+        rows = None
+        if len(tokens) >= TEXT_INDEX_MIN_TOKENS and TokenTextIndex.can_search(search_string):
+            rows = self.token_table.get_rows(tokens)
+        if rows is None:
+            found_tokens = [token for token in tokens if search_string in self.get_token_text(token)]
+        else:
+            rows_found = set(self.get_token_text_index().rows_containing(search_string))
+            found_tokens = [token for token, row in zip(tokens, rows.tolist()) if row in rows_found]
 
         if self.debug_draw_image:
             # TODO get an access to real page index
@@ -158,9 +177,6 @@ class GoogleTools(ImageDebug):
         boundary_relative=False,
         offset_y=0.0,
     ):
-        found_tokens = []
-        page = self.google_ocred_document.pages[page_index]
-
         scan_start_x = search_from_token.layout.bounding_poly.normalized_vertices[1].x - 0.001
         scan_start_y = (
             search_from_token.layout.bounding_poly.normalized_vertices[1].y
@@ -178,15 +194,9 @@ class GoogleTools(ImageDebug):
             PIL.ImageColor.getrgb("blue"),
         )
 
-        for token_to_the_right in page.tokens:
-            if (
-                (token_to_the_right.layout.bounding_poly.normalized_vertices[0].x > scan_start_x)
-                and (token_to_the_right.layout.bounding_poly.normalized_vertices[0].x < boundary_x)
-                and (token_to_the_right.layout.bounding_poly.normalized_vertices[0].y < scan_start_y)
-                and (token_to_the_right.layout.bounding_poly.normalized_vertices[3].y > scan_start_y)
-            ):
-                found_tokens.append(token_to_the_right)
-        return found_tokens
+        page_tokens = self.get_page_tokens(page_index)
+        found_at = self.get_page_spatial_index(page_index).to_right(scan_start_x, boundary_x, scan_start_y)
+        return [page_tokens[i] for i in found_at]
 
     def gd_find_tokens_in_box(
         self,
@@ -194,22 +204,33 @@ class GoogleTools(ImageDebug):
         box,
     ):
         found_tokens = []
-        page = self.google_ocred_document.pages[page_index]
+        page_tokens = self.get_page_tokens(page_index)
 
         # Debug
         self.draw_token_rectangle_img_box(page_index, box, PIL.ImageColor.getrgb("blue"))
 
         polygon = Polygon(box)
-        for token in page.tokens:
-            if all(
-                [
-                    polygon.contains(Point(normalized_vertice.x, normalized_vertice.y))
-                    for normalized_vertice in token.layout.bounding_poly.normalized_vertices
-                ]
-            ):
-                found_tokens.append(token)
-                # Debug
-                self.draw_token_boundary_img(page_index, token, PIL.ImageColor.getrgb("brown"))
+        candidates = self.get_page_spatial_index(page_index).rectangle_candidates(*polygon.bounds)
+        if is_axis_aligned_rectangle(box):
+            page_rows = self.token_table.page_rows(page_index)
+            x = self.token_table.x[page_rows][candidates]
+            y = self.token_table.y[page_rows][candidates]
+            found_at = candidates[in_rectangle_mask(x, y, *polygon.bounds)]
+        else:
+            found_at = [
+                i
+                for i in candidates
+                if all(
+                    [
+                        polygon.contains(Point(normalized_vertice.x, normalized_vertice.y))
+                        for normalized_vertice in page_tokens[i].layout.bounding_poly.normalized_vertices
+                    ]
+                )
+            ]
+        for i in found_at:
+            found_tokens.append(page_tokens[i])
+            # Debug
+            self.draw_token_boundary_img(page_index, page_tokens[i], PIL.ImageColor.getrgb("brown"))
 
         return found_tokens
 
@@ -273,13 +294,15 @@ class GoogleTools(ImageDebug):
         found_at_start = list(find_all_strings(search_string, self.google_ocred_document.text))
         found_at_end = list(map(lambda x: x + len(search_string), found_at_start))
         found_at = list(zip(found_at_start, found_at_end))
-        found_tokens = []
-        page = self.google_ocred_document.pages[page_index]
-        for token in page.tokens:
-            for serch_range in found_at:
-                assert len(token.layout.text_anchor.text_segments) == 1
-                if (token.layout.text_anchor.text_segments[0].start_index <= serch_range[0]) and (
-                    token.layout.text_anchor.text_segments[0].end_index >= serch_range[1]
-                ):
-                    found_tokens.append(token)
-        return found_tokens
+        page_rows = self.token_table.page_rows(page_index)
+        if found_at:
+            assert all(self.token_table.text_segments[page_rows] == 1)
+
+        # Token for every match containing it, in page order of the tokens and then in order of the matches
+        found_tokens_at = []
+        page_offset_index = self.get_page_offset_index(page_index)
+        for match_no, serch_range in enumerate(found_at):
+            for row in page_offset_index.rows_containing_range(serch_range[0], serch_range[1]):
+                found_tokens_at.append((row, match_no))
+        page_tokens = self.get_page_tokens(page_index)
+        return [page_tokens[row] for row, _ in sorted(found_tokens_at)]
@@ -0,0 +1,41 @@
+import numpy as np
+
+from labrep_recognizer.recognition_tools.spatial_index import ROW_MARGIN
+from labrep_recognizer.recognition_tools.token_table import same_row_mask
+
+
+def cluster_rows(x_0, y_0, y_3, height):
+    # Groups tokens into lines, same result as taking the leftmost remaining token and collecting all remaining tokens
+    # on the same row with it (GoogleTools.is_same_row), but sweeping tokens sorted by y: only the tokens in the
+    # y band of the leftmost token are checked. Returns lines of token indices, tokens left to right, lines top to
+    # bottom by the first token.
+    by_x = np.argsort(x_0, kind="stable")
+    x_rank = np.empty(len(x_0), dtype=np.int64)
+    x_rank[by_x] = np.arange(len(x_0))
+
+    y_min = np.minimum(y_0, y_3)
+    y_max = np.maximum(y_0, y_3)
+    # Tokens of NaN geometry are swept last, each gets a line of its own at the end
+    max_height = float(np.fmax.reduce(y_max - y_min, initial=0.0))
+    by_y_min = np.argsort(y_min, kind="stable")
+    sorted_y_min = y_min[by_y_min]
+
+    token_is_available = np.ones(len(x_0), dtype=bool)
+    lines = []
+    for token_from in by_x:
+        if not token_is_available[token_from]:
+            continue
+        # Overlapping y ranges is a necessary condition of being on the same row
+        first = np.searchsorted(sorted_y_min, y_min[token_from] - max_height - ROW_MARGIN, side="right")
+        last = np.searchsorted(sorted_y_min, y_max[token_from], side="left")
+        band = by_y_min[first:last]
+        band = band[token_is_available[band] & (y_max[band] > y_min[token_from])]
+        same_row = same_row_mask(
+            y_0[token_from], y_3[token_from], height[token_from], y_0[band], y_3[band], height[band]
+        )
+        # Token of zero height is not on the same row with itself, it gets a line of its own
+        line = np.union1d(band[same_row], [token_from])
+        line = line[np.argsort(x_rank[line], kind="stable")]
+        token_is_available[line] = False
+        lines.append(line)
+    return sorted(lines, key=(lambda line_internal: (np.isnan(y_0[line_internal[0]]), y_0[line_internal[0]])))
@@ -0,0 +1,51 @@
+from collections import deque
+
+
+# Aho-Corasick automaton over marker strings, finds all markers present in a text in one pass over it, independent
+# of the number of markers
+class MarkerIndex:
+    def __init__(self, markers):
+        # markers: marker -> value reported when the marker is found
+        self._transitions = [dict()]
+        self._fail = [0]
+        self._outputs = [set()]
+        for marker, value in markers.items():
+            assert marker != ""
+            self._add(marker, value)
+        self._build_fail_links()
+
+    def _add(self, marker, value):
+        state = 0
+        for char in marker:
+            if char not in self._transitions[state]:
+                self._transitions.append(dict())
+                self._fail.append(0)
+                self._outputs.append(set())
+                self._transitions[state][char] = len(self._transitions) - 1
+            state = self._transitions[state][char]
+        self._outputs[state].add(value)
+
+    def _build_fail_links(self):
+        queue = deque(self._transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._transitions[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._transitions[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._transitions[fail].get(char, 0)
+                # Markers ending at the fail state end here as well
+                self._outputs[next_state] |= self._outputs[self._fail[next_state]]
+
+    def find(self, text):
+        found = set()
+        state = 0
+        transitions = self._transitions
+        for char in text:
+            while state and char not in transitions[state]:
+                state = self._fail[state]
+            state = transitions[state].get(char, 0)
+            if self._outputs[state]:
+                found |= self._outputs[state]
+        return found
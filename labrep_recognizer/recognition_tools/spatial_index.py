@@ -0,0 +1,37 @@
+import numpy as np
+
+# Widens row candidate ranges against rounding of the token heights
+ROW_MARGIN = 1e-6
+
+
+# Tokens of one page sorted by x, so to-the-right and rectangle queries only look at tokens in the queried x range. Queries return token indices in page order, same as scanning page tokens.
+class PageSpatialIndex:
+    def __init__(self, x, y):
+        # x, y: vertex coordinate arrays (tokens, 4) of the page
+        self._x_0 = x[:, 0]
+        self._y_0 = y[:, 0]
+        self._y_3 = y[:, 3]
+
+        self._by_x = np.argsort(self._x_0, kind="stable")
+        self._sorted_x = self._x_0[self._by_x]
+
+    def _x_range(self, x_from, x_to, inclusive):
+        if inclusive:
+            first = np.searchsorted(self._sorted_x, x_from, side="left")
+            last = np.searchsorted(self._sorted_x, x_to, side="right")
+        else:
+            first = np.searchsorted(self._sorted_x, x_from, side="right")
+            last = np.searchsorted(self._sorted_x, x_to, side="left")
+        return self._by_x[first:last]
+
+    def to_right(self, scan_start_x, boundary_x, scan_start_y):
+        # First vertex strictly between scan_start_x and boundary_x, scan line crossing the token
+        candidates = self._x_range(scan_start_x, boundary_x, inclusive=False)
+        mask = (self._y_0[candidates] < scan_start_y) & (self._y_3[candidates] > scan_start_y)
+        return np.sort(candidates[mask])
+
+    def rectangle_candidates(self, x_min, y_min, x_max, y_max):
+        # Tokens with the first vertex inside the bounds, callers check the exact containment
+        candidates = self._x_range(x_min, x_max, inclusive=True)
+        mask = (self._y_0[candidates] >= y_min) & (self._y_0[candidates] <= y_max)
+        return np.sort(candidates[mask])
@@ -0,0 +1,58 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from labrep_recognizer.shared.utils import find_all_strings
+
+# Never part of OCR token texts, so substring matches do not span tokens
+TOKEN_SEPARATOR = "\x00"
+
+
+# Texts of all tokens joined into one string: a substring lookup is one str.find pass over it plus a bisect from the
+# character offset of each match to its token
+class TokenTextIndex:
+    def __init__(self, token_texts):
+        self._joined = TOKEN_SEPARATOR.join(token_texts)
+        self._offsets = []
+        offset = 0
+        for token_text in token_texts:
+            self._offsets.append(offset)
+            offset += len(token_text) + len(TOKEN_SEPARATOR)
+
+    @staticmethod
+    def can_search(search_string):
+        return search_string != "" and TOKEN_SEPARATOR not in search_string
+
+    def rows_containing(self, search_string):
+        # Rows of tokens with the search string in their text, ascending
+        return list(self.iter_rows_containing(search_string))
+
+    def iter_rows_containing(self, search_string):
+        # Lazy, the joined text is only searched as far as the rows are consumed
+        assert self.can_search(search_string)
+        last_row = None
+        for found_at in find_all_strings(search_string, self._joined):
+            row = bisect_right(self._offsets, found_at) - 1
+            if row != last_row:
+                last_row = row
+                yield row
+
+
+# Tokens of a page sorted by the start of their text segment, maps a character range of the document text to the
+# tokens containing it
+class TokenOffsetIndex:
+    def __init__(self, text_start, text_end):
+        self._by_start = np.argsort(text_start, kind="stable").tolist()
+        self._sorted_start = [int(text_start[row]) for row in self._by_start]
+        self._text_end = text_end.tolist()
+        # Largest end of the tokens starting at or before, scanning back stops when no earlier token reaches the range
+        self._max_end = np.maximum.accumulate(text_end[self._by_start]).tolist() if len(text_end) else []
+
+    def rows_containing_range(self, start, end):
+        rows = []
+        i = bisect_right(self._sorted_start, start) - 1
+        while i >= 0 and self._max_end[i] >= end:
+            if self._text_end[self._by_start[i]] >= end:
+                rows.append(self._by_start[i])
+            i -= 1
+        return rows
@@ -0,0 +1,114 @@
+import numpy as np
+
+SAME_ROW_TOLERANCE = 0.25
+
+
+# Geometry and text anchors of all Document AI tokens as NumPy arrays, one row per token in page order. Vertex
+# coordinates are kept as float64 of the protobuf values, so vectorized predicates give the same results as computing
+# them token by token.
+class TokenTable:
+    def __init__(self, document):
+        self.tokens = []
+        self.page_starts = [0]
+        for page in document.pages:
+            self.tokens += list(page.tokens)
+            self.page_starts.append(len(self.tokens))
+        self.x, self.y = token_vertices(self.tokens)
+        self.page = np.repeat(np.arange(len(document.pages)), np.diff(self.page_starts))
+        self.text_start, self.text_end, self.text_segments = token_text_anchors(self.tokens)
+        self.height = token_heights(self.x, self.y)
+        # Token objects are kept in self.tokens, so their ids stay valid
+        self._rows = {id(token): row for row, token in enumerate(self.tokens)}
+
+    def page_rows(self, page_index):
+        return slice(self.page_starts[page_index], self.page_starts[page_index + 1])
+
+    def page_tokens(self, page_index):
+        return self.tokens[self.page_rows(page_index)]
+
+    def get_rows(self, tokens):
+        # None when some of the tokens are not from the table, e.g. read from the document again
+        rows = [self._rows.get(id(token)) for token in tokens]
+        if any([row is None for row in rows]):
+            return None
+        return np.array(rows, dtype=np.int64)
+
+    def geometry(self, tokens):
+        rows = self.get_rows(tokens)
+        if rows is None:
+            x, y = token_vertices(tokens)
+            return x, y, token_heights(x, y)
+        return self.x[rows], self.y[rows], self.height[rows]
+
+
+def token_vertices(tokens):
+    # Tokens without 4 vertices, e.g. an empty bounding_poly, get NaN geometry. Comparisons with NaN are False, so
+    # spatial queries and row masks leave them out instead of failing the document.
+    x = np.full((len(tokens), 4), np.nan, dtype=np.float64)
+    y = np.full((len(tokens), 4), np.nan, dtype=np.float64)
+    for row, token in enumerate(tokens):
+        vertices = token.layout.bounding_poly.normalized_vertices
+        if len(vertices) == 4:
+            x[row] = [vertex.x for vertex in vertices]
+            y[row] = [vertex.y for vertex in vertices]
+    return x, y
+
+
+def token_text_anchors(tokens):
+    # First text segment of each token, as used by GoogleTools.get_token_text, and the number of segments
+    segments = [token.layout.text_anchor.text_segments for token in tokens]
+    text_start = np.array([s[0].start_index if len(s) > 0 else -1 for s in segments], dtype=np.int64)
+    text_end = np.array([s[0].end_index if len(s) > 0 else -1 for s in segments], dtype=np.int64)
+    text_segments = np.array([len(s) for s in segments], dtype=np.int64)
+    return text_start, text_end, text_segments
+
+
+def _distance(x_a, y_a, x_b, y_b):
+    # Same operations as the point distance in shapely (GEOS)
+    dx = x_a - x_b
+    dy = y_a - y_b
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def token_heights(x, y):
+    return (_distance(x[:, 0], y[:, 0], x[:, 3], y[:, 3]) + _distance(x[:, 1], y[:, 1], x[:, 2], y[:, 2])) / 2.0
+
+
+def token_lengths(x, y):
+    return (_distance(x[:, 0], y[:, 0], x[:, 1], y[:, 1]) + _distance(x[:, 2], y[:, 2], x[:, 3], y[:, 3])) / 2.0
+
+
+def same_row_mask(from_y_0, from_y_3, from_height, y_0, y_3, height, tolerance=SAME_ROW_TOLERANCE):
+    # GoogleTools.is_same_row of one token against many: the middle part of the lower token has to fit vertically
+    # inside the higher one, the token_from is the lower one on equal heights
+    from_is_small = from_height <= height
+    y_small_0 = np.where(from_is_small, from_y_0, y_0)
+    y_small_1 = np.where(from_is_small, from_y_3, y_3)
+    y_large_0 = np.where(from_is_small, y_0, from_y_0)
+    y_large_1 = np.where(from_is_small, y_3, from_y_3)
+    y_large_sorted_0 = np.minimum(y_large_0, y_large_1)
+    y_large_sorted_1 = np.maximum(y_large_0, y_large_1)
+
+    y_small_fit_0 = y_small_0 + ((y_small_1 - y_small_0) * tolerance)
+    y_small_fit_1 = y_small_1 - ((y_small_1 - y_small_0) * tolerance)
+
+    return (
+        (y_large_sorted_0 < y_small_fit_0)
+        & (y_small_fit_0 < y_large_sorted_1)
+        & (y_large_sorted_0 < y_small_fit_1)
+        & (y_small_fit_1 < y_large_sorted_1)
+    )
+
+
+def in_rectangle_mask(x, y, x_min, y_min, x_max, y_max):
+    # All vertices strictly inside, same as shapely Polygon.contains for an axis-aligned rectangle
+    return np.all((x > x_min) & (x < x_max) & (y > y_min) & (y < y_max), axis=1)
+
+
+def is_axis_aligned_rectangle(box):
+    if len(box) != 4:
+        return False
+    xs = set([point[0] for point in box])
+    ys = set([point[1] for point in box])
+    sides_aligned = all([(box[i][0] == box[(i + 1) % 4][0]) != (box[i][1] == box[(i + 1) % 4][1]) for i in range(4)])
+    return len(xs) == 2 and len(ys) == 2 and sides_aligned
@@ -1,20 +1,44 @@
 import json
 import os
 import sys
+import threading
 
 import cachetools
 import requests
+from google.api_core.exceptions import ClientError
 from google.cloud import documentai_v1beta2 as documentai, storage
-from google.cloud.documentai_v1beta2 import Document
 from google.cloud import secretmanager
 from tika.tika import checkTikaServer
 
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import ABBYY_OUTPUT_XLSX, ABBYY_OUTPUT_TYPES
+from labrep_recognizer.shared.abbyy_client import AbbyyClient
+from labrep_recognizer.shared.document_serialization import (
+    document_to_compressed_proto,
+    document_from_compressed_proto,
+)
 from labrep_recognizer.shared.pdf_parser_logging import get_logger
-from labrep_recognizer.shared.recognizer_cache import RecognizerCache
-
+from labrep_recognizer.shared.recognizer_cache import RecognizerCache, cache_namespace
+from labrep_recognizer.shared.round_trips import (
+    record_round_trip,
+    ROUND_TRIP_GET_BUCKET,
+    ROUND_TRIP_UPLOAD,
+    ROUND_TRIP_DOWNLOAD,
+    ROUND_TRIP_DELETE,
+    ROUND_TRIP_OCR_GOOGLE,
+)
+from labrep_recognizer.shared.stage_executor import get_stage_deadline
+from labrep_recognizer.shared.utils import new_transfer_stream
 
 log = get_logger(__name__)
 
+# Part of the content addressed cache keys, change when OCR request parameters change
+OCR_GOOGLE_VERSION = "documentai_v1beta2/eu/table_extraction/proto_zstd/2"
+OCR_ABBYY_FR_ENGINE_VERSION = "abbyy_fr_engine/English, Lithuanian, Mathematical/{output_type}/1"
+
+
+class AbbyyConversionError(Exception):
+    pass
+
 
 class RecognizerInfrastructure:
     def __init__(
@@ -28,6 +52,16 @@ class RecognizerInfrastructure:
         self.project_id = project_id
         self.ocr_abbyy_fr_engine_url = ocr_abbyy_fr_engine_url
         self.google_application_credentials = google_application_credentials
+        self._bucket = None
+        self._bucket_lock = threading.Lock()
+        # Kept by reconnect(): conversions in flight keep their session, broken pooled connections are replaced by the
+        # pool and retried by the client
+        self.abbyy_client = AbbyyClient(self.ocr_abbyy_fr_engine_url)
+        self._create_clients()
+
+    def _create_clients(self):
+        # Bucket handle of the previous storage client is not reused
+        self._bucket = None
         if self.google_application_credentials:
             self.storage_client = storage.Client.from_service_account_json(self.google_application_credentials)
             self.ocr_client = documentai.DocumentUnderstandingServiceClient.from_service_account_json(
@@ -37,13 +71,18 @@ class RecognizerInfrastructure:
                 self.google_application_credentials
             )
 
-    def ocr_google(self, input_uri):
-        google_document_ai_json = self._ocr_google_to_json(input_uri, "_ocr_google_to_json")
-        google_document_ai = Document.from_json(google_document_ai_json)
+    def ocr_google(self, input_uri, content_sha256=None):
+        google_document_ai_compressed_proto = self._ocr_google_to_compressed_proto(
+            input_uri,
+            "_ocr_google_to_compressed_proto",
+            content_sha256=content_sha256,
+            ocr_version=OCR_GOOGLE_VERSION,
+        )
+        google_document_ai = document_from_compressed_proto(google_document_ai_compressed_proto)
         return google_document_ai
 
-    @cachetools.cachedmethod(lambda self: self._cache, key=RecognizerCache.pickled_hashkey)
-    def _ocr_google_to_json(self, input_uri, function_name):
+    @cachetools.cachedmethod(cache_namespace("_ocr_google_to_compressed_proto"), key=RecognizerCache.content_hashkey)
+    def _ocr_google_to_compressed_proto(self, input_uri, function_name, content_sha256=None, ocr_version=None):
         # ## OCR uploaded document with google document AI
         gcs_source = documentai.types.GcsSource(uri=input_uri)
         # mime_type can be application/pdf, image/tiff,
@@ -81,19 +120,32 @@ class RecognizerInfrastructure:
             input_config=input_config,
             table_extraction_params=table_extraction_params,
         )
+        record_round_trip(ROUND_TRIP_OCR_GOOGLE)
         google_document_ai = self.ocr_client.process_document(request=request)
-        google_document_ai_json = Document.to_json(google_document_ai)
+        # Cached as zstd compressed protobuf bytes, much smaller and faster to restore than Document.to_json
+        google_document_ai_compressed_proto = document_to_compressed_proto(google_document_ai)
 
-        return google_document_ai_json
+        return google_document_ai_compressed_proto
 
-    @cachetools.cachedmethod(lambda self: self._cache, key=RecognizerCache.pickled_hashkey)
-    def ocr_abbyy_fr_engine(self, uploaded_uri):
-        return self._ocr_abbyy_fr_engine(uploaded_uri, "_ocr_abbyy_fr_engine")
+    def ocr_abbyy_fr_engine(self, uploaded_uri, content_sha256=None, output_type=ABBYY_OUTPUT_XLSX):
+        assert output_type in ABBYY_OUTPUT_TYPES
+        try:
+            return self._ocr_abbyy_fr_engine_cached(
+                uploaded_uri,
+                output_type,
+                content_sha256=content_sha256,
+                ocr_version=OCR_ABBYY_FR_ENGINE_VERSION.format(output_type=output_type),
+            )
+        except AbbyyConversionError as e:
+            # Raised through the cache, so a failed conversion is tried again by the next request
+            log.error(str(e))
+            return False, str(e), None
 
-    def _ocr_abbyy_fr_engine(self, uploaded_uri, function_name):
+    @cachetools.cachedmethod(cache_namespace("ocr_abbyy_fr_engine"), key=RecognizerCache.content_hashkey)
+    def _ocr_abbyy_fr_engine_cached(self, uploaded_uri, output_type, content_sha256=None, ocr_version=None):
+        return self._ocr_abbyy_fr_engine(uploaded_uri, output_type, "_ocr_abbyy_fr_engine")
 
-        conversion_ok = False
-        error_message = "#_undefined_error_#"
+    def _ocr_abbyy_fr_engine(self, uploaded_uri, output_type, function_name):
 
         input_files = [
             {
@@ -105,7 +157,7 @@ class RecognizerInfrastructure:
         languages = "English, Lithuanian, Mathematical"
 
         output_types = [
-            "OUTPUT_GS_XLSX_OCRED_LAB_REPORT",
+            output_type,
         ]
 
         url = self.ocr_abbyy_fr_engine_url
@@ -115,107 +167,124 @@ class RecognizerInfrastructure:
             "output_types": json.dumps(output_types),
         }
         try:
-            response = requests.post(
-                url=url,
-                data=data,
-            )
-            conversion_ok = True
-            error_message = ""
-        except (requests.exceptions.ConnectionError, requests.exceptions.MissingSchema) as e:
-            conversion_ok = False
-            error_message = f"Error from ocr_abbyy_fr_engine: {str(e)}, url: {self.ocr_abbyy_fr_engine_url}"
-            log.error(error_message)
+            response = self.abbyy_client.post(data, deadline=get_stage_deadline())
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.MissingSchema,
+        ) as e:
+            raise AbbyyConversionError(f"Error from ocr_abbyy_fr_engine: {str(e)}, url: {self.ocr_abbyy_fr_engine_url}")
         except:
             print("Unexpected error:", sys.exc_info()[0])
             raise
 
-        if conversion_ok:
-            # print(response.status_code, response.reason)
-            response_json = response.json()
-            # print(response_json)
-
-            if response.status_code == 200:
-                if "conversionStatus" in response_json:
-                    if response_json["conversionStatus"] == "OK":
-                        conversion_ok = True
-                        error_message = ""
-                    elif response_json["conversionStatus"] == "ERROR":
-                        conversion_ok = False
-                        error_message = (
-                            f"Error from ocr_abbyy_fr_engine, url: {url}, data: {data}, {response_json['errorMessage']}"
-                        )
-                        log.error(error_message)
-            else:
-                conversion_ok = False
-                error_message = f"Error from ocr_abbyy_fr_engine, url: {url}, data: {data}, status_code: {response.status_code}, {response.reason}, {response.text}"
-                log.error(error_message)
-
-        if conversion_ok:
-            xlsx_files = [
-                output_file["FILE_PATH"]
-                for output_file in response_json["outputFiles"]
-                if output_file["FILE_TYPE"] == "OUTPUT_GS_XLSX_OCRED_LAB_REPORT"
-            ]
-            assert len(xlsx_files) == 1
-            xlsx_file_uri = xlsx_files[0]
-
-            ocred_file = self.download_file_from_google_bucket(xlsx_file_uri, "data/ocred")
-
-            return (
-                True,
-                error_message,
-                ocred_file,
+        # Error responses may not be JSON
+        if response.status_code != 200:
+            raise AbbyyConversionError(
+                f"Error from ocr_abbyy_fr_engine, url: {url}, data: {data}, status_code: {response.status_code}, {response.reason}, {response.text}"
             )
-
-        else:
-            return (
-                False,
-                error_message,
-                None,
+        response_json = response.json()
+        if response_json.get("conversionStatus") == "ERROR":
+            raise AbbyyConversionError(
+                f"Error from ocr_abbyy_fr_engine, url: {url}, data: {data}, {response_json['errorMessage']}"
             )
 
+        output_files = [
+            output_file["FILE_PATH"]
+            for output_file in response_json["outputFiles"]
+            if output_file["FILE_TYPE"] == output_type
+        ]
+        assert len(output_files) == 1
+        output_file_uri = output_files[0]
+
+        ocred_file = self.download_file_from_google_bucket(output_file_uri, "data/ocred")
+
+        return (
+            True,
+            "",
+            ocred_file,
+        )
+
     def upload_pdf_to_google_bucket(self, raw_pdf, blob_name):
         original_input_uri = self._upload_pdf_to_google_bucket(raw_pdf, blob_name, "_upload_pdf_to_google_bucket")
         return original_input_uri
 
-    @cachetools.cachedmethod(lambda self: self._cache, key=RecognizerCache.pickled_hashkey)
+    @cachetools.cachedmethod(cache_namespace("_upload_pdf_to_google_bucket"), key=RecognizerCache.pickled_hashkey)
     def _upload_pdf_to_google_bucket(self, raw_pdf, blob_name, function_name):
         # ### Upload PDF to google cloud bucket
-        bucket_name = os.environ.get("recognizer_bucket_name")
-        print(list(self.storage_client.list_buckets()))
-        bucket = self.storage_client.get_bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        blob.upload_from_filename(raw_pdf)
-        print(blob.public_url)
-        input_uri = "gs://" + bucket_name + "/" + blob_name
-        print(input_uri)
+        input_uri = self._bucket_call(
+            ROUND_TRIP_UPLOAD, lambda bucket: bucket.blob(blob_name).upload_from_filename(raw_pdf), blob_name
+        )
+        log.debug(f"Uploaded: {input_uri}")
         return input_uri
 
     def delete_file_from_google_bucket(self, uri):
-        bucket_name = os.environ.get("recognizer_bucket_name")
-        blob_name = self.get_blob_name_from_uri(uri, bucket_name)
-        bucket = self.storage_client.get_bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        blob.delete()
+        blob_name = self.get_blob_name_from_uri(uri, os.environ.get("recognizer_bucket_name"))
+        self._bucket_call(ROUND_TRIP_DELETE, lambda bucket: bucket.blob(blob_name).delete(), blob_name)
         return None
 
     def download_file_from_google_bucket(self, uri, destination_dir):
         return self._download_file_from_google_bucket(uri, destination_dir, "_download_file_from_google_bucket")
 
-    @cachetools.cachedmethod(lambda self: self._cache, key=RecognizerCache.pickled_hashkey)
+    @cachetools.cachedmethod(cache_namespace("_download_file_from_google_bucket"), key=RecognizerCache.pickled_hashkey)
     def _download_file_from_google_bucket(self, uri, destination_dir, function_name):
-        bucket_name = os.environ.get("recognizer_bucket_name")
-        blob_name = self.get_blob_name_from_uri(uri, bucket_name)
-        print(list(self.storage_client.list_buckets()))
-        bucket = self.storage_client.get_bucket(bucket_name)
-        blob = bucket.get_blob(blob_name)
+        blob_name = self.get_blob_name_from_uri(uri, os.environ.get("recognizer_bucket_name"))
 
         downloaded_file_path = os.path.join(destination_dir, os.path.split(blob_name)[1])
 
-        blob.download_to_filename(downloaded_file_path)
+        self._bucket_call(
+            ROUND_TRIP_DOWNLOAD,
+            lambda bucket: bucket.blob(blob_name).download_to_filename(downloaded_file_path),
+            blob_name,
+        )
 
         return downloaded_file_path
 
+    def upload_stream_to_google_bucket(self, stream, blob_name, content_type="application/pdf"):
+        return self._bucket_call(
+            ROUND_TRIP_UPLOAD,
+            lambda bucket: bucket.blob(blob_name).upload_from_file(stream, rewind=True, content_type=content_type),
+            blob_name,
+        )
+
+    def download_stream_from_google_bucket(self, uri):
+        # Nothing is written to the data directories, so concurrent requests for the same blob do not collide
+        blob_name = self.get_blob_name_from_uri(uri, os.environ.get("recognizer_bucket_name"))
+        stream = new_transfer_stream()
+        try:
+            self._bucket_call(
+                ROUND_TRIP_DOWNLOAD, lambda bucket: bucket.blob(blob_name).download_to_file(stream), blob_name
+            )
+        except Exception:
+            stream.close()
+            raise
+        stream.seek(0)
+        return stream
+
+    def _get_bucket(self):
+        # Resolved once and held, blob handles are created locally without an API call
+        bucket_name = os.environ.get("recognizer_bucket_name")
+        with self._bucket_lock:
+            if self._bucket is None or self._bucket.name != bucket_name:
+                record_round_trip(ROUND_TRIP_GET_BUCKET)
+                self._bucket = self.storage_client.get_bucket(bucket_name)
+            return self._bucket
+
+    def _bucket_call(self, operation, function, blob_name):
+        # Exactly one API call on the held bucket, returns the uri of the blob. After a bucket or connection error the
+        # bucket is resolved again by the next call.
+        bucket = self._get_bucket()
+        record_round_trip(operation)
+        try:
+            function(bucket)
+        except Exception as e:
+            if is_bucket_error(e):
+                with self._bucket_lock:
+                    if self._bucket is bucket:
+                        self._bucket = None
+            raise
+        return "gs://" + bucket.name + "/" + blob_name
+
     def get_blob_name_from_uri(self, uri, bucket_name):
         full_input_file_path = ""
         found_bucket_name = False
@@ -234,3 +303,28 @@ class RecognizerInfrastructure:
         tika_server = checkTikaServer()
         log.info(f"Tika server is runnign at: {tika_server}")
         return None
+
+    def is_healthy(self):
+        try:
+            self.warm_up()
+            if self.google_application_credentials:
+                bucket_name = os.environ.get("recognizer_bucket_name")
+                assert self.storage_client.lookup_bucket(bucket_name) is not None
+            return True
+        except Exception as e:
+            log.error(f"Infrastructure health check failed: {str(e)}")
+            return False
+
+    def reconnect(self):
+        # Clients are rebuilt, the cache is kept
+        log.info("Reconnecting infrastructure clients...")
+        self._create_clients()
+        self.warm_up()
+        return None
+
+
+def is_bucket_error(e):
+    # Errors of the request itself, e.g. a missing blob, leave the bucket handle valid
+    if isinstance(e, ClientError):
+        return "bucket does not exist" in str(e).lower()
+    return True
@@ -0,0 +1,73 @@
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from labrep_recognizer.shared.pdf_parser_logging import get_logger
+from labrep_recognizer.shared.round_trips import record_round_trip, ROUND_TRIP_OCR_ABBYY
+from labrep_recognizer.shared.stage_executor import get_stage_max_workers, STAGE_BACKEND_ABBYY
+from labrep_recognizer.shared.utils import environ_int
+
+log = get_logger(__name__)
+
+# Connect timeout is short, a conversion of a long report takes minutes. Every attempt, its read timeout and the
+# backoff before it, fit inside the deadline of the ABBYY stage (recognizer_abbyy_timeout).
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 540
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_MS = 500
+
+
+# Keep-alive connection pool to the ABBYY wrapper. Connection errors and 5xx responses are retried with full jitter
+# exponential backoff; read timeouts are not, the conversion may still be running on the server. Concurrent
+# conversions are limited by the ABBYY stage workers (recognizer_abbyy_max_workers), the pool has a connection for each.
+class AbbyyClient:
+    def __init__(self, url):
+        self.url = url
+        self._connect_timeout = environ_int("recognizer_abbyy_connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+        self._read_timeout = environ_int("recognizer_abbyy_read_timeout", DEFAULT_READ_TIMEOUT)
+        self._max_retries = environ_int("recognizer_abbyy_max_retries", DEFAULT_MAX_RETRIES)
+        self._retry_backoff = environ_int("recognizer_abbyy_retry_backoff_ms", DEFAULT_RETRY_BACKOFF_MS) / 1000
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=get_stage_max_workers(STAGE_BACKEND_ABBYY))
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def post(self, data, deadline=None):
+        # deadline: time.monotonic() by which the response is needed, no attempt is started or waited for past it
+        attempt = 0
+        while True:
+            timeout = (self._connect_timeout, self._get_read_timeout(deadline))
+            backoff = random.uniform(0, self._retry_backoff * 2**attempt)
+            record_round_trip(ROUND_TRIP_OCR_ABBYY)
+            try:
+                response = self._session.post(url=self.url, data=data, timeout=timeout)
+                if response.status_code < 500 or not self._can_retry(attempt, backoff, deadline):
+                    return response
+                log.warning(f"ABBYY returned {response.status_code}, retrying ({attempt + 1}/{self._max_retries})")
+                # Returns the connection to the pool, which has only one per ABBYY stage worker
+                response.close()
+            except requests.exceptions.ConnectionError as e:
+                if not self._can_retry(attempt, backoff, deadline):
+                    raise
+                log.warning(f"ABBYY connection failed: {str(e)}, retrying ({attempt + 1}/{self._max_retries})")
+            time.sleep(backoff)
+            attempt += 1
+
+    def _get_read_timeout(self, deadline):
+        if deadline is None:
+            return self._read_timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout("ABBYY stage deadline passed")
+        return min(self._read_timeout, remaining)
+
+    def _can_retry(self, attempt, backoff, deadline):
+        # Retry is only worth it with time left to connect after the backoff
+        if attempt >= self._max_retries:
+            return False
+        return deadline is None or time.monotonic() + backoff + self._connect_timeout < deadline
+
+    def close(self):
+        self._session.close()
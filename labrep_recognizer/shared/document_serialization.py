@@ -0,0 +1,12 @@
+import cramjam
+from google.cloud.documentai_v1beta2 import Document
+
+ZSTD_LEVEL = 3
+
+
+def document_to_compressed_proto(document):
+    return bytes(cramjam.zstd.compress(Document.serialize(document), level=ZSTD_LEVEL))
+
+
+def document_from_compressed_proto(compressed_proto):
+    return Document.deserialize(bytes(cramjam.zstd.decompress(compressed_proto)))
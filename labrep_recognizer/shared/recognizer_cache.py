@@ -1,24 +1,179 @@
+import itertools
 import pickle
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 import cachetools
 
-from labrep_recognizer.shared.utils import make_dirs
+from labrep_recognizer.shared.recognizer_cache_store import AppendOnlyCacheStore
 
+CACHE_POLICY_LRU = "lru"
+CACHE_POLICY_TTL = "ttl"
+
+DEFAULT_NAMESPACE = "_default"
+
+
+class _LoadedEntry:
+    __slots__ = ("value", "size", "stored_at", "order")
+
+    def __init__(self, value, size, stored_at, order):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+        self.order = order
+
+
+class RecognizerCache(MutableMapping):
+    def __init__(
+        self,
+        cache_file,
+        persist_interval=10,
+        max_entries=None,
+        max_bytes=None,
+        policy=CACHE_POLICY_LRU,
+        ttl=None,
+        namespace_quotas=None,
+        max_log_bytes=None,
+    ):
+        assert policy in (CACHE_POLICY_LRU, CACHE_POLICY_TTL)
+        assert (policy != CACHE_POLICY_TTL) or (ttl is not None)
 
-class RecognizerCache(dict):
-    def __init__(self, cache_file, persist_interval=10):
         self._cache_file = cache_file
         self._persist_interval = persist_interval
         self._persist_counter = persist_interval
-        try:
-            with open(self._cache_file, "rb") as f:
-                super().__init__(pickle.load(f))
-        except FileNotFoundError:
-            super().__init__()
+        # Expired entries are dropped from the log when it is compacted
+        self._store = AppendOnlyCacheStore(cache_file, max_log_bytes=max_log_bytes, ttl=ttl)
+
+        # Limits for values kept in memory, entries are kept in the store regardless of eviction
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._ttl = ttl
+        # namespace -> {"max_entries": ..., "max_bytes": ...}
+        self._namespace_quotas = namespace_quotas or dict()
+
+        # namespace -> OrderedDict(key -> _LoadedEntry), oldest first
+        self._loaded = dict()
+        self._loaded_bytes = dict()
+        self._order_counter = itertools.count()
+        self._namespaces = dict()
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        return self._get(key, DEFAULT_NAMESPACE)
 
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        self._persist_cache_on_interval()
+        self._set(key, value, DEFAULT_NAMESPACE)
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._store.delete(key)
+            for namespace in self._loaded:
+                self._unload(namespace, key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return (key in self._store) and not self._is_expired(self._store.timestamp(key))
+
+    def __iter__(self):
+        return iter(self._live_keys())
+
+    def __len__(self):
+        return len(self._live_keys())
+
+    def _live_keys(self):
+        with self._lock:
+            if self._ttl is None:
+                return self._store.keys()
+            return [key for key, stored_at in self._store.timestamps().items() if not self._is_expired(stored_at)]
+
+    def namespace(self, namespace):
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = RecognizerCacheNamespace(self, namespace)
+            return self._namespaces[namespace]
+
+    def memory_usage(self):
+        with self._lock:
+            return {
+                namespace: (len(entries), self._loaded_bytes[namespace]) for namespace, entries in self._loaded.items()
+            }
+
+    def _get(self, key, namespace):
+        with self._lock:
+            entries = self._loaded.get(namespace)
+            entry = entries.get(key) if entries else None
+            if entry is not None:
+                if self._is_expired(entry.stored_at):
+                    self._unload(namespace, key)
+                    raise KeyError(key)
+                if self._policy == CACHE_POLICY_LRU:
+                    entry.order = next(self._order_counter)
+                    entries.move_to_end(key)
+                return entry.value
+
+            value, size, stored_at = self._store.get(key)
+            if self._is_expired(stored_at):
+                raise KeyError(key)
+            self._load(namespace, key, value, size, stored_at)
+            return value
+
+    def _set(self, key, value, namespace):
+        with self._lock:
+            size, stored_at = self._store.put(key, value)
+            self._load(namespace, key, value, size, stored_at)
+            self._persist_cache_on_interval()
+
+    def _is_expired(self, stored_at):
+        return (self._ttl is not None) and (time.time() - stored_at > self._ttl)
+
+    def _load(self, namespace, key, value, size, stored_at):
+        self._unload(namespace, key)
+        entries = self._loaded.setdefault(namespace, OrderedDict())
+        entries[key] = _LoadedEntry(value, size, stored_at, next(self._order_counter))
+        self._loaded_bytes[namespace] = self._loaded_bytes.get(namespace, 0) + size
+        self._evict(namespace)
+
+    def _unload(self, namespace, key):
+        entries = self._loaded.get(namespace)
+        if entries and key in entries:
+            entry = entries.pop(key)
+            self._loaded_bytes[namespace] -= entry.size
+
+    def _evict(self, namespace):
+        quota = self._namespace_quotas.get(namespace, dict())
+        while self._is_over_limit(
+            len(self._loaded[namespace]),
+            self._loaded_bytes[namespace],
+            quota.get("max_entries"),
+            quota.get("max_bytes"),
+        ):
+            self._evict_oldest(namespace)
+
+        while self._is_over_limit(
+            sum([len(entries) for entries in self._loaded.values()]),
+            sum(self._loaded_bytes.values()),
+            self._max_entries,
+            self._max_bytes,
+        ):
+            # Evict the least recently used (LRU) or the earliest loaded (TTL) entry across all namespaces
+            oldest_namespace = min(
+                [namespace for namespace, entries in self._loaded.items() if entries],
+                key=lambda namespace_internal: next(iter(self._loaded[namespace_internal].values())).order,
+            )
+            self._evict_oldest(oldest_namespace)
+
+    def _evict_oldest(self, namespace):
+        key = next(iter(self._loaded[namespace]))
+        self._unload(namespace, key)
+
+    @staticmethod
+    def _is_over_limit(entries, size, max_entries, max_bytes):
+        return (entries > 0) and (
+            ((max_entries is not None) and (entries > max_entries)) or ((max_bytes is not None) and (size > max_bytes))
+        )
 
     def _persist_cache_on_interval(self):
         self._persist_counter -= 1
@@ -27,11 +182,45 @@ class RecognizerCache(dict):
             self._persist_counter = self._persist_interval
 
     def persist_cache(self):
-        make_dirs(self._cache_file)
-        with open(self._cache_file, "wb") as f:
-            pickle.dump(dict(self), f)
+        # Entries are appended on write, persisting only flushes the log to disk
+        self._store.sync()
 
     def pickled_hashkey(*args, **kwargs):
         pickled_args = pickle.dumps(args)
         pickled_kwargs = pickle.dumps(kwargs)
         return cachetools.keys.hashkey(pickled_args, pickled_kwargs)
+
+    def content_hashkey(*args, content_sha256=None, ocr_version=None, **kwargs):
+        # OCR results are keyed by the PDF content and OCR version, not by the uri it was uploaded to
+        if content_sha256 is None:
+            return RecognizerCache.pickled_hashkey(*args, **kwargs)
+        return cachetools.keys.hashkey("content_sha256", ocr_version, content_sha256)
+
+
+# View of RecognizerCache used by one cached method, memory quotas are applied per namespace
+class RecognizerCacheNamespace(MutableMapping):
+    def __init__(self, cache, namespace):
+        self._cache = cache
+        self._namespace = namespace
+
+    def __getitem__(self, key):
+        return self._cache._get(key, self._namespace)
+
+    def __setitem__(self, key, value):
+        self._cache._set(key, value, self._namespace)
+
+    def __delitem__(self, key):
+        del self._cache[key]
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __iter__(self):
+        return iter(self._cache)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def cache_namespace(function_name):
+    return lambda self: None if self._cache is None else self._cache.namespace(function_name)
@@ -0,0 +1,251 @@
+import fcntl
+import os
+import pickle
+import struct
+import threading
+import time
+
+from labrep_recognizer.shared.pdf_parser_logging import get_logger
+from labrep_recognizer.shared.utils import make_dirs
+
+log = get_logger(__name__)
+
+LOG_MAGIC = b"RCLOG002"
+# Random id of the log written after the magic, a new one for each compacted log. Inode numbers of replaced files
+# are reused, so the id tells other processes the log was replaced.
+LOG_ID_SIZE = 16
+LOG_HEADER_SIZE = len(LOG_MAGIC) + LOG_ID_SIZE
+
+# key length, value length, timestamp, flags
+RECORD_HEADER = struct.Struct("<IQdB")
+RECORD_FLAG_TOMBSTONE = 1
+
+
+# Append-only key-value log with an in-memory offset index. Each record is written once at the end of the log,
+# on open only record headers and keys are read (values are skipped with seek), values are loaded lazily by key.
+# The log can be shared by several processes (e.g. gunicorn workers): writes are serialized with a lock file and
+# records appended by other processes are picked up on a cache miss. Once the log passes max_log_bytes and most of it
+# is overwritten, deleted or expired records, it is compacted into a new file; other processes notice the replaced
+# file by its new log id and index it again. A value that cannot be read back is a cache miss.
+class AppendOnlyCacheStore:
+    def __init__(self, log_file, max_log_bytes=None, ttl=None):
+        self._log_file = log_file
+        self._lock_file = log_file + ".lock"
+        self._lock = threading.RLock()
+        self._max_log_bytes = max_log_bytes
+        self._ttl = ttl
+        # key -> (value_offset, value_length, timestamp, record_length)
+        self._index = dict()
+        self._indexed_to = LOG_HEADER_SIZE
+        self._indexed_log_id = None
+        # Bytes of the records in the index, the rest of the log is garbage
+        self._live_bytes = 0
+        self._next_check_at = 0
+        make_dirs(self._log_file)
+        self._open_log()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._index:
+                self._refresh_index_if_changed()
+            return key in self._index
+
+    def keys(self):
+        with self._lock:
+            self._refresh_index_if_changed()
+            return list(self._index.keys())
+
+    def timestamps(self):
+        # key -> timestamp of the latest record
+        with self._lock:
+            self._refresh_index_if_changed()
+            return {key: entry[2] for key, entry in self._index.items()}
+
+    def timestamp(self, key):
+        with self._lock:
+            if key not in self._index:
+                self._refresh_index_if_changed()
+            return self._index[key][2]
+
+    def get(self, key):
+        with self._lock, open(self._lock_file, "a") as lock_file:
+            # Shared lock, the log is not replaced by a compaction while the value is read
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            self._reindex_if_replaced()
+            if key not in self._index:
+                self._refresh_index()
+            value_offset, value_length, timestamp, _ = self._index[key]
+            with open(self._log_file, "rb") as f:
+                f.seek(value_offset)
+                value_bytes = f.read(value_length)
+            try:
+                if len(value_bytes) < value_length:
+                    raise EOFError(f"{len(value_bytes)} of {value_length} bytes read")
+                return pickle.loads(value_bytes), value_length, timestamp
+            except Exception as e:
+                # Index does not match the log, it is read again and the value is a cache miss
+                log.warning(f"Cache value at {value_offset} of {self._log_file} not readable: {str(e)}")
+                self._reset_index()
+                raise KeyError(key)
+
+    def put(self, key, value):
+        value_bytes = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        timestamp = self._append(key, value_bytes, 0)
+        return len(value_bytes), timestamp
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._append(key, b"", RECORD_FLAG_TOMBSTONE)
+
+    def sync(self):
+        with self._lock:
+            with open(self._log_file, "ab") as f:
+                os.fsync(f.fileno())
+
+    def _open_log(self):
+        with self._lock, open(self._lock_file, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(self._log_file) or os.path.getsize(self._log_file) == 0:
+                with open(self._log_file, "wb") as f:
+                    f.write(self._new_log_header())
+            else:
+                with open(self._log_file, "rb") as f:
+                    magic = f.read(len(LOG_MAGIC))
+                if magic.startswith(LOG_MAGIC[:5]) and magic != LOG_MAGIC:
+                    # Log of an older format, the cache is filled again
+                    with open(self._log_file, "wb") as f:
+                        f.write(self._new_log_header())
+                elif magic != LOG_MAGIC:
+                    self._migrate_legacy_pickle()
+            self._refresh_index()
+            self._truncate_incomplete_tail()
+
+    def _migrate_legacy_pickle(self):
+        # Cache files written before the append-only log are a single pickled dict
+        legacy_file = self._log_file + ".legacy"
+        os.replace(self._log_file, legacy_file)
+        with open(legacy_file, "rb") as f:
+            legacy_cache = pickle.load(f)
+        with open(self._log_file, "wb") as f:
+            f.write(self._new_log_header())
+            for key, value in legacy_cache.items():
+                f.write(self._pack_record(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 0, time.time()))
+
+    @staticmethod
+    def _new_log_header():
+        return LOG_MAGIC + os.urandom(LOG_ID_SIZE)
+
+    def _read_log_id(self):
+        with open(self._log_file, "rb") as f:
+            return f.read(LOG_HEADER_SIZE)[len(LOG_MAGIC) :]
+
+    def _refresh_index_if_changed(self):
+        if self._read_log_id() != self._indexed_log_id or os.path.getsize(self._log_file) > self._indexed_to:
+            with open(self._lock_file, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+                self._reindex_if_replaced()
+                self._refresh_index()
+
+    def _reindex_if_replaced(self):
+        # Called while holding the lock file, the log was compacted by another process
+        if self._read_log_id() != self._indexed_log_id:
+            self._reset_index()
+
+    def _reset_index(self):
+        self._index = dict()
+        self._indexed_to = LOG_HEADER_SIZE
+        self._indexed_log_id = None
+        self._live_bytes = 0
+
+    def _truncate_incomplete_tail(self):
+        # Only called while holding the exclusive lock, so there is no write in progress
+        if os.path.getsize(self._log_file) > self._indexed_to:
+            with open(self._log_file, "r+b") as f:
+                f.truncate(self._indexed_to)
+
+    def _refresh_index(self):
+        with open(self._log_file, "rb") as f:
+            # Id and records are read from the same file, a log replaced meanwhile is noticed by the next check
+            log_id = f.read(LOG_HEADER_SIZE)[len(LOG_MAGIC) :]
+            if log_id != self._indexed_log_id:
+                self._reset_index()
+                self._indexed_log_id = log_id
+            f.seek(self._indexed_to)
+            while True:
+                record_offset = f.tell()
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                key_length, value_length, timestamp, flags = RECORD_HEADER.unpack(header)
+                key_bytes = f.read(key_length)
+                value_offset = f.tell()
+                f.seek(value_length, os.SEEK_CUR)
+                if len(key_bytes) < key_length or f.tell() > os.fstat(f.fileno()).st_size:
+                    # Incomplete record at the tail, e.g. interrupted write
+                    f.seek(record_offset)
+                    break
+                key = pickle.loads(key_bytes)
+                previous = self._index.pop(key, None)
+                if previous is not None:
+                    self._live_bytes -= previous[3]
+                if not flags & RECORD_FLAG_TOMBSTONE:
+                    record_length = f.tell() - record_offset
+                    self._index[key] = (value_offset, value_length, timestamp, record_length)
+                    self._live_bytes += record_length
+            self._indexed_to = f.tell()
+
+    @staticmethod
+    def _pack_record(key, value_bytes, flags, timestamp):
+        key_bytes = pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+        return RECORD_HEADER.pack(len(key_bytes), len(value_bytes), timestamp, flags) + key_bytes + value_bytes
+
+    def _append(self, key, value_bytes, flags):
+        timestamp = time.time()
+        record = self._pack_record(key, value_bytes, flags, timestamp)
+        with self._lock, open(self._lock_file, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Index records appended by other processes first, so the new record is the latest for its key
+            self._reindex_if_replaced()
+            self._refresh_index()
+            self._truncate_incomplete_tail()
+            with open(self._log_file, "ab") as f:
+                f.write(record)
+            self._refresh_index()
+            if self._needs_compaction():
+                self._compact()
+        return timestamp
+
+    def _needs_compaction(self):
+        # Live bytes exclude expired records, counting them scans the index, so it is repeated only after the log
+        # grew by another tenth
+        log_bytes = self._indexed_to
+        if (self._max_log_bytes is None) or (log_bytes <= self._max_log_bytes) or (log_bytes < self._next_check_at):
+            return False
+        self._next_check_at = log_bytes + log_bytes // 10
+        live_bytes = self._live_bytes
+        if self._ttl is not None:
+            now = time.time()
+            live_bytes -= sum([entry[3] for entry in self._index.values() if now - entry[2] > self._ttl])
+        return log_bytes > 2 * live_bytes
+
+    def _compact(self):
+        # Only called while holding the exclusive lock. Latest records of live keys are copied to a new log, which
+        # replaces the old one atomically.
+        compacted_file = self._log_file + ".compacting"
+        now = time.time()
+        with open(self._log_file, "rb") as f_in, open(compacted_file, "wb") as f_out:
+            f_out.write(self._new_log_header())
+            for value_offset, value_length, timestamp, record_length in sorted(self._index.values()):
+                if (self._ttl is not None) and (now - timestamp > self._ttl):
+                    continue
+                f_in.seek(value_offset + value_length - record_length)
+                f_out.write(f_in.read(record_length))
+        os.replace(compacted_file, self._log_file)
+        self._reindex_if_replaced()
+        self._refresh_index()
+        self._next_check_at = 0
@@ -0,0 +1,47 @@
+import contextlib
+import contextvars
+import threading
+
+ROUND_TRIP_GET_BUCKET = "get_bucket"
+ROUND_TRIP_UPLOAD = "upload"
+ROUND_TRIP_DOWNLOAD = "download"
+ROUND_TRIP_DELETE = "delete"
+ROUND_TRIP_OCR_GOOGLE = "ocr_google"
+ROUND_TRIP_OCR_ABBYY = "ocr_abbyy"
+
+# Counters of the enclosing count_round_trips() blocks, innermost last. Stage threads run in a copy of the request's
+# context, so their calls are counted for the request that started them.
+_round_trip_counters = contextvars.ContextVar("round_trip_counters", default=())
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict()
+
+    def add(self, operation):
+        with self._lock:
+            self._counts[operation] = self._counts.get(operation, 0) + 1
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def total(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+
+@contextlib.contextmanager
+def count_round_trips():
+    counter = RoundTripCounter()
+    token = _round_trip_counters.set(_round_trip_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _round_trip_counters.reset(token)
+
+
+def record_round_trip(operation):
+    for counter in _round_trip_counters.get():
+        counter.add(operation)
@@ -0,0 +1,179 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from labrep_recognizer.shared.pdf_parser_logging import get_logger
+from labrep_recognizer.shared.utils import environ_int
+
+log = get_logger(__name__)
+
+STAGE_BACKEND_ABBYY = "abbyy"
+STAGE_BACKEND_GOOGLE = "google"
+STAGE_BACKEND_LOCAL = "local"
+STAGE_BACKENDS = [STAGE_BACKEND_ABBYY, STAGE_BACKEND_GOOGLE, STAGE_BACKEND_LOCAL]
+
+# Concurrent stages per backend in one process, shared by all requests. The ABBYY workers are the only limit of
+# concurrent conversions sent to the single ABBYY server.
+DEFAULT_MAX_WORKERS = {
+    STAGE_BACKEND_ABBYY: 2,
+    STAGE_BACKEND_GOOGLE: 8,
+    STAGE_BACKEND_LOCAL: 4,
+}
+
+# Seconds, including the time a stage waits for a free worker
+DEFAULT_TIMEOUTS = {
+    STAGE_BACKEND_ABBYY: 600,
+    STAGE_BACKEND_GOOGLE: 300,
+    STAGE_BACKEND_LOCAL: 120,
+}
+
+_executors = dict()
+_executors_pid = None
+_executors_lock = threading.Lock()
+
+# time.monotonic() deadline of the stage run in the current context, None outside of stages
+_stage_deadline = contextvars.ContextVar("stage_deadline", default=None)
+
+
+# Short-circuited requests, stages skipped before they started, stages abandoned while running and seconds the
+# requests did not wait for the abandoned stages
+_short_circuit_metrics = {
+    "requests": 0,
+    "skipped_stages": 0,
+    "abandoned_stages": 0,
+    "saved_seconds": 0.0,
+}
+_short_circuit_metrics_lock = threading.Lock()
+
+
+class RecognitionStageError(Exception):
+    pass
+
+
+class RecognitionStageCancelled(RecognitionStageError):
+    pass
+
+
+def get_stage_executor(backend):
+    global _executors, _executors_pid
+
+    with _executors_lock:
+        # Executor threads do not survive fork
+        if _executors_pid != os.getpid():
+            _executors = dict()
+            _executors_pid = os.getpid()
+        if backend not in _executors:
+            _executors[backend] = ThreadPoolExecutor(
+                max_workers=get_stage_max_workers(backend),
+                thread_name_prefix=f"stage_{backend}",
+            )
+        return _executors[backend]
+
+
+def get_stage_max_workers(backend):
+    return environ_int(f"recognizer_{backend}_max_workers", DEFAULT_MAX_WORKERS[backend])
+
+
+def get_stage_timeout(backend):
+    return environ_int(f"recognizer_{backend}_timeout", DEFAULT_TIMEOUTS[backend])
+
+
+def get_stage_deadline():
+    return _stage_deadline.get()
+
+
+def get_short_circuit_metrics():
+    with _short_circuit_metrics_lock:
+        return dict(_short_circuit_metrics)
+
+
+def run_stages(stages, cancelled):
+    stage_group = StageGroup(cancelled)
+    for backend, function in stages:
+        stage_group.start(backend, function)
+    stage_group.wait()
+    return None
+
+
+# Stages of one request running concurrently on the backend executors, more stages can be started while waiting for
+# the first ones. The first failure or timeout is raised right away: stages not started yet are cancelled, running
+# stages are signalled with the cancelled event and left to finish in the background, their results are not used.
+class StageGroup:
+    def __init__(self, cancelled):
+        self._cancelled = cancelled
+        # future -> (backend, deadline)
+        self._futures = dict()
+
+    def start(self, backend, function):
+        # Stage runs in a copy of the request's context, e.g. its round trip counters, with its own deadline
+        deadline = time.monotonic() + get_stage_timeout(backend)
+        context = contextvars.copy_context()
+        context.run(_stage_deadline.set, deadline)
+        future = get_stage_executor(backend).submit(context.run, function)
+        self._futures[future] = (backend, deadline)
+
+    def restart(self, backend, function):
+        # Runs a finished stage of the backend again, e.g. with other parameters, wait() then waits for the new run
+        for future, (started_backend, _) in list(self._futures.items()):
+            if started_backend == backend:
+                assert future.done()
+                del self._futures[future]
+        self.start(backend, function)
+
+    def started(self):
+        return set([backend for backend, _ in self._futures.values()])
+
+    def wait(self, backends=None):
+        # Waits for the stages of the given backends (all by default), failures of other stages are raised as well
+        waited_for = [
+            future for future, (backend, _) in self._futures.items() if backends is None or backend in backends
+        ]
+        pending = set([future for future in self._futures.keys() if not future.done()])
+        try:
+            while True:
+                for future in self._futures.keys():
+                    if future.done() and not future.cancelled():
+                        future.result()
+                if all([future.done() for future in waited_for]):
+                    break
+                for future in pending:
+                    backend, deadline = self._futures[future]
+                    if deadline <= time.monotonic():
+                        raise RecognitionStageError(f"Stage {backend} timed out after {get_stage_timeout(backend)} s")
+                next_deadline = min([self._futures[future][1] for future in pending])
+                _, pending = wait(
+                    pending, timeout=max(0.0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED
+                )
+        except BaseException:
+            self._cancelled.set()
+            skipped = [self._futures[future][0] for future in pending if future.cancel()]
+            abandoned = [future for future in pending if not future.cancelled()]
+            _record_short_circuit(skipped, abandoned, self._futures)
+            raise
+        return None
+
+
+def _record_short_circuit(skipped, abandoned, futures):
+    failed_at = time.monotonic()
+    abandoned_backends = [futures[future][0] for future in abandoned]
+    log.info(f"Short-circuited recognition, skipped stages: {skipped}, abandoned stages: {abandoned_backends}")
+    with _short_circuit_metrics_lock:
+        _short_circuit_metrics["requests"] += 1
+        _short_circuit_metrics["skipped_stages"] += len(skipped)
+        _short_circuit_metrics["abandoned_stages"] += len(abandoned)
+
+    remaining = [len(abandoned)]
+
+    def abandoned_stage_done(_future):
+        # Time saved for the request is the time until its last abandoned stage would have been joined
+        with _short_circuit_metrics_lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                saved_seconds = time.monotonic() - failed_at
+                _short_circuit_metrics["saved_seconds"] += saved_seconds
+                log.info(f"Abandoned stages finished {saved_seconds:.3f} s after the request returned")
+
+    for future in abandoned:
+        future.add_done_callback(abandoned_stage_done)
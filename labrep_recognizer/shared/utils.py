@@ -1,8 +1,12 @@
 import hashlib
+import os
+import tempfile
 from pathlib import Path
 from dotenv import find_dotenv, load_dotenv
 import datetime
 
+DEFAULT_SPILL_TO_DISK_BYTES = 32 * 2**20
+
 
 def is_number(s):
     try:
@@ -32,6 +36,13 @@ def load_environment():
     # load_dotenv(find_dotenv(filename=".env.local"))
 
 
+def environ_int(name, default=None):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
 def split_cell(s, separator):
     found_at = s.find(separator)
     if found_at == -1:
@@ -51,12 +62,36 @@ def is_valid_iso_date_time_str(time_str):
 
 
 def file_to_sha256(file_name):
+    with open(file_name, "rb") as f:
+        return stream_to_sha256(f)
+
+
+def stream_to_sha256(stream):
+    # Hashed from the start, the stream is left rewound for the next reader
     buf_size = 65536
     sha256 = hashlib.sha256()
-    with open(file_name, "rb") as f:
-        while True:
-            data = f.read(buf_size)
-            if not data:
-                break
-            sha256.update(data)
+    stream.seek(0)
+    while True:
+        data = stream.read(buf_size)
+        if not data:
+            break
+        sha256.update(data)
+    stream.seek(0)
     return sha256.hexdigest()
+
+
+def transfer_stream_file(stream):
+    # Rewound file object under a spooled stream: the in-memory buffer or the spilled temporary file. The only use of
+    # the private SpooledTemporaryFile._file. The wrapper has readable(), seekable() and readinto(), needed by pikepdf,
+    # only from Python 3.11, and requests takes the body size from fileno(), which would spill an in-memory stream.
+    stream.seek(0)
+    if isinstance(stream, tempfile.SpooledTemporaryFile):
+        return stream._file
+    return stream
+
+
+def new_transfer_stream():
+    # Kept in memory, spilled to an anonymous temporary file above the threshold
+    return tempfile.SpooledTemporaryFile(
+        max_size=environ_int("recognizer_spill_to_disk_bytes", DEFAULT_SPILL_TO_DISK_BYTES)
+    )
@@ -3,20 +3,39 @@ import pandas as pd
 from labrep_recognizer.shared.pdf_parser_logging import get_logger
 
 import datetime
+import io
 import json
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import pikepdf
 
 from flask import Flask, render_template, request, send_from_directory
 
 from labrep_recognizer.normalization.normalization_revolab import normalize_result_to_revolab
-from labrep_recognizer.pipeline import process_single_pdf_in_gs, initialize_infrastructure
-from labrep_recognizer.shared.utils import make_dirs, file_to_sha256
+from labrep_recognizer.pipeline import process_single_pdf_in_gs, get_shared_infrastructure
+from labrep_recognizer.shared.utils import (
+    make_dirs,
+    environ_int,
+    new_transfer_stream,
+    stream_to_sha256,
+    transfer_stream_file,
+)
+from server.recognition_jobs import get_recognition_jobs, JOB_STATUS_PENDING
 
 log = get_logger(__name__)
 app = Flask(__name__)
 
+EXECUTION_LOGS_DIR = "./data/execution_logs"
+
+DEFAULT_BATCH_CONCURRENCY = 4
+
+_batch_executor = None
+_batch_executor_pid = None
+_batch_executor_lock = threading.Lock()
+
 
 @app.route("/")
 def hello():
@@ -49,14 +68,122 @@ def send_js(path):
 
 @app.route("/recognize", methods=["POST"])
 def recognize():
-    import uuid
+    request_json = request.json
+
+    print(f"Recognize API post from: {request.remote_addr}, json: {json.dumps(request_json, indent=4)}")
+
+    return recognize_request(request_json, request.remote_addr)
+
+
+@app.route("/recognize-async", methods=["POST"])
+def recognize_async():
+    request_json = request.json
+
+    print(f"Recognize-async API post from: {request.remote_addr}, json: {json.dumps(request_json, indent=4)}")
+
+    job_id = get_recognition_jobs().submit(recognize_request, request_json, request.remote_addr)
+    if job_id is None:
+        return {"jobStatus": "REJECTED", "errorText": "Too many recognition jobs in progress"}, 503
+    return {"jobId": job_id, "jobStatus": JOB_STATUS_PENDING}, 202
+
+
+@app.route("/recognize-async/<job_id>", methods=["GET"])
+def recognize_async_status(job_id):
+    job = get_recognition_jobs().get(job_id)
+    if job is None:
+        return {"jobId": job_id, "errorText": "Job not found"}, 404
+    return job
+
+
+@app.route("/recognize-batch", methods=["POST"])
+def recognize_batch():
+    request_json = request.json
+
+    print(f"Recognize-batch API post from: {request.remote_addr}, json: {json.dumps(request_json, indent=4)}")
 
+    return recognize_batch_request(request_json, request.remote_addr)
+
+
+def recognize_batch_request(request_json, remote_addr):
     date_time_utc = datetime.datetime.utcnow().isoformat(timespec="microseconds")
     uuid_srt = str(uuid.uuid4().hex)
 
-    request_json = request.json
+    files = request_json["files"]
+
+    # Same document submitted more than once is recognized once
+    unique_files = dict()
+    for file in files:
+        unique_files.setdefault(get_file_key(file), file)
+
+    parsing_statuses = dict(
+        zip(unique_files.keys(), get_batch_executor().map(recognize_file_safe, unique_files.values()))
+    )
+
+    batch_parsing_status = {
+        "results": [
+            {
+                "hashedName": file["hashedName"],
+                "hashSha256": file.get("hashSha256"),
+                "parsingStatus": parsing_statuses[get_file_key(file)],
+            }
+            for file in files
+        ]
+    }
+
+    write_execution_log(date_time_utc, uuid_srt, remote_addr, request_json, batch_parsing_status)
+
+    return batch_parsing_status
+
+
+def get_batch_executor():
+    # Shared by all batch requests of a worker process, so concurrent batches do not multiply the document concurrency.
+    # Executor threads do not survive fork, so it is created per worker process.
+    global _batch_executor, _batch_executor_pid
+
+    with _batch_executor_lock:
+        if _batch_executor is None or _batch_executor_pid != os.getpid():
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=environ_int("recognizer_batch_concurrency", DEFAULT_BATCH_CONCURRENCY),
+                thread_name_prefix="recognize_batch",
+            )
+            _batch_executor_pid = os.getpid()
+        return _batch_executor
+
+
+def write_execution_log(date_time_utc, uuid_srt, remote_addr, request_json, response):
+    execution_log = {
+        "date_time_utc": date_time_utc,
+        "uuid": uuid_srt,
+        "remote_addr": remote_addr,
+        "request": request_json,
+        "response": response,
+    }
+    log_file_name = os.path.join(EXECUTION_LOGS_DIR, f"{date_time_utc}_{uuid_srt}.json")
+    make_dirs(log_file_name)
+    with open(log_file_name, "w") as f:
+        json.dump(execution_log, f)
+
+
+def get_file_key(file):
+    return file.get("hashSha256") or file["hashedName"]
 
-    print(f"Recognize API post from: {request.remote_addr}, json: {json.dumps(request_json, indent=4)}")
+
+def recognize_file_safe(file):
+    # One failed document must not fail the whole batch
+    try:
+        return recognize_file(file)
+    except Exception as e:
+        log.exception(f"Recognition failed for {file['hashedName']}")
+        return {
+            "recognitionStatus": "ERROR",
+            "errorText": f"Recognition failed: {type(e).__name__} {str(e)}",
+            "recognizedTestResults": dict(),
+        }
+
+
+def recognize_request(request_json, remote_addr):
+    date_time_utc = datetime.datetime.utcnow().isoformat(timespec="microseconds")
+    uuid_srt = str(uuid.uuid4().hex)
 
     files = request_json["files"]
 
@@ -64,18 +191,27 @@ def recognize():
 
     file = files[0]
 
+    parsing_status = recognize_file(file)
+
+    write_execution_log(date_time_utc, uuid_srt, remote_addr, request_json, parsing_status)
+
+    return parsing_status
+
+
+def recognize_file(file):
     bucket_name = os.environ.get("recognizer_bucket_name")
     uploaded_file_uri = f"gs://{bucket_name}/{file['hashedName']}"
-    recognizer_infrastructure = initialize_infrastructure()
+    recognizer_infrastructure = get_shared_infrastructure()
 
     # Password removal
     password_removal = False
     uploaded_file_password_removed_uri = ""
+    content_sha256 = None
     if "passwordSecret" in file and file["passwordSecret"] is not None and file["passwordSecret"] != "":
         password_removal = True
         password_secret = file["passwordSecret"]
         log.info(f"Got request with password_secret: {password_secret}")
-        uploaded_file_password_removed_uri = remove_pdf_password(
+        uploaded_file_password_removed_uri, content_sha256 = remove_pdf_password(
             recognizer_infrastructure=recognizer_infrastructure,
             uploaded_file_uri=uploaded_file_uri,
             password_secret=password_secret,
@@ -84,7 +220,7 @@ def recognize():
         log.info(f"Password removal successful, new uri: {uploaded_file_uri}")
 
     recognition_ok, recognition_error, df_header, df_details = process_single_pdf_in_gs(
-        uploaded_file_uri, recognizer_infrastructure
+        uploaded_file_uri, recognizer_infrastructure, content_sha256
     )
 
     if password_removal:
@@ -122,18 +258,6 @@ def recognize():
             "recognizedTestResults": dict(),
         }
 
-    execution_log = {
-        "date_time_utc": date_time_utc,
-        "uuid": uuid_srt,
-        "remote_addr": request.remote_addr,
-        "request": request_json,
-        "response": parsing_status,
-    }
-    log_file_name = f"./data/execution_logs/{date_time_utc}_{uuid_srt}.json"
-    make_dirs(log_file_name)
-    with open(log_file_name, "w") as f:
-        json.dump(execution_log, f)
-
     return parsing_status
 
 
@@ -152,7 +276,7 @@ def recognize_diagnostic():
     file = files[0]
     uploaded_file_uri = f"gs://revolab-test.appspot.com/{file['hashedName']}"
 
-    recognizer_infrastructure = initialize_infrastructure()
+    recognizer_infrastructure = get_shared_infrastructure()
     recognition_ok, recognition_error, df_header, df_details = process_single_pdf_in_gs(
         uploaded_file_uri, recognizer_infrastructure
     )
@@ -188,31 +312,42 @@ def recognize_diagnostic():
 
 def remove_pdf_password(recognizer_infrastructure, uploaded_file_uri, password_secret):
     pdf_password = get_google_secret(recognizer_infrastructure.secret_manager_client, password_secret)
-    downloaded_pdf = recognizer_infrastructure.download_file_from_google_bucket(
-        uploaded_file_uri, "data/local_input_copy"
-    )
-    downloaded_pdf_password_removed = downloaded_pdf + "_password_removed"
-    remove_password(downloaded_pdf, downloaded_pdf_password_removed, pdf_password)
-    hash_password_removed = file_to_sha256(downloaded_pdf_password_removed)
-    target_file_name = "temp_passwd_removed/" + hash_password_removed + ".pdf"
-    uploaded_file_password_removed_uri = recognizer_infrastructure.upload_pdf_to_google_bucket(
-        downloaded_pdf_password_removed, target_file_name
-    )
-    uploaded_file_password_removed_uri
-    return uploaded_file_password_removed_uri
+    # Streamed, concurrent requests for the same file do not share local copies
+    with recognizer_infrastructure.download_stream_from_google_bucket(
+        uploaded_file_uri
+    ) as downloaded_pdf, new_transfer_stream() as downloaded_pdf_password_removed:
+        pdf_in = transfer_stream_file(downloaded_pdf)
+        # Written past the spooled wrapper, so the output is spilled up front when the input was
+        if not isinstance(pdf_in, io.BytesIO):
+            downloaded_pdf_password_removed.rollover()
+        remove_password(
+            pdf_in,
+            transfer_stream_file(downloaded_pdf_password_removed),
+            pdf_password,
+            pdf_in_name=uploaded_file_uri,
+        )
+        hash_password_removed = stream_to_sha256(downloaded_pdf_password_removed)
+        target_file_name = "temp_passwd_removed/" + hash_password_removed + ".pdf"
+        uploaded_file_password_removed_uri = recognizer_infrastructure.upload_stream_to_google_bucket(
+            downloaded_pdf_password_removed, target_file_name
+        )
+    return uploaded_file_password_removed_uri, hash_password_removed
 
 
 # TODO move to utils
-def remove_password(pdf_in, pdf_out, passwd):
+# File names or file objects (not SpooledTemporaryFile before Python 3.11), pdf_in_name is printed for a stream
+def remove_password(pdf_in, pdf_out, passwd, pdf_in_name=None):
     with pikepdf.open(
         pdf_in,
         password=passwd,
     ) as pdf:
         num_pages = len(pdf.pages)
-        pdf.save(pdf_out)
+        # Static /ID keeps the output identical for the same input, so it hits the same content addressed cache
+        pdf.save(pdf_out, static_id=True)
         print(f"{'-' * 100}")
-        print(f"removing passwrord from: {pdf_in}")
-        print(f"saving as:               {pdf_out}")
+        print(f"removing passwrord from: {pdf_in_name or pdf_in}")
+        if isinstance(pdf_out, str):
+            print(f"saving as:               {pdf_out}")
         print(f"pages: {num_pages}")
         print(f"{'-' * 100}")
     return None
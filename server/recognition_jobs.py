@@ -0,0 +1,160 @@
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from labrep_recognizer.shared.pdf_parser_logging import get_logger
+from labrep_recognizer.shared.utils import make_dirs, environ_int
+
+log = get_logger(__name__)
+
+JOB_STATUS_PENDING = "PENDING"
+JOB_STATUS_RUNNING = "RUNNING"
+JOB_STATUS_DONE = "DONE"
+JOB_STATUS_ERROR = "ERROR"
+
+JOBS_DIR = "./data/recognition_jobs"
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_QUEUED = 64
+# Job files are removed a day after their last update
+DEFAULT_JOB_TTL = 24 * 60 * 60
+
+_recognition_jobs = None
+_recognition_jobs_pid = None
+_recognition_jobs_lock = threading.Lock()
+
+
+# Runs recognition jobs in a bounded background executor. Job status is kept in files, so the status request can be
+# answered by any worker process, not only the one running the job.
+class RecognitionJobs:
+    def __init__(self, max_workers, max_queued, jobs_dir=JOBS_DIR, job_ttl=DEFAULT_JOB_TTL):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recognition_job")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._jobs_dir = jobs_dir
+        self._job_ttl = job_ttl
+        self._cleaned_at = 0.0
+        self._cleanup_lock = threading.Lock()
+
+    def submit(self, function, *args):
+        # Returns None when too many jobs are already running or queued
+        self._remove_expired_jobs()
+        if not self._slots.acquire(blocking=False):
+            return None
+        job_id = uuid.uuid4().hex
+        try:
+            self._write_job(job_id, JOB_STATUS_PENDING)
+            self._executor.submit(self._run_job, job_id, function, *args)
+        except Exception:
+            # Not queued, e.g. status not written or executor shut down
+            self._slots.release()
+            self._remove_job(job_id)
+            raise
+        return job_id
+
+    def get(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._job_file_name(job_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _run_job(self, job_id, function, *args):
+        try:
+            try:
+                self._write_job(job_id, JOB_STATUS_RUNNING)
+            except Exception as e:
+                # Not run, the job must not stay pending
+                log.exception(f"Recognition job {job_id} status could not be written")
+                job_status, parsing_status = JOB_STATUS_ERROR, self._error_status(e)
+            else:
+                job_status, parsing_status = self._run_function(job_id, function, *args)
+        finally:
+            # Free the slot before the final status is visible, so a finished job never blocks a new one
+            self._slots.release()
+        try:
+            self._write_job(job_id, job_status, parsing_status)
+        except Exception as e:
+            # E.g. the parsing status is not serializable, the job must not stay running
+            log.exception(f"Recognition job {job_id} result could not be written")
+            self._write_job(job_id, JOB_STATUS_ERROR, self._error_status(e))
+
+    @classmethod
+    def _run_function(cls, job_id, function, *args):
+        try:
+            return JOB_STATUS_DONE, function(*args)
+        except Exception as e:
+            log.exception(f"Recognition job {job_id} failed")
+            return JOB_STATUS_ERROR, cls._error_status(e)
+
+    @staticmethod
+    def _error_status(e):
+        return {
+            "recognitionStatus": "ERROR",
+            "errorText": f"Recognition failed: {type(e).__name__} {str(e)}",
+            "recognizedTestResults": dict(),
+        }
+
+    def _remove_expired_jobs(self):
+        # At most once per tenth of the TTL, job files of all worker processes are in the same directory
+        with self._cleanup_lock:
+            if time.time() - self._cleaned_at < self._job_ttl / 10:
+                return
+            self._cleaned_at = time.time()
+        try:
+            file_names = os.listdir(self._jobs_dir)
+        except FileNotFoundError:
+            return
+        for file_name in file_names:
+            job_file_name = os.path.join(self._jobs_dir, file_name)
+            try:
+                if time.time() - os.path.getmtime(job_file_name) > self._job_ttl:
+                    os.remove(job_file_name)
+            except FileNotFoundError:
+                # Removed by another worker process
+                pass
+
+    def _write_job(self, job_id, job_status, parsing_status=None):
+        job = {
+            "jobId": job_id,
+            "jobStatus": job_status,
+            "updated": datetime.datetime.utcnow().isoformat(timespec="milliseconds") + "Z",
+            "parsingStatus": parsing_status,
+        }
+        job_file_name = self._job_file_name(job_id)
+        make_dirs(job_file_name)
+        # Write and rename, so a status request never reads a partially written file
+        with open(job_file_name + ".tmp", "w") as f:
+            json.dump(job, f)
+        os.replace(job_file_name + ".tmp", job_file_name)
+
+    def _remove_job(self, job_id):
+        try:
+            os.remove(self._job_file_name(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _job_file_name(self, job_id):
+        return os.path.join(self._jobs_dir, f"{job_id}.json")
+
+
+def get_recognition_jobs():
+    # Executor threads do not survive fork, so jobs are created per worker process
+    global _recognition_jobs, _recognition_jobs_pid
+
+    with _recognition_jobs_lock:
+        if _recognition_jobs is None or _recognition_jobs_pid != os.getpid():
+            _recognition_jobs = RecognitionJobs(
+                max_workers=environ_int("recognizer_jobs_max_workers", DEFAULT_MAX_WORKERS),
+                max_queued=environ_int("recognizer_jobs_max_queued", DEFAULT_MAX_QUEUED),
+                job_ttl=environ_int("recognizer_jobs_ttl", DEFAULT_JOB_TTL),
+            )
+            _recognition_jobs_pid = os.getpid()
+        return _recognition_jobs
@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import time
+import timeit
+import tracemalloc
+from copy import copy
+
+import numpy as np
+import pandas as pd
+import mock
+from openpyxl import load_workbook
+
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import (
+    read_abbyy_xlsx,
+    read_abbyy_output,
+    ABBYY_OUTPUT_CSV,
+    ABBYY_OUTPUT_XLSX,
+)
+from labrep_recognizer.recognition_tools.abbyy_tools import AbbyyTools
+from labrep_recognizer.recognizer_infrastructure import RecognizerInfrastructure
+from tests.synthetic_abbyy_sheet import (
+    synthetic_abbyy_sheet,
+    synthetic_abbyy_xlsx,
+    synthetic_abbyy_csv,
+    HEADER_KEYWORDS,
+)
+
+REPEAT = 2
+
+# Simulated Cloud Storage download from the ABBYY output bucket: request latency plus the file size at the bandwidth
+BUCKET_NAME = "benchmark-bucket"
+BUCKET_LATENCY_SECONDS = 0.05
+BUCKET_BYTES_PER_SECOND = 20 * 2**20
+
+
+# Whole sheet scan per search string as before the cell text index
+def find_all_at_offset_scan(df_extract, search_strings, offset_x, offset_y):
+    found_values = []
+    for search_string in search_strings:
+        found_at = np.where(df_extract.applymap(lambda cell: search_string in cell).to_numpy())
+        for i in range(len(found_at[0])):
+            found_values.append(df_extract.iloc[found_at[0][i] + offset_y, found_at[1][i] + offset_x])
+    return sorted(list(set(found_values)))
+
+
+def find_till_the_end_in_list(search_string, fields, remove):
+    found_at = [i for i, field in enumerate(fields) if search_string in field][0]
+    found_inside_at = fields[found_at].find(search_string)
+    found_value = fields[found_at][found_inside_at + len(search_string) :].strip()
+    if remove:
+        fields[found_at] = fields[found_at][:found_inside_at]
+    return found_value
+
+
+# Copy of all fields per lookup as before the removed span overlay
+def find_between_keywords_copy(fields, before, after):
+    fields_copy = copy(fields)
+    _ = find_till_the_end_in_list(after, fields_copy, remove=True)
+    return find_till_the_end_in_list(before, fields_copy, remove=False)
+
+
+def benchmark_find_between_keywords():
+    for pages in [1, 10, 50]:
+        df_extract = synthetic_abbyy_sheet(pages=pages, rows=60, columns=8)
+        abbyy_tools = AbbyyTools(df_extract)
+        fields = list(sorted(set(df_extract.to_numpy().flatten())))
+        keywords = [(keyword.split(" ")[0][:-1], ":") for keyword in HEADER_KEYWORDS] * 20
+
+        def copying():
+            for before, after in keywords:
+                find_between_keywords_copy(fields, before, after)
+
+        def overlay():
+            for before, after in keywords:
+                abbyy_tools.find_between_keywords(before, after)
+
+        copy_seconds = min(timeit.repeat(copying, number=1, repeat=REPEAT))
+        overlay_seconds = min(timeit.repeat(overlay, number=1, repeat=REPEAT))
+        print(
+            f"between keywords pages: {pages:3d} fields: {len(fields):7d} copy: {copy_seconds * 1000:9.1f} ms "
+            f"overlay: {overlay_seconds * 1000:9.1f} ms speedup: {copy_seconds / overlay_seconds:6.1f}x"
+        )
+
+
+def main():
+    # Header extraction looks up each keyword once
+    for pages in [1, 10, 50]:
+        df_extract = synthetic_abbyy_sheet(pages=pages, rows=60, columns=8)
+
+        def scan():
+            for keyword in HEADER_KEYWORDS:
+                find_all_at_offset_scan(df_extract, [keyword], 0, 0)
+
+        def indexed():
+            # Index is built once per sheet, included in the measurement
+            abbyy_tools = AbbyyTools(df_extract)
+            for keyword in HEADER_KEYWORDS:
+                abbyy_tools.find_all_at_offset([keyword], 0, 0)
+
+        scan_seconds = min(timeit.repeat(scan, number=1, repeat=REPEAT))
+        indexed_seconds = min(timeit.repeat(indexed, number=1, repeat=REPEAT))
+        print(
+            f"pages: {pages:3d} cells: {df_extract.size:7d} scan: {scan_seconds * 1000:9.1f} ms "
+            f"indexed: {indexed_seconds * 1000:9.1f} ms speedup: {scan_seconds / indexed_seconds:6.1f}x"
+        )
+
+
+# Loaded workbook modified in place as before the streaming reader
+def read_fix_excel_loaded(file_name, sheet_name):
+    wb = load_workbook(file_name, data_only=True)
+    sh = wb[sheet_name]
+    for row in sh:
+        for cell in row:
+            if cell.number_format == "#,##0" and cell.value is not None:
+                value = cell.value
+                cell.number_format = "General"
+                cell.value = f"{value:,}"
+    return pd.DataFrame(sh.values)
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark_read_xlsx():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for pages in [1, 10, 50]:
+            file_name = os.path.join(temp_dir, f"ocred_{pages}.xlsx")
+            synthetic_abbyy_xlsx(file_name, pages=pages, rows=60, columns=8)
+
+            def loaded():
+                return read_fix_excel_loaded(file_name, "Sheet1").fillna("").astype(str)
+
+            def streamed():
+                return read_abbyy_xlsx(file_name, "Sheet1").fillna("").astype(str)
+
+            loaded_seconds = min(timeit.repeat(loaded, number=1, repeat=REPEAT))
+            streamed_seconds = min(timeit.repeat(streamed, number=1, repeat=REPEAT))
+            print(
+                f"read xlsx pages: {pages:3d} loaded: {loaded_seconds * 1000:9.1f} ms "
+                f"{peak_memory(loaded) / 2**20:7.1f} MiB streamed: {streamed_seconds * 1000:9.1f} ms "
+                f"{peak_memory(streamed) / 2**20:7.1f} MiB speedup: {loaded_seconds / streamed_seconds:6.1f}x"
+            )
+
+
+# Stand-in for the Cloud Storage client, blobs are local files of the real output size
+class SimulatedBlob:
+    def __init__(self, file_name):
+        self._file_name = file_name
+
+    def download_to_filename(self, file_name):
+        time.sleep(BUCKET_LATENCY_SECONDS + os.path.getsize(self._file_name) / BUCKET_BYTES_PER_SECOND)
+        shutil.copyfile(self._file_name, file_name)
+
+
+class SimulatedBucket:
+    def __init__(self, blobs_dir):
+        self.name = BUCKET_NAME
+        self._blobs_dir = blobs_dir
+
+    def blob(self, blob_name):
+        return SimulatedBlob(os.path.join(self._blobs_dir, blob_name))
+
+
+class SimulatedStorageClient:
+    def __init__(self, blobs_dir):
+        self._blobs_dir = blobs_dir
+
+    def get_bucket(self, bucket_name):
+        return SimulatedBucket(self._blobs_dir)
+
+
+def benchmark_output_types():
+    # ABBYY output downloaded from the bucket and loaded into AbbyyTools, as run_abbyy does after the conversion
+    with tempfile.TemporaryDirectory() as blobs_dir, tempfile.TemporaryDirectory() as ocred_dir, mock.patch.dict(
+        os.environ, {"recognizer_bucket_name": BUCKET_NAME}
+    ):
+        infrastructure = RecognizerInfrastructure("project", None, "http://abbyy", None)
+        infrastructure.storage_client = SimulatedStorageClient(blobs_dir)
+        for pages in [1, 10, 50]:
+            results = []
+            for output_type, extension, write in [
+                (ABBYY_OUTPUT_XLSX, "xlsx", synthetic_abbyy_xlsx),
+                (ABBYY_OUTPUT_CSV, "csv", synthetic_abbyy_csv),
+            ]:
+                blob_name = f"ocred_{pages}.{extension}"
+                write(os.path.join(blobs_dir, blob_name), pages=pages, rows=60, columns=8)
+
+                def download():
+                    return infrastructure.download_file_from_google_bucket(f"gs://{BUCKET_NAME}/{blob_name}", ocred_dir)
+
+                def download_load():
+                    return AbbyyTools(read_abbyy_output(download(), output_type).fillna("").astype(str))
+
+                download_seconds = min(timeit.repeat(download, number=1, repeat=REPEAT))
+                seconds = min(timeit.repeat(download_load, number=1, repeat=REPEAT))
+                results.append(
+                    f"{extension}: {os.path.getsize(os.path.join(blobs_dir, blob_name)) / 1024:8.1f} KiB "
+                    f"download: {download_seconds * 1000:8.1f} ms total: {seconds * 1000:8.1f} ms"
+                )
+            print(f"output types pages: {pages:3d} " + " ".join(results))
+
+
+if __name__ == "__main__":
+    main()
+    benchmark_find_between_keywords()
+    benchmark_read_xlsx()
+    benchmark_output_types()
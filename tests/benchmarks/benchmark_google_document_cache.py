@@ -0,0 +1,51 @@
+import os
+import tempfile
+import timeit
+
+from google.cloud.documentai_v1beta2 import Document
+
+from labrep_recognizer.shared.document_serialization import (
+    document_to_compressed_proto,
+    document_from_compressed_proto,
+)
+from labrep_recognizer.shared.recognizer_cache import RecognizerCache
+from tests.synthetic_google_document import synthetic_google_document
+
+REPEAT = 5
+
+
+def benchmark_format(name, document, serialize, deserialize, temp_dir):
+    cache_file = os.path.join(temp_dir, f"{name}.cache")
+    cache = RecognizerCache(cache_file, 0)
+    cache["document"] = serialize(document)
+
+    # Warm cache hit in a new worker: read from the store and rehydrate the Document
+    def cache_hit():
+        deserialize(RecognizerCache(cache_file, 0)["document"])
+
+    hit_seconds = min(timeit.repeat(cache_hit, number=1, repeat=REPEAT))
+    assert deserialize(cache["document"]).text == document.text
+    return os.path.getsize(cache_file), hit_seconds
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for pages in [1, 4, 10]:
+            document = synthetic_google_document(pages=pages)
+            results = [
+                ("json", *benchmark_format("json", document, Document.to_json, Document.from_json, temp_dir)),
+                (
+                    "proto_zstd",
+                    *benchmark_format(
+                        "proto_zstd", document, document_to_compressed_proto, document_from_compressed_proto, temp_dir
+                    ),
+                ),
+            ]
+            for name, size, hit_seconds in results:
+                print(
+                    f"pages: {pages:3d} format: {name:10s} on disk: {size / 1024:10.1f} KiB hit: {hit_seconds * 1000:8.1f} ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
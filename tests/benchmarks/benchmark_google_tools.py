@@ -0,0 +1,134 @@
+import timeit
+
+from shapely.geometry import Point, Polygon
+
+from labrep_recognizer.recognition_tools.google_tools import GoogleTools
+from tests.synthetic_google_document import synthetic_google_document
+
+REPEAT = 2
+QUERIES = 100
+
+
+# Page scans as before the spatial index
+def find_token_to_right_scan(page, search_from_token, boundary_x):
+    scan_start_x = search_from_token.layout.bounding_poly.normalized_vertices[1].x - 0.001
+    scan_start_y = (
+        search_from_token.layout.bounding_poly.normalized_vertices[1].y
+        + search_from_token.layout.bounding_poly.normalized_vertices[2].y
+    ) / 2
+    return [
+        token
+        for token in page.tokens
+        if (token.layout.bounding_poly.normalized_vertices[0].x > scan_start_x)
+        and (token.layout.bounding_poly.normalized_vertices[0].x < boundary_x)
+        and (token.layout.bounding_poly.normalized_vertices[0].y < scan_start_y)
+        and (token.layout.bounding_poly.normalized_vertices[3].y > scan_start_y)
+    ]
+
+
+def find_tokens_in_box_scan(page, box):
+    polygon = Polygon(box)
+    return [
+        token
+        for token in page.tokens
+        if all([polygon.contains(Point(v.x, v.y)) for v in token.layout.bounding_poly.normalized_vertices])
+    ]
+
+
+def is_same_row_shapely(token_1, token_2):
+    def height(token):
+        v = token.layout.bounding_poly.normalized_vertices
+        return (
+            Point(v[0].x, v[0].y).distance(Point(v[3].x, v[3].y))
+            + Point(v[1].x, v[1].y).distance(Point(v[2].x, v[2].y))
+        ) / 2.0
+
+    tokens = sorted([token_1, token_2], key=height)
+    y_small_0 = tokens[0].layout.bounding_poly.normalized_vertices[0].y
+    y_small_1 = tokens[0].layout.bounding_poly.normalized_vertices[3].y
+    y_large_sorted = sorted(
+        [
+            tokens[1].layout.bounding_poly.normalized_vertices[0].y,
+            tokens[1].layout.bounding_poly.normalized_vertices[3].y,
+        ]
+    )
+    y_small_fit_0 = y_small_0 + ((y_small_1 - y_small_0) * 0.25)
+    y_small_fit_1 = y_small_1 - ((y_small_1 - y_small_0) * 0.25)
+    return (y_large_sorted[0] < y_small_fit_0 < y_large_sorted[1]) and (
+        y_large_sorted[0] < y_small_fit_1 < y_large_sorted[1]
+    )
+
+
+def organize_tokens_box_shapely(tokens):
+    lines = []
+    tokens = sorted(tokens, key=(lambda token_internal: token_internal.layout.bounding_poly.normalized_vertices[0].x))
+    token_is_available = [True] * len(tokens)
+    while any(token_is_available):
+        available_range = [i for i, x in enumerate(token_is_available) if x]
+        token_from = tokens[available_range[0]]
+        lines.append([])
+        for i in available_range:
+            if is_same_row_shapely(token_from, tokens[i]):
+                lines[-1].append(tokens[i])
+                token_is_available[i] = False
+    return sorted(lines, key=(lambda line: line[0].layout.bounding_poly.normalized_vertices[0].y))
+
+
+def benchmark_organize_tokens_box():
+    # Header field sized boxes, tokens taken from the token table as in the header extraction
+    for rows, columns in [(5, 4), (20, 8), (40, 12)]:
+        document = synthetic_google_document(pages=1, rows=rows, columns=columns)
+        google_tools = GoogleTools(document)
+        tokens = google_tools.get_page_tokens(0)
+        shapely_seconds = min(timeit.repeat(lambda: organize_tokens_box_shapely(tokens), number=1, repeat=REPEAT))
+        table_seconds = min(timeit.repeat(lambda: google_tools.organize_tokens_box(tokens), number=1, repeat=REPEAT))
+        print(
+            f"organize tokens: {len(tokens):6d} shapely: {shapely_seconds * 1000:9.1f} ms "
+            f"token table: {table_seconds * 1000:9.1f} ms speedup: {shapely_seconds / table_seconds:6.1f}x"
+        )
+
+
+def main():
+    for rows, columns in [(60, 8), (150, 12), (300, 16)]:
+        document = synthetic_google_document(pages=1, rows=rows, columns=columns)
+        page = document.pages[0]
+        tokens = list(page.tokens)
+        queries = [tokens[i * len(tokens) // QUERIES] for i in range(QUERIES)]
+        box = [(0.3, 0.3), (0.6, 0.3), (0.6, 0.5), (0.3, 0.5)]
+
+        def scan():
+            for token in queries:
+                find_token_to_right_scan(page, token, 1.0)
+            find_tokens_in_box_scan(page, box)
+
+        def indexed():
+            # Index is built once per document, included in the measurement
+            google_tools = GoogleTools(document)
+            for token in queries:
+                google_tools.gd_find_token_to_right(0, token, 1.0)
+            google_tools.gd_find_tokens_in_box(0, box)
+
+        scan_seconds = min(timeit.repeat(scan, number=1, repeat=REPEAT))
+        indexed_seconds = min(timeit.repeat(indexed, number=1, repeat=REPEAT))
+        print(
+            f"tokens: {len(tokens):6d} queries: {QUERIES} scan: {scan_seconds * 1000:9.1f} ms "
+            f"indexed: {indexed_seconds * 1000:9.1f} ms speedup: {scan_seconds / indexed_seconds:6.1f}x"
+        )
+
+
+def benchmark_page_lines():
+    # Whole page line clustering, too slow for the pairwise algorithm on large pages
+    for rows, columns in [(60, 8), (150, 12), (300, 16)]:
+        document = synthetic_google_document(pages=1, rows=rows, columns=columns)
+        google_tools = GoogleTools(document)
+        tokens = google_tools.get_page_tokens(0)
+        seconds = min(timeit.repeat(lambda: google_tools.organize_tokens_box(tokens), number=1, repeat=REPEAT))
+        lines = google_tools.organize_tokens_box(tokens)
+        assert len(lines) == rows
+        print(f"page lines tokens: {len(tokens):6d} lines: {len(lines):4d} sweep: {seconds * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
+    benchmark_organize_tokens_box()
+    benchmark_page_lines()
@@ -0,0 +1,50 @@
+import csv
+import random
+
+import pandas as pd
+from openpyxl import Workbook
+
+HEADER_KEYWORDS = ["Pacientas:", "Gimimo data:", "Mėginys paimtas:", "Užsakymo nr.:", "Gydytojas:"]
+
+
+def synthetic_abbyy_sheet(pages=2, rows=60, columns=8, seed=0):
+    # ABBYY spreadsheet like frame of strings: a header block with "keyword value" cells on every page, then result
+    # rows with empty cells in between
+    rnd = random.Random(seed)
+    sheet = []
+    for page_index in range(pages):
+        for keyword in HEADER_KEYWORDS:
+            sheet.append([f"{keyword} v{page_index}_{rnd.randint(0, 999)}"] + [""] * (columns - 1))
+        for row in range(rows):
+            sheet.append(
+                [
+                    (
+                        ""
+                        if rnd.random() < 0.2
+                        else f"c{page_index}_{row}_{column}_" + "".join(rnd.choice("abcdefghijklm") for _ in range(5))
+                    )
+                    for column in range(columns)
+                ]
+            )
+    return pd.DataFrame(sheet)
+
+
+def synthetic_abbyy_xlsx(file_name, pages=2, rows=60, columns=8, seed=0):
+    # Synthetic sheet saved as ABBYY xlsx output, numeric result columns with the thousands number format
+    rnd = random.Random(seed)
+    wb = Workbook()
+    sh = wb.active
+    sh.title = "Sheet1"
+    for row in synthetic_abbyy_sheet(pages=pages, rows=rows, columns=columns, seed=seed).itertuples(index=False):
+        sh.append([None if cell == "" else cell for cell in row] + [rnd.randint(0, 100000), rnd.random() * 100])
+        sh.cell(row=sh.max_row, column=columns + 1).number_format = "#,##0"
+    wb.save(file_name)
+
+
+def synthetic_abbyy_csv(file_name, pages=2, rows=60, columns=8, seed=0):
+    # Same cells as synthetic_abbyy_xlsx written as ABBYY CSV output, numbers as the recognized text
+    rnd = random.Random(seed)
+    with open(file_name, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        for row in synthetic_abbyy_sheet(pages=pages, rows=rows, columns=columns, seed=seed).itertuples(index=False):
+            writer.writerow(list(row) + [f"{rnd.randint(0, 100000):,}", str(rnd.random() * 100)])
@@ -0,0 +1,56 @@
+import random
+
+from google.cloud.documentai_v1beta2 import Document, types
+
+
+def synthetic_google_document(pages=2, rows=60, columns=8, seed=0, vertex_jitter=0.0):
+    # Dense multi-column lab report like layout: one token per cell, rows slightly skewed. Vertex jitter (relative to
+    # the row height) makes token boxes irregular quadrilaterals.
+    rnd = random.Random(seed)
+    text = ""
+    document_pages = []
+    row_height = 0.9 / rows
+    column_width = 0.9 / columns
+    for page_index in range(pages):
+        tokens = []
+        for row in range(rows):
+            skew = rnd.uniform(-0.1, 0.1) * row_height
+            for column in range(columns):
+                word = f"w{page_index}_{row}_{column}_" + "".join(rnd.choice("abcdefghijklm") for _ in range(5))
+                start_index = len(text)
+                text += word + (" " if column < columns - 1 else "\n")
+                x_0 = 0.05 + column * column_width
+                x_1 = x_0 + column_width * 0.8
+                y_0 = 0.05 + row * row_height + skew
+                y_1 = y_0 + row_height * 0.7
+                tokens.append(
+                    Document.Page.Token(
+                        layout=Document.Page.Layout(
+                            text_anchor=Document.TextAnchor(
+                                text_segments=[
+                                    Document.TextAnchor.TextSegment(
+                                        start_index=start_index, end_index=start_index + len(word)
+                                    )
+                                ]
+                            ),
+                            confidence=rnd.uniform(0.8, 1.0),
+                            bounding_poly=types.BoundingPoly(
+                                normalized_vertices=[
+                                    types.NormalizedVertex(
+                                        x=x + rnd.uniform(-vertex_jitter, vertex_jitter) * row_height,
+                                        y=y + rnd.uniform(-vertex_jitter, vertex_jitter) * row_height,
+                                    )
+                                    for x, y in [(x_0, y_0), (x_1, y_0), (x_1, y_1), (x_0, y_1)]
+                                ]
+                            ),
+                        )
+                    )
+                )
+        document_pages.append(
+            Document.Page(
+                page_number=page_index + 1,
+                dimension=Document.Page.Dimension(width=1654, height=2339, unit="pixels"),
+                tokens=tokens,
+            )
+        )
+    return Document(text=text, pages=document_pages)
@@ -0,0 +1,81 @@
+import os
+import time
+import unittest
+
+import mock
+import requests
+
+from labrep_recognizer.shared.abbyy_client import AbbyyClient
+from labrep_recognizer.shared.round_trips import count_round_trips
+
+
+def response(status_code):
+    response_mock = mock.Mock()
+    response_mock.status_code = status_code
+    return response_mock
+
+
+class AbbyyClientTestCase(unittest.TestCase):
+    def setUp(self):
+        environ = {
+            "recognizer_abbyy_max_retries": "2",
+            "recognizer_abbyy_retry_backoff_ms": "0",
+        }
+        with mock.patch.dict(os.environ, environ):
+            self.client = AbbyyClient("http://abbyy/convert")
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_retries_connection_errors(self):
+        responses = [response(503), response(200)]
+        with mock.patch.object(
+            self.client._session,
+            "post",
+            side_effect=[requests.exceptions.ConnectionError("refused")] + responses,
+        ) as post, count_round_trips() as round_trips:
+            self.assertEqual(200, self.client.post({"languages": "English"}).status_code)
+        self.assertEqual(3, post.call_count)
+        self.assertEqual({"ocr_abbyy": 3}, round_trips.counts())
+        # Retried responses are closed, the returned one is left to the caller
+        self.assertEqual([True, False], [response.close.called for response in responses])
+        self.assertEqual((10, 540), post.call_args.kwargs["timeout"])
+
+    def test_retries_are_bounded(self):
+        with mock.patch.object(self.client._session, "post", return_value=response(502)) as post:
+            self.assertEqual(502, self.client.post({}).status_code)
+        self.assertEqual(3, post.call_count)
+
+        with mock.patch.object(
+            self.client._session, "post", side_effect=requests.exceptions.ConnectionError("refused")
+        ) as post:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.client.post({})
+        self.assertEqual(3, post.call_count)
+
+    def test_no_retry_on_read_timeout_or_client_error(self):
+        with mock.patch.object(self.client._session, "post", side_effect=requests.exceptions.ReadTimeout()) as post:
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                self.client.post({})
+        self.assertEqual(1, post.call_count)
+
+        with mock.patch.object(self.client._session, "post", return_value=response(400)) as post:
+            self.assertEqual(400, self.client.post({}).status_code)
+        self.assertEqual(1, post.call_count)
+
+    def test_read_timeout_capped_by_deadline(self):
+        with mock.patch.object(self.client._session, "post", return_value=response(200)) as post:
+            self.client.post({}, deadline=time.monotonic() + 100)
+        self.assertLessEqual(post.call_args.kwargs["timeout"][1], 100)
+
+    def test_no_retry_near_deadline(self):
+        # Less time left than the connect timeout of another attempt
+        with mock.patch.object(self.client._session, "post", return_value=response(503)) as post:
+            self.assertEqual(503, self.client.post({}, deadline=time.monotonic() + 5).status_code)
+        self.assertEqual(1, post.call_count)
+
+    def test_deadline_passed(self):
+        with mock.patch.object(self.client._session, "post") as post:
+            with self.assertRaises(requests.exceptions.Timeout):
+                self.client.post({}, deadline=time.monotonic() - 1)
+        self.assertEqual(0, post.call_count)
@@ -0,0 +1,95 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import (
+    read_abbyy_xlsx,
+    read_abbyy_csv,
+    read_abbyy_output,
+    ABBYY_OUTPUT_CSV,
+    ABBYY_OUTPUT_XLSX,
+)
+from tests.synthetic_abbyy_sheet import synthetic_abbyy_xlsx, synthetic_abbyy_csv
+
+
+# Loaded workbook modified in place as before the streaming reader, except that formatted empty cells are skipped (they
+# failed with TypeError)
+def read_fix_excel_loaded(file_name, sheet_name):
+    wb = load_workbook(file_name, data_only=True)
+    sh = wb[sheet_name]
+    for row in sh:
+        for cell in row:
+            if cell.number_format == "#,##0" and cell.value is not None:
+                value = cell.value
+                cell.number_format = "General"
+                cell.value = f"{value:,}"
+    return pd.DataFrame(sh.values)
+
+
+class AbbyySheetReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.temp_dir.name, "ocred.xlsx")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def assert_same_as_loaded(self):
+        df_loaded = read_fix_excel_loaded(self.file_name, "Sheet1")
+        df_streamed = read_abbyy_xlsx(self.file_name, "Sheet1")
+        pd.testing.assert_frame_equal(df_loaded, df_streamed)
+        pd.testing.assert_frame_equal(df_loaded.fillna("").astype(str), df_streamed.fillna("").astype(str))
+
+    def test_same_as_loaded_workbook(self):
+        wb = Workbook()
+        sh = wb.active
+        sh.title = "Sheet1"
+        sh["A1"] = "Pacientas: Vardenis Pavardenis"
+        sh["C1"] = 1234567
+        sh["C1"].number_format = "#,##0"
+        sh["B2"] = 12.5
+        sh["D2"] = datetime.datetime(2021, 5, 4, 8, 30)
+        sh["A3"] = 42
+        # Row 4 is missing, row 5 ends with a formatted empty cell
+        sh["A5"] = "Hemoglobinas"
+        sh["F5"].number_format = "#,##0"
+        wb.save(self.file_name)
+        self.assert_same_as_loaded()
+
+    def test_same_as_loaded_synthetic(self):
+        synthetic_abbyy_xlsx(self.file_name, pages=3, rows=20, columns=6)
+        self.assert_same_as_loaded()
+
+    def test_empty_sheet(self):
+        wb = Workbook()
+        wb.active.title = "Sheet1"
+        wb.save(self.file_name)
+        self.assert_same_as_loaded()
+
+    def test_read_csv(self):
+        csv_file_name = os.path.join(self.temp_dir.name, "ocred.csv")
+        with open(csv_file_name, "w", encoding="utf-8-sig") as f:
+            f.write('Pacientas: Vardenis,,"1,234,567"\n"Hemoglobinas\nHGB",12.5\n\n,,,x\n')
+        df_expected = pd.DataFrame(
+            [
+                ["Pacientas: Vardenis", None, "1,234,567", None],
+                ["Hemoglobinas\nHGB", "12.5", None, None],
+                [None, None, None, None],
+                [None, None, None, "x"],
+            ]
+        )
+        pd.testing.assert_frame_equal(df_expected, read_abbyy_csv(csv_file_name))
+        pd.testing.assert_frame_equal(df_expected, read_abbyy_output(csv_file_name, ABBYY_OUTPUT_CSV))
+
+    def test_read_output_csv_same_text_as_xlsx(self):
+        csv_file_name = os.path.join(self.temp_dir.name, "ocred.csv")
+        synthetic_abbyy_xlsx(self.file_name, pages=2, rows=10, columns=4)
+        synthetic_abbyy_csv(csv_file_name, pages=2, rows=10, columns=4)
+        df_xlsx = read_abbyy_output(self.file_name, ABBYY_OUTPUT_XLSX).fillna("").astype(str)
+        df_csv = read_abbyy_output(csv_file_name, ABBYY_OUTPUT_CSV).fillna("").astype(str)
+        # Text cells and thousands formatted numbers are the same, other numbers are as recognized in CSV
+        pd.testing.assert_frame_equal(df_xlsx.iloc[:, :-1], df_csv.iloc[:, :-1])
@@ -1,8 +1,11 @@
 import unittest
-from mock import patch, call
+from copy import copy
+from mock import patch
+import numpy as np
 import pandas as pd
 
 from labrep_recognizer.recognition_tools.abbyy_tools import AbbyyTools
+from tests.synthetic_abbyy_sheet import synthetic_abbyy_sheet, HEADER_KEYWORDS
 
 
 class AbbyyToolsTestCase(unittest.TestCase):
@@ -52,6 +55,21 @@ class AbbyyToolsTestCase(unittest.TestCase):
         # self.assertEqual([], abbyy_tools.find_all_at_offset("c", 0, 1))
         self.assertEqual([], abbyy_tools.find_all_at_offset("not_found_string", 0, 1))
 
+    def test_find_all_at_offset_same_as_scan(self):
+        df_extract = synthetic_abbyy_sheet(pages=3, rows=20, columns=6)
+        abbyy_tools = AbbyyTools(df_extract)
+        for search_strings in [HEADER_KEYWORDS, ["c1_"], ["_1_", "_2_"], ["a", "b"], [""]]:
+            for offset_x, offset_y in [(0, 0), (1, 0), (-1, 0), (0, -1)]:
+                try:
+                    expected = find_all_at_offset_scan(df_extract, search_strings, offset_x, offset_y)
+                except IndexError:
+                    with self.assertRaises(IndexError):
+                        abbyy_tools.find_all_at_offset(search_strings, offset_x, offset_y)
+                    continue
+                self.assertEqual(expected, abbyy_tools.find_all_at_offset(search_strings, offset_x, offset_y))
+        with self.assertRaises(IndexError):
+            abbyy_tools.find_all_at_offset(HEADER_KEYWORDS[0], 0, len(df_extract))
+
     @patch(
         "labrep_recognizer.recognition_tools.abbyy_tools.AbbyyTools.find_all_at_offset",
         return_value=["b_value", "c_value", "a_value"],
@@ -85,54 +103,88 @@ class AbbyyToolsTestCase(unittest.TestCase):
         with self.assertRaises(IndexError):
             self.assertEqual("word1", abbyy_tools.find_whole_word("string_to_find", remove=False))
 
-    def test_find_till_the_end_in_copy(self):
-        abbyy_tools = AbbyyTools(AbbyyToolsTestCase.df_spreadsheet)
-        all_fields_expected_copy = [
-            "d_a0",
-            "d_a2",
-            "d_b0",
-            "d_b2",
-            "d_c0",
-            "d_c2",
-            "d_string_a1",
-            "different_string_to_find d_word1 d_word2",
-            "d_string_c1",
-        ]
-        self.assertEqual(
-            "d_word1 d_word2",
-            abbyy_tools.find_till_the_end_in_copy("different_string_to_find", all_fields_expected_copy, remove=False),
-        )
-        self.assertEqual(
-            "d_word1 d_word2",
-            abbyy_tools.find_till_the_end_in_copy("different_string_to_find", all_fields_expected_copy, remove=True),
-        )
+    def test_find_between_keywords(self):
+        df_spreadsheet_augmented = AbbyyToolsTestCase.df_spreadsheet.copy()
+        df_spreadsheet_augmented.iloc[1, 1] = "before value after other"
+        abbyy_tools = AbbyyTools(df_spreadsheet_augmented)
+        self.assertEqual("value", abbyy_tools.find_between_keywords("before", "after"))
+        # Removal of the after keyword is not kept
+        self.assertEqual("value after other", abbyy_tools.find_till_the_end("before", remove=False))
+        self.assertEqual("value", abbyy_tools.find_between_keywords("before", "after"))
         with self.assertRaises(IndexError):
-            self.assertEqual(
-                "d_word1 d_word2",
-                abbyy_tools.find_till_the_end_in_copy(
-                    "different_string_to_find", all_fields_expected_copy, remove=False
-                ),
+            abbyy_tools.find_between_keywords("before", "not_found_string")
+
+    def test_removal_same_as_list(self):
+        df_extract = synthetic_abbyy_sheet(pages=2, rows=10, columns=4)
+        abbyy_tools = AbbyyTools(df_extract)
+        abbyy_tools_list = AbbyyToolsList(df_extract)
+        lookups = [
+            ("find_whole_word", "Pacientas:", True),
+            ("find_till_the_end", "Pacientas:", False),
+            ("find_between_keywords", "Gimimo", "data:"),
+            ("find_till_the_end", "Gimimo data:", True),
+            ("find_between_keywords", "Gimimo", "data:"),
+            ("find_whole_word", "_1_", True),
+            ("find_whole_word", "_1_", False),
+            ("find_till_the_end", "_1_", True),
+            ("find_till_the_end", "_1_", True),
+            ("find_anywhere", "Gimimo data:"),
+            ("find_anywhere", "Gimimo"),
+        ]
+        for method, *args in lookups:
+            try:
+                expected = getattr(abbyy_tools_list, method)(*args)
+            except IndexError:
+                with self.assertRaises(IndexError):
+                    getattr(abbyy_tools, method)(*args)
+                continue
+            self.assertEqual(expected, getattr(abbyy_tools, method)(*args), (method, args))
+            self.assertEqual(abbyy_tools_list._extracted_all_fields, abbyy_tools._extracted_all_fields)
+
+
+# Whole sheet scan as before the cell text index
+def find_all_at_offset_scan(df_extract, search_strings, offset_x, offset_y):
+    found_values = []
+    for search_string in search_strings:
+        found_at = np.where(df_extract.applymap(lambda cell: search_string in cell).to_numpy())
+        for i in range(len(found_at[0])):
+            found_values.append(df_extract.iloc[found_at[0][i] + offset_y, found_at[1][i] + offset_x])
+    return sorted(list(set(found_values)))
+
+
+# Lookups modifying a list of all fields as before the removed span overlay
+class AbbyyToolsList:
+    def __init__(self, df_extract):
+        self._extracted_all_fields = list(sorted(set(df_extract.to_numpy().flatten())))
+
+    def find_anywhere(self, search_string):
+        return any([search_string in field for field in self._extracted_all_fields])
+
+    def find_till_the_end(self, search_string, remove=False):
+        return find_till_the_end_in_copy(search_string, self._extracted_all_fields, remove=remove)
+
+    def find_whole_word(self, search_string, remove=False):
+        found_at = [i for i, field in enumerate(self._extracted_all_fields) if search_string in field][0]
+        found_inside_at = self._extracted_all_fields[found_at].find(search_string)
+        found_value = self._extracted_all_fields[found_at][found_inside_at + len(search_string) :].strip().split(" ")[0]
+        found_end_value = self._extracted_all_fields[found_at].find(found_value) + len(found_value)
+        if remove:
+            self._extracted_all_fields[found_at] = (
+                self._extracted_all_fields[found_at][:found_inside_at]
+                + self._extracted_all_fields[found_at][found_end_value:]
             )
+        return found_value
 
-    @patch(
-        "labrep_recognizer.recognition_tools.abbyy_tools.AbbyyTools.find_till_the_end_in_copy",
-        return_value="expected_value",
-    )
-    def test_find_between_keywords(self, find_between_keywords_mock):
-        abbyy_tools = AbbyyTools(AbbyyToolsTestCase.df_spreadsheet)
-        self.assertEqual("expected_value", abbyy_tools.find_between_keywords("before", "after"))
-        self.assertEqual(2, find_between_keywords_mock.call_count)
-        find_between_keywords_mock.assert_has_calls(
-            [
-                call(
-                    "after",
-                    ["a0", "a2", "b0", "b2", "c0", "c2", "string_a1", "string_b1", "string_c1"],
-                    remove=True,
-                ),
-                call(
-                    "before",
-                    ["a0", "a2", "b0", "b2", "c0", "c2", "string_a1", "string_b1", "string_c1"],
-                    remove=False,
-                ),
-            ]
-        )
+    def find_between_keywords(self, before, after):
+        extracted_copy = copy(self._extracted_all_fields)
+        _ = find_till_the_end_in_copy(after, extracted_copy, remove=True)
+        return find_till_the_end_in_copy(before, extracted_copy, remove=False)
+
+
+def find_till_the_end_in_copy(search_string, extracted_copy, remove=False):
+    found_at = [i for i, field in enumerate(extracted_copy) if search_string in field][0]
+    found_inside_at = extracted_copy[found_at].find(search_string)
+    found_value = extracted_copy[found_at][found_inside_at + len(search_string) :].strip()
+    if remove:
+        extracted_copy[found_at] = extracted_copy[found_at][:found_inside_at]
+    return found_value
@@ -0,0 +1,30 @@
+import unittest
+
+from labrep_recognizer.shared.document_serialization import (
+    document_to_compressed_proto,
+    document_from_compressed_proto,
+)
+from tests.synthetic_google_document import synthetic_google_document
+
+
+class DocumentSerializationTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        document = synthetic_google_document(pages=2, rows=10, columns=4)
+        compressed_proto = document_to_compressed_proto(document)
+        self.assertIsInstance(compressed_proto, bytes)
+        restored = document_from_compressed_proto(compressed_proto)
+
+        self.assertEqual(document.text, restored.text)
+        self.assertEqual(len(document.pages), len(restored.pages))
+        for page, restored_page in zip(document.pages, restored.pages):
+            self.assertEqual(len(page.tokens), len(restored_page.tokens))
+            for token, restored_token in zip(page.tokens, restored_page.tokens):
+                self.assertEqual(
+                    [(s.start_index, s.end_index) for s in token.layout.text_anchor.text_segments],
+                    [(s.start_index, s.end_index) for s in restored_token.layout.text_anchor.text_segments],
+                )
+                self.assertEqual(
+                    [(v.x, v.y) for v in token.layout.bounding_poly.normalized_vertices],
+                    [(v.x, v.y) for v in restored_token.layout.bounding_poly.normalized_vertices],
+                )
+        self.assertEqual(document, restored)
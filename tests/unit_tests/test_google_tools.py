@@ -0,0 +1,290 @@
+import random
+import unittest
+
+import mock
+import numpy as np
+from shapely.geometry import Point, Polygon
+
+from labrep_recognizer.recognition_tools import google_tools as google_tools_module
+from labrep_recognizer.recognition_tools.google_tools import GoogleTools
+from labrep_recognizer.recognition_tools.line_clustering import cluster_rows
+from labrep_recognizer.shared.utils import find_all_strings
+from tests.synthetic_google_document import synthetic_google_document
+
+
+def vertices(token):
+    return token.layout.bounding_poly.normalized_vertices
+
+
+# Reference implementations scanning all page tokens
+def find_token_to_right_scan(tokens, scan_start_x, boundary_x, scan_start_y):
+    return [
+        token
+        for token in tokens
+        if vertices(token)[0].x > scan_start_x
+        and vertices(token)[0].x < boundary_x
+        and vertices(token)[0].y < scan_start_y
+        and vertices(token)[3].y > scan_start_y
+    ]
+
+
+def find_tokens_in_box_scan(tokens, box):
+    polygon = Polygon(box)
+    return [token for token in tokens if all([polygon.contains(Point(v.x, v.y)) for v in vertices(token)])]
+
+
+def token_ids(tokens):
+    return [
+        (vertices(token)[0].x, vertices(token)[0].y, token.layout.text_anchor.text_segments[0].start_index)
+        for token in tokens
+    ]
+
+
+class GoogleToolsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.document = synthetic_google_document(pages=2, rows=20, columns=6, seed=1)
+        self.google_tools = GoogleTools(self.document)
+        self.rnd = random.Random(0)
+
+    def test_find_token_to_right(self):
+        for page_index in range(2):
+            tokens = list(self.document.pages[page_index].tokens)
+            for token_from in self.rnd.sample(tokens, 15):
+                for boundary_x, boundary_relative, offset_y in [
+                    (1.0, False, 0.0),
+                    (0.2, True, 0.004),
+                    (0.5, False, -0.01),
+                ]:
+                    found = self.google_tools.gd_find_token_to_right(
+                        page_index, token_from, boundary_x, boundary_relative, offset_y
+                    )
+                    scan_start_x = vertices(token_from)[1].x - 0.001
+                    scan_start_y = (vertices(token_from)[1].y + vertices(token_from)[2].y) / 2 + offset_y
+                    if boundary_relative:
+                        boundary_x += vertices(token_from)[1].x
+                    expected = find_token_to_right_scan(tokens, scan_start_x, boundary_x, scan_start_y)
+                    self.assertEqual(token_ids(expected), token_ids(found))
+
+    def test_find_tokens_in_box(self):
+        tokens = list(self.document.pages[1].tokens)
+        for _ in range(15):
+            x_0, x_1 = sorted([self.rnd.uniform(0, 1), self.rnd.uniform(0, 1)])
+            y_0, y_1 = sorted([self.rnd.uniform(0, 1), self.rnd.uniform(0, 1)])
+            for box in [
+                [(x_0, y_0), (x_1, y_0), (x_1, y_1), (x_0, y_1)],
+                [(x_0, y_0), (x_1, y_0 + 0.05), (x_1, y_1), (x_0, y_1)],
+            ]:
+                found = self.google_tools.gd_find_tokens_in_box(1, box)
+                self.assertEqual(token_ids(find_tokens_in_box_scan(tokens, box)), token_ids(found))
+
+        # Vertices on the box boundary are not contained
+        v = vertices(tokens[7])
+        for box in [
+            [(v[0].x, v[0].y), (v[2].x, v[0].y), (v[2].x, v[2].y), (v[0].x, v[2].y)],
+            [
+                (v[0].x - 0.001, v[0].y - 0.001),
+                (v[2].x + 0.001, v[0].y - 0.001),
+                (v[2].x + 0.001, v[2].y + 0.001),
+                (v[0].x - 0.001, v[2].y + 0.001),
+            ],
+        ]:
+            found = self.google_tools.gd_find_tokens_in_box(1, box)
+            self.assertEqual(token_ids(find_tokens_in_box_scan(tokens, box)), token_ids(found))
+
+
+def get_token_height_shapely(token):
+    v = vertices(token)
+    return (
+        Point(v[0].x, v[0].y).distance(Point(v[3].x, v[3].y)) + Point(v[1].x, v[1].y).distance(Point(v[2].x, v[2].y))
+    ) / 2.0
+
+
+def is_same_row_reference(token_1, token_2):
+    tolerance = 0.25
+    tokens = sorted([token_1, token_2], key=get_token_height_shapely)
+    y_small_0 = vertices(tokens[0])[0].y
+    y_small_1 = vertices(tokens[0])[3].y
+    y_large_sorted = sorted([vertices(tokens[1])[0].y, vertices(tokens[1])[3].y])
+    y_small_fit_0 = y_small_0 + ((y_small_1 - y_small_0) * tolerance)
+    y_small_fit_1 = y_small_1 - ((y_small_1 - y_small_0) * tolerance)
+    return (y_large_sorted[0] < y_small_fit_0 < y_large_sorted[1]) and (
+        y_large_sorted[0] < y_small_fit_1 < y_large_sorted[1]
+    )
+
+
+def organize_tokens_box_reference(tokens):
+    lines = []
+    tokens = sorted(tokens, key=(lambda token_internal: vertices(token_internal)[0].x))
+    token_is_available = [True] * len(tokens)
+    while any(token_is_available):
+        available_range = [i for i, x in enumerate(token_is_available) if x]
+        token_from = tokens[available_range[0]]
+        lines.append([])
+        for i in available_range:
+            if is_same_row_reference(token_from, tokens[i]):
+                lines[-1].append(tokens[i])
+                token_is_available[i] = False
+    return sorted(lines, key=(lambda line: vertices(line[0])[0].y))
+
+
+class GoogleToolsIrregularTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.document = synthetic_google_document(pages=1, rows=15, columns=5, seed=2, vertex_jitter=0.3)
+        self.google_tools = GoogleTools(self.document)
+        self.tokens = list(self.document.pages[0].tokens)
+
+    def test_token_geometry(self):
+        for token in self.tokens:
+            self.assertEqual(get_token_height_shapely(token), self.google_tools.get_token_height(token))
+            v = vertices(token)
+            length = (
+                Point(v[0].x, v[0].y).distance(Point(v[1].x, v[1].y))
+                + Point(v[2].x, v[2].y).distance(Point(v[3].x, v[3].y))
+            ) / 2.0
+            self.assertEqual(length, self.google_tools.get_token_length(token))
+
+    def test_is_same_row(self):
+        for token_1 in self.tokens[:20]:
+            for token_2 in self.tokens:
+                self.assertEqual(
+                    is_same_row_reference(token_1, token_2), self.google_tools.is_same_row(token_1, token_2)
+                )
+
+    def test_organize_tokens_box(self):
+        rnd = random.Random(3)
+        for tokens in [self.tokens, rnd.sample(self.tokens, 30), list(self.document.pages[0].tokens)]:
+            expected = organize_tokens_box_reference(tokens)
+            found = self.google_tools.organize_tokens_box(tokens)
+            self.assertEqual([token_ids(line) for line in expected], [token_ids(line) for line in found])
+
+    def test_find_tokens_in_box(self):
+        rnd = random.Random(4)
+        for _ in range(15):
+            x_0, x_1 = sorted([rnd.uniform(0, 1), rnd.uniform(0, 1)])
+            y_0, y_1 = sorted([rnd.uniform(0, 1), rnd.uniform(0, 1)])
+            box = [(x_0, y_0), (x_1, y_0), (x_1, y_1), (x_0, y_1)]
+            found = self.google_tools.gd_find_tokens_in_box(0, box)
+            self.assertEqual(token_ids(find_tokens_in_box_scan(self.tokens, box)), token_ids(found))
+
+
+def text_start(token):
+    return token.layout.text_anchor.text_segments[0].start_index
+
+
+class GoogleToolsDegenerateTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.document = synthetic_google_document(pages=1, rows=10, columns=4, seed=6)
+        tokens = self.document.pages[0].tokens
+        # Empty and partial bounding polygons
+        del vertices(tokens[5])[:]
+        del vertices(tokens[12])[2:]
+        self.degenerate_tokens = [tokens[5], tokens[12]]
+        self.google_tools = GoogleTools(self.document)
+        self.tokens = list(tokens)
+        self.valid_tokens = [token for token in self.tokens if len(vertices(token)) == 4]
+
+    def test_find_tokens_in_box(self):
+        box = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
+        found = self.google_tools.gd_find_tokens_in_box(0, box)
+        self.assertEqual(token_ids(find_tokens_in_box_scan(self.valid_tokens, box)), token_ids(found))
+
+    def test_organize_tokens_box(self):
+        # Degenerate tokens get lines of their own after the other lines
+        lines = self.google_tools.organize_tokens_box(self.google_tools.get_page_tokens(0))
+        self.assertEqual(
+            [token_ids(line) for line in organize_tokens_box_reference(self.valid_tokens)],
+            [token_ids(line) for line in lines[:-2]],
+        )
+        self.assertEqual(
+            [[text_start(token)] for token in self.degenerate_tokens],
+            [[text_start(token) for token in line] for line in lines[-2:]],
+        )
+        self.assertFalse(self.google_tools.is_same_row(self.degenerate_tokens[0], self.valid_tokens[0]))
+
+
+def cluster_rows_reference(x_0, y_0, y_3, height):
+    def is_same_row(i, j):
+        small, large = sorted([i, j], key=lambda k: height[k])
+        y_small_fit_0 = y_0[small] + ((y_3[small] - y_0[small]) * 0.25)
+        y_small_fit_1 = y_3[small] - ((y_3[small] - y_0[small]) * 0.25)
+        y_large_sorted = sorted([y_0[large], y_3[large]])
+        return (y_large_sorted[0] < y_small_fit_0 < y_large_sorted[1]) and (
+            y_large_sorted[0] < y_small_fit_1 < y_large_sorted[1]
+        )
+
+    lines = []
+    available = sorted(range(len(x_0)), key=lambda k: x_0[k])
+    while available:
+        token_from = available[0]
+        line = [i for i in available if i == token_from or is_same_row(token_from, i)]
+        available = [i for i in available if i not in line]
+        lines.append(line)
+    return sorted(lines, key=lambda line: y_0[line[0]])
+
+
+class LineClusteringTestCase(unittest.TestCase):
+    def test_cluster_rows_random(self):
+        rnd = random.Random(5)
+        for _ in range(50):
+            count = rnd.randint(0, 60)
+            x_0 = np.array([rnd.choice([0.1, 0.2, rnd.random()]) for _ in range(count)])
+            y_0 = np.array([rnd.random() for _ in range(count)])
+            # Inverted, zero height and equal height tokens included
+            y_3 = y_0 + np.array([rnd.choice([0.0, 0.02, -0.02, rnd.uniform(-0.05, 0.1)]) for _ in range(count)])
+            height = np.abs(y_3 - y_0)
+            expected = cluster_rows_reference(x_0, y_0, y_3, height)
+            found = cluster_rows(x_0, y_0, y_3, height)
+            self.assertEqual(expected, [list(line) for line in found])
+
+
+def find_by_text_reference(document, page_index, search_string):
+    found_at_start = list(find_all_strings(search_string, document.text))
+    found_at = [(start, start + len(search_string)) for start in found_at_start]
+    found_tokens = []
+    for token in document.pages[page_index].tokens:
+        for serch_range in found_at:
+            segment = token.layout.text_anchor.text_segments[0]
+            if segment.start_index <= serch_range[0] and segment.end_index >= serch_range[1]:
+                found_tokens.append(token)
+    return found_tokens
+
+
+class GoogleToolsTextSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.document = synthetic_google_document(pages=2, rows=10, columns=4, seed=6)
+        self.google_tools = GoogleTools(self.document)
+        self.search_strings = ["w1_3_2_", "w0_", "_1", "a", "ab", "3_2", "\n", "w9", " w0_2"]
+
+    def test_find_token_by_text_from_token_list(self):
+        # Scanned and searched with the text index
+        for min_tokens in [google_tools_module.TEXT_INDEX_MIN_TOKENS, 0]:
+            with mock.patch.object(google_tools_module, "TEXT_INDEX_MIN_TOKENS", min_tokens):
+                google_tools = GoogleTools(self.document)
+                for page_index in range(2):
+                    page_tokens = google_tools.get_page_tokens(page_index)
+                    for tokens in [page_tokens, page_tokens[::-3]]:
+                        for search_string in self.search_strings + [""]:
+                            expected = [
+                                token for token in tokens if search_string in google_tools.get_token_text(token)
+                            ]
+                            found = google_tools.gd_find_token_by_text_from_token_list(tokens, search_string)
+                            self.assertEqual(token_ids(expected), token_ids(found))
+
+                # Tokens read from the document again are searched without the index
+                tokens = list(self.document.pages[0].tokens)
+                found = google_tools.gd_find_token_by_text_from_token_list(tokens, "w0_1")
+                self.assertEqual(4, len(found))
+
+    def test_find_token_by_text_short_list(self):
+        tokens = self.google_tools.get_page_tokens(0)[:5]
+        found = self.google_tools.gd_find_token_by_text_from_token_list(tokens, "w0_")
+        self.assertEqual(token_ids(tokens), token_ids(found))
+        # Not worth building the index for
+        self.assertIsNone(self.google_tools._token_text_index)
+
+    def test_find_by_text(self):
+        for page_index in range(2):
+            for search_string in self.search_strings:
+                expected = find_by_text_reference(self.document, page_index, search_string)
+                found = self.google_tools.gd_find_by_text(page_index, search_string)
+                self.assertEqual(token_ids(expected), token_ids(found))
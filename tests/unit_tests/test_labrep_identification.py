@@ -0,0 +1,166 @@
+import unittest
+
+import mock
+
+import pandas as pd
+
+from labrep_recognizer.labrep_recognize_request import LabrepRecognizeRequest
+from labrep_recognizer.labrep_types.labrep_anteja_2021 import LabrepAnteja2021
+from labrep_recognizer.labrep_types.labrep_interface import (
+    laboratory_types,
+    PRODUCT_ABBYY_TOOLS,
+    PRODUCT_GOOGLE_TOOLS,
+    PRODUCT_TIKA_EXTRACTED_TEXT,
+)
+from labrep_recognizer.labrep_types.labrep_medicina_practica_2021 import LabrepMedicinaPractica2021
+from labrep_recognizer.labrep_types.labrep_registry import LabrepRegistry, get_labrep_registry
+from labrep_recognizer.labrep_types.labrep_synlab_2021 import LabrepSynlab2021
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import ABBYY_OUTPUT_CSV, ABBYY_OUTPUT_XLSX
+from labrep_recognizer.recognition_tools.abbyy_tools import AbbyyTools
+from labrep_recognizer.recognition_tools.marker_index import MarkerIndex
+from labrep_recognizer.shared.stage_executor import STAGE_BACKEND_ABBYY, STAGE_BACKEND_GOOGLE
+
+
+class LabrepIdentificationTestCase(unittest.TestCase):
+    def test_marker_index(self):
+        marker_index = MarkerIndex({"he": 1, "she": 2, "his": 3, "hers": 4, "ushers": 5})
+        self.assertEqual({1, 2, 4}, marker_index.find("ushe hers"))
+        self.assertEqual({1, 2, 4, 5}, marker_index.find("ushers"))
+        self.assertEqual(set(), marker_index.find("h e r s"))
+        self.assertEqual(set(), MarkerIndex(dict()).find("text"))
+
+    def test_registry_identify_text(self):
+        registry = get_labrep_registry()
+        self.assertIs(LabrepSynlab2021, registry.get_class(laboratory_types[2]))
+        text = "Medicina practica\nlaboratorija,  UAB\nTyrimų rezultatai"
+        self.assertEqual([laboratory_types[1]], registry.identify_text(text))
+        self.assertEqual([], registry.identify_text("SYNLAB"))
+        self.assertTrue(registry.is_identified_by_markers(laboratory_types[0]))
+        self.assertFalse(registry.is_identified_by_markers(laboratory_types[2]))
+
+    def test_identify_by_markers(self):
+        df = pd.DataFrame([["UAB Antėja", "Įmonės kodas 300598351"], ["Pacientas:", "Vardenis Pavardenis"]])
+        request = LabrepRecognizeRequest(mock.Mock(), [], True)
+        request.abbyy_tools = AbbyyTools(df)
+        laboratory = request.identify(laboratory_types[:2])
+        self.assertEqual(
+            {"is_anteja_2021": True, "is_medicina_practica_2021": False, "is_synlab_2021": False}, laboratory
+        )
+        labrep = LabrepAnteja2021(df, request.abbyy_tools, None, None, None)
+        self.assertEqual(labrep.identify(), laboratory["is_anteja_2021"])
+
+    def test_request_identify_text(self):
+        request = LabrepRecognizeRequest(mock.Mock(), [], True)
+        request.tika_extracted_text = "UAB Antėja, įmonės kodas 300598351"
+        self.assertEqual("labrep_anteja_2021", request.identify_text()[0])
+        request.tika_extracted_text = "None"
+        self.assertIsNone(request.identify_text())
+
+    def test_common_stages(self):
+        self.assertEqual([STAGE_BACKEND_ABBYY, STAGE_BACKEND_GOOGLE], get_labrep_registry().common_stages())
+        self.assertEqual([STAGE_BACKEND_ABBYY, STAGE_BACKEND_GOOGLE], get_labrep_registry().identification_stages())
+
+    def test_abbyy_output_type(self):
+        self.assertEqual(ABBYY_OUTPUT_XLSX, get_labrep_registry().abbyy_output_type())
+        registry = LabrepRegistry(laboratory_types[:2])
+        with mock.patch.object(LabrepAnteja2021, "abbyy_output_type", ABBYY_OUTPUT_CSV):
+            self.assertEqual(ABBYY_OUTPUT_XLSX, registry.abbyy_output_type())
+            with mock.patch.object(LabrepMedicinaPractica2021, "abbyy_output_type", ABBYY_OUTPUT_CSV):
+                self.assertEqual(ABBYY_OUTPUT_CSV, registry.abbyy_output_type())
+
+    def test_run_staged_extraction_abbyy_output_type(self):
+        for identified, abbyy_output_types_expected in [
+            (True, [ABBYY_OUTPUT_CSV]),
+            # Not confirmed, ABBYY is run again for the other types
+            (False, [ABBYY_OUTPUT_CSV, ABBYY_OUTPUT_XLSX]),
+        ]:
+            request = LabrepRecognizeRequest(mock.Mock(), [], True)
+            abbyy_output_types = []
+
+            def run_abbyy():
+                if request.abbyy_output_type is None:
+                    request.abbyy_output_type = ABBYY_OUTPUT_XLSX
+                abbyy_output_types.append(request.abbyy_output_type)
+
+            def run_local_processing():
+                request.tika_extracted_text = "UAB Antėja, įmonės kodas 300598351"
+
+            request.run_abbyy = run_abbyy
+            request.run_google = mock.Mock()
+            request.run_local_processing = run_local_processing
+            # ABBYY is not needed by every type, so it starts after Antėja is identified from the text
+            with mock.patch(
+                "labrep_recognizer.labrep_recognize_request.get_labrep_registry",
+                return_value=LabrepRegistry(laboratory_types[:2]),
+            ), mock.patch.object(LabrepAnteja2021, "abbyy_output_type", ABBYY_OUTPUT_CSV), mock.patch.object(
+                LabrepAnteja2021, "identification_products", [PRODUCT_TIKA_EXTRACTED_TEXT]
+            ), mock.patch.object(
+                LabrepAnteja2021, "parsing_products", [PRODUCT_ABBYY_TOOLS]
+            ), mock.patch.object(
+                LabrepAnteja2021, "identify", return_value=identified
+            ), mock.patch.object(
+                LabrepMedicinaPractica2021, "identification_products", [PRODUCT_GOOGLE_TOOLS]
+            ), mock.patch.object(
+                LabrepMedicinaPractica2021, "parsing_products", [PRODUCT_GOOGLE_TOOLS]
+            ), mock.patch.object(
+                LabrepMedicinaPractica2021, "identify", return_value=False
+            ):
+                request.run_staged_extraction()
+            self.assertEqual(abbyy_output_types_expected, abbyy_output_types)
+
+    def test_run_staged_extraction(self):
+        request = LabrepRecognizeRequest(mock.Mock(), [], True)
+        request.run_abbyy = mock.Mock()
+        request.run_google = mock.Mock()
+
+        def run_local_processing():
+            request.tika_extracted_text = "UAB Antėja, įmonės kodas 300598351"
+
+        request.run_local_processing = run_local_processing
+        with mock.patch.object(LabrepAnteja2021, "identify", return_value=True):
+            laboratory = request.run_staged_extraction()
+        self.assertEqual(
+            {"is_anteja_2021": True, "is_medicina_practica_2021": False, "is_synlab_2021": False}, laboratory
+        )
+        request.run_abbyy.assert_called_once()
+        request.run_google.assert_called_once()
+
+    def test_run_staged_extraction_only_needed_stages(self):
+        request = LabrepRecognizeRequest(mock.Mock(), [], True)
+        request.run_abbyy = mock.Mock()
+        request.run_google = mock.Mock()
+
+        def run_local_processing():
+            request.tika_extracted_text = "UAB Antėja, įmonės kodas 300598351"
+
+        request.run_local_processing = run_local_processing
+        with mock.patch(
+            "labrep_recognizer.labrep_recognize_request.get_labrep_registry",
+            return_value=LabrepRegistry([laboratory_types[0]]),
+        ), mock.patch.object(LabrepAnteja2021, "parsing_products", [PRODUCT_ABBYY_TOOLS]), mock.patch.object(
+            LabrepAnteja2021, "identify", return_value=True
+        ):
+            laboratory = request.run_staged_extraction()
+        self.assertEqual({"is_anteja_2021": True}, laboratory)
+        request.run_abbyy.assert_called_once()
+        request.run_google.assert_not_called()
+
+    def test_run_staged_extraction_ambiguous(self):
+        # Antėja identified from the text, but the ABBYY fields also have the Medicina practica marker
+        request = LabrepRecognizeRequest(mock.Mock(), [], True)
+        df = pd.DataFrame([["UAB Antėja", "Įmonės kodas 300598351"], ["Medicina practica laboratorija, UAB", ""]])
+
+        def run_abbyy():
+            request.abbyy_tools = AbbyyTools(df)
+
+        def run_local_processing():
+            request.tika_extracted_text = "UAB Antėja, įmonės kodas 300598351"
+
+        request.run_abbyy = run_abbyy
+        request.run_google = mock.Mock()
+        request.run_local_processing = run_local_processing
+        with mock.patch.object(LabrepSynlab2021, "identify", return_value=False):
+            laboratory = request.run_staged_extraction()
+        self.assertEqual(
+            {"is_anteja_2021": True, "is_medicina_practica_2021": True, "is_synlab_2021": False}, laboratory
+        )
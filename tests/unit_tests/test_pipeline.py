@@ -0,0 +1,52 @@
+import os
+import threading
+import unittest
+
+import mock
+
+from labrep_recognizer import pipeline
+
+
+class SharedInfrastructureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.infrastructure = mock.Mock()
+        patcher = mock.patch.object(pipeline, "initialize_infrastructure", return_value=self.infrastructure)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ, {"recognizer_health_check_interval": "0"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pipeline._shared_infrastructure = None
+        self.addCleanup(setattr, pipeline, "_shared_infrastructure", None)
+
+    def test_health_check_without_lock(self):
+        self.assertIs(self.infrastructure, pipeline.get_shared_infrastructure())
+        check_started = threading.Event()
+        release = threading.Event()
+
+        def is_healthy():
+            check_started.set()
+            release.wait(5)
+            return True
+
+        self.infrastructure.is_healthy.side_effect = is_healthy
+        pipeline._shared_infrastructure_checked_at = -1.0
+        thread = threading.Thread(target=pipeline.get_shared_infrastructure)
+        thread.start()
+        self.assertTrue(check_started.wait(5))
+        # Other requests get the infrastructure while the check is running, without checking again
+        with mock.patch.dict(os.environ, {"recognizer_health_check_interval": "60"}):
+            self.assertIs(self.infrastructure, pipeline.get_shared_infrastructure())
+        release.set()
+        thread.join()
+        self.assertEqual(1, self.infrastructure.is_healthy.call_count)
+
+    def test_failed_reconnect_is_not_repeated(self):
+        pipeline.get_shared_infrastructure()
+        self.infrastructure.is_healthy.return_value = False
+        self.infrastructure.reconnect.side_effect = ConnectionError("unreachable")
+        pipeline._shared_infrastructure_checked_at = -1.0
+        self.assertIs(self.infrastructure, pipeline.get_shared_infrastructure())
+        with mock.patch.dict(os.environ, {"recognizer_health_check_interval": "60"}):
+            pipeline.get_shared_infrastructure()
+        self.assertEqual(1, self.infrastructure.reconnect.call_count)
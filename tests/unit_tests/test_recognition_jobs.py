@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from server.recognition_jobs import (
+    RecognitionJobs,
+    JOB_STATUS_DONE,
+    JOB_STATUS_ERROR,
+    JOB_STATUS_PENDING,
+    JOB_STATUS_RUNNING,
+)
+
+
+def wait_for_job(recognition_jobs, job_id):
+    for _ in range(500):
+        job = recognition_jobs.get(job_id)
+        if job["jobStatus"] in (JOB_STATUS_DONE, JOB_STATUS_ERROR):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def failing_recognition():
+    raise IndexError("index out of range")
+
+
+class RecognitionJobsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_submit_get(self):
+        recognition_jobs = RecognitionJobs(max_workers=2, max_queued=2, jobs_dir=self.temp_dir.name)
+        job_id = recognition_jobs.submit(lambda x: {"recognitionStatus": "OK", "value": x}, 1)
+        job = wait_for_job(recognition_jobs, job_id)
+        self.assertEqual(JOB_STATUS_DONE, job["jobStatus"])
+        self.assertEqual({"recognitionStatus": "OK", "value": 1}, job["parsingStatus"])
+
+        # Status is readable by another instance, e.g. another worker process
+        job_other_worker = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name).get(job_id)
+        self.assertEqual(job, job_other_worker)
+
+    def test_error(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name)
+        job = wait_for_job(recognition_jobs, recognition_jobs.submit(failing_recognition))
+        self.assertEqual(JOB_STATUS_ERROR, job["jobStatus"])
+        self.assertEqual("ERROR", job["parsingStatus"]["recognitionStatus"])
+        self.assertIn("IndexError", job["parsingStatus"]["errorText"])
+
+    def test_bounded(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name)
+        release = threading.Event()
+        job_id_1 = recognition_jobs.submit(release.wait)
+        job_id_2 = recognition_jobs.submit(release.wait)
+        self.assertIsNone(recognition_jobs.submit(release.wait))
+        self.assertIn(recognition_jobs.get(job_id_1)["jobStatus"], (JOB_STATUS_PENDING, JOB_STATUS_RUNNING))
+        self.assertEqual(JOB_STATUS_PENDING, recognition_jobs.get(job_id_2)["jobStatus"])
+        release.set()
+        wait_for_job(recognition_jobs, job_id_1)
+        wait_for_job(recognition_jobs, job_id_2)
+        job_id_3 = recognition_jobs.submit(release.wait)
+        self.assertIsNotNone(job_id_3)
+        wait_for_job(recognition_jobs, job_id_3)
+
+    def test_unknown_job(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name)
+        self.assertIsNone(recognition_jobs.get("0" * 32))
+        self.assertIsNone(recognition_jobs.get("../../etc/passwd"))
+
+    def test_running_status_write_failure(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name)
+        write_job = recognition_jobs._write_job
+
+        def write_job_failing_running(job_id, job_status, parsing_status=None):
+            if job_status == JOB_STATUS_RUNNING:
+                raise OSError("No space left on device")
+            write_job(job_id, job_status, parsing_status)
+
+        function = mock.Mock()
+        with mock.patch.object(recognition_jobs, "_write_job", side_effect=write_job_failing_running):
+            job = wait_for_job(recognition_jobs, recognition_jobs.submit(function))
+        self.assertEqual(JOB_STATUS_ERROR, job["jobStatus"])
+        self.assertIn("No space left on device", job["parsingStatus"]["errorText"])
+        function.assert_not_called()
+
+    def test_submit_failure_releases_slot(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=0, jobs_dir=self.temp_dir.name)
+        recognition_jobs._executor.shutdown()
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                recognition_jobs.submit(mock.Mock())
+        self.assertEqual([], os.listdir(self.temp_dir.name))
+
+        with mock.patch.object(recognition_jobs, "_write_job", side_effect=OSError("No space left on device")):
+            with self.assertRaises(OSError):
+                recognition_jobs.submit(mock.Mock())
+        # Slot is still free
+        self.assertTrue(recognition_jobs._slots.acquire(blocking=False))
+
+    def test_result_write_failure(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name)
+        job = wait_for_job(recognition_jobs, recognition_jobs.submit(lambda: {"value": object()}))
+        self.assertEqual(JOB_STATUS_ERROR, job["jobStatus"])
+        self.assertIn("not JSON serializable", job["parsingStatus"]["errorText"])
+
+    def test_expired_jobs_removed(self):
+        recognition_jobs = RecognitionJobs(max_workers=1, max_queued=1, jobs_dir=self.temp_dir.name, job_ttl=60)
+        job_id_old = recognition_jobs.submit(lambda: {"recognitionStatus": "OK"})
+        wait_for_job(recognition_jobs, job_id_old)
+        old = time.time() - 120
+        os.utime(os.path.join(self.temp_dir.name, f"{job_id_old}.json"), (old, old))
+        recognition_jobs._cleaned_at = 0.0
+        job_id_new = recognition_jobs.submit(lambda: {"recognitionStatus": "OK"})
+        wait_for_job(recognition_jobs, job_id_new)
+        self.assertIsNone(recognition_jobs.get(job_id_old))
+        self.assertIsNotNone(recognition_jobs.get(job_id_new))
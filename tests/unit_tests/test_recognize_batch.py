@@ -0,0 +1,89 @@
+import glob
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import mock
+
+from server import form
+
+
+def recognize_file_by_name(file):
+    if file["hashedName"].startswith("broken"):
+        raise ValueError("not a pdf")
+    return {"recognitionStatus": "OK", "errorText": "", "recognizedTestResults": {"name": file["hashedName"]}}
+
+
+class RecognizeBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(form, "EXECUTION_LOGS_DIR", self.temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_deduplication(self):
+        request_json = {
+            "files": [
+                {"hashedName": "a1", "hashSha256": "aaa"},
+                {"hashedName": "b", "hashSha256": "bbb"},
+                {"hashedName": "a2", "hashSha256": "aaa"},
+            ]
+        }
+        with mock.patch.object(form, "recognize_file", side_effect=recognize_file_by_name) as recognize_file:
+            batch_parsing_status = form.recognize_batch_request(request_json, "127.0.0.1")
+        self.assertEqual(2, recognize_file.call_count)
+        results = batch_parsing_status["results"]
+        self.assertEqual(["a1", "b", "a2"], [result["hashedName"] for result in results])
+        # Duplicate gets the result of the first file with the same content
+        self.assertEqual(results[0]["parsingStatus"], results[2]["parsingStatus"])
+        self.assertEqual({"name": "a1"}, results[2]["parsingStatus"]["recognizedTestResults"])
+
+    def test_item_error(self):
+        request_json = {
+            "files": [
+                {"hashedName": "a", "hashSha256": "aaa"},
+                {"hashedName": "broken", "hashSha256": "bbb"},
+                {"hashedName": "c", "hashSha256": "ccc"},
+            ]
+        }
+        with mock.patch.object(form, "recognize_file", side_effect=recognize_file_by_name):
+            batch_parsing_status = form.recognize_batch_request(request_json, "127.0.0.1")
+        statuses = [result["parsingStatus"]["recognitionStatus"] for result in batch_parsing_status["results"]]
+        self.assertEqual(["OK", "ERROR", "OK"], statuses)
+        self.assertIn("not a pdf", batch_parsing_status["results"][1]["parsingStatus"]["errorText"])
+
+    def test_order(self):
+        # Later files finish first, results still follow the request order
+        names = [f"file_{i}" for i in range(8)]
+        request_json = {"files": [{"hashedName": name, "hashSha256": name} for name in names]}
+
+        def recognize_file(file):
+            time.sleep((len(names) - names.index(file["hashedName"])) * 0.01)
+            return recognize_file_by_name(file)
+
+        with mock.patch.object(form, "recognize_file", side_effect=recognize_file):
+            batch_parsing_status = form.recognize_batch_request(request_json, "127.0.0.1")
+        self.assertEqual(names, [result["hashedName"] for result in batch_parsing_status["results"]])
+        self.assertEqual(
+            names,
+            [result["parsingStatus"]["recognizedTestResults"]["name"] for result in batch_parsing_status["results"]],
+        )
+
+    def test_execution_log(self):
+        request_json = {"files": [{"hashedName": "a", "hashSha256": "aaa"}]}
+        with mock.patch.object(form, "recognize_file", side_effect=recognize_file_by_name):
+            batch_parsing_status = form.recognize_batch_request(request_json, "127.0.0.1")
+        (log_file_name,) = glob.glob(os.path.join(self.temp_dir.name, "*.json"))
+        with open(log_file_name) as f:
+            execution_log = json.load(f)
+        self.assertEqual(request_json, execution_log["request"])
+        self.assertEqual(batch_parsing_status, execution_log["response"])
+
+    def test_shared_executor(self):
+        self.assertIs(form.get_batch_executor(), form.get_batch_executor())
+
@@ -0,0 +1,289 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+import unittest
+
+import cachetools
+
+from labrep_recognizer.shared.recognizer_cache import (
+    RecognizerCache,
+    CACHE_POLICY_TTL,
+    DEFAULT_NAMESPACE,
+    cache_namespace,
+)
+
+
+class CachedService:
+    def __init__(self, cache):
+        self._cache = cache
+        self.calls = 0
+
+    @cachetools.cachedmethod(lambda self: self._cache, key=RecognizerCache.pickled_hashkey)
+    def ocr(self, uri, function_name):
+        self.calls += 1
+        return f"ocred {uri}"
+
+    @cachetools.cachedmethod(cache_namespace("ocr_content"), key=RecognizerCache.content_hashkey)
+    def ocr_content(self, uri, function_name, content_sha256=None, ocr_version=None):
+        self.calls += 1
+        return f"ocred {uri}"
+
+    @cachetools.cachedmethod(cache_namespace("download"), key=RecognizerCache.pickled_hashkey)
+    def download(self, uri, function_name):
+        self.calls += 1
+        return f"downloaded {uri}"
+
+
+class RecognizerCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.temp_dir.name, "cache", "cache.pickle")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_set_get(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        self.assertFalse(cache)
+        cache["key_1"] = "value_1"
+        cache[("key", 2)] = {"value": 2}
+        self.assertEqual("value_1", cache["key_1"])
+        self.assertEqual({"value": 2}, cache[("key", 2)])
+        self.assertEqual(2, len(cache))
+        with self.assertRaises(KeyError):
+            _ = cache["not_found_key"]
+
+    def test_reopen_loads_lazily(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_1"] = "value_1"
+        cache["key_2"] = "value_2"
+        cache["key_1"] = "value_1_updated"
+
+        cache_reopened = RecognizerCache(self.cache_file, 0)
+        self.assertEqual(2, len(cache_reopened))
+        self.assertEqual({}, cache_reopened.memory_usage())
+        self.assertIn("key_2", cache_reopened)
+        self.assertEqual("value_1_updated", cache_reopened["key_1"])
+        self.assertEqual(["key_1"], list(cache_reopened._loaded[DEFAULT_NAMESPACE].keys()))
+
+    def test_write_appends_only_new_entry(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_1"] = "x" * 10000
+        size_before = os.path.getsize(self.cache_file)
+        cache["key_2"] = "y"
+        self.assertLess(os.path.getsize(self.cache_file) - size_before, 1000)
+
+    def test_delete(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_1"] = "value_1"
+        del cache["key_1"]
+        self.assertNotIn("key_1", cache)
+        self.assertNotIn("key_1", RecognizerCache(self.cache_file, 0))
+        with self.assertRaises(KeyError):
+            del cache["key_1"]
+
+    def test_incomplete_tail_is_ignored(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_1"] = "value_1"
+        cache["key_2"] = "value_2"
+        with open(self.cache_file, "r+b") as f:
+            f.truncate(os.path.getsize(self.cache_file) - 3)
+        cache_reopened = RecognizerCache(self.cache_file, 0)
+        self.assertEqual("value_1", cache_reopened["key_1"])
+        self.assertNotIn("key_2", cache_reopened)
+
+    def test_legacy_pickle_migration(self):
+        os.makedirs(os.path.dirname(self.cache_file))
+        with open(self.cache_file, "wb") as f:
+            pickle.dump({"key_1": "value_1"}, f)
+        cache = RecognizerCache(self.cache_file, 0)
+        self.assertEqual("value_1", cache["key_1"])
+        self.assertTrue(os.path.exists(self.cache_file + ".legacy"))
+        self.assertEqual("value_1", RecognizerCache(self.cache_file, 0)["key_1"])
+
+    def test_cachedmethod(self):
+        service = CachedService(RecognizerCache(self.cache_file, 0))
+        self.assertEqual("ocred gs://a", service.ocr("gs://a", "ocr"))
+        self.assertEqual("ocred gs://a", service.ocr("gs://a", "ocr"))
+        self.assertEqual(1, service.calls)
+
+        service_restarted = CachedService(RecognizerCache(self.cache_file, 0))
+        self.assertEqual("ocred gs://a", service_restarted.ocr("gs://a", "ocr"))
+        self.assertEqual(0, service_restarted.calls)
+
+    def test_content_hashkey(self):
+        self.assertEqual(
+            RecognizerCache.pickled_hashkey("gs://a", "ocr"),
+            RecognizerCache.content_hashkey("gs://a", "ocr", content_sha256=None, ocr_version="v1"),
+        )
+        self.assertEqual(
+            RecognizerCache.content_hashkey("gs://a", "ocr", content_sha256="sha", ocr_version="v1"),
+            RecognizerCache.content_hashkey("gs://b", "ocr", content_sha256="sha", ocr_version="v1"),
+        )
+        self.assertNotEqual(
+            RecognizerCache.content_hashkey("gs://a", "ocr", content_sha256="sha", ocr_version="v1"),
+            RecognizerCache.content_hashkey("gs://a", "ocr", content_sha256="sha", ocr_version="v2"),
+        )
+
+    def test_cachedmethod_content_hashkey(self):
+        service = CachedService(RecognizerCache(self.cache_file, 0))
+        service.ocr_content("gs://a", "ocr", content_sha256="sha", ocr_version="v1")
+        self.assertEqual("ocred gs://a", service.ocr_content("gs://b", "ocr", content_sha256="sha", ocr_version="v1"))
+        self.assertEqual(1, service.calls)
+        service.ocr_content("gs://b", "ocr", content_sha256=None, ocr_version="v1")
+        self.assertEqual(2, service.calls)
+
+    def test_cachedmethod_namespace(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        service = CachedService(cache)
+        self.assertEqual("downloaded gs://a", service.download("gs://a", "download"))
+        self.assertEqual("downloaded gs://a", service.download("gs://a", "download"))
+        self.assertEqual(1, service.calls)
+        self.assertEqual(["download"], list(cache.memory_usage().keys()))
+
+        service_no_cache = CachedService(None)
+        service_no_cache.download("gs://a", "download")
+        service_no_cache.download("gs://a", "download")
+        self.assertEqual(2, service_no_cache.calls)
+
+    def test_lru_max_entries(self):
+        cache = RecognizerCache(self.cache_file, 0, max_entries=2)
+        cache["key_1"] = "value_1"
+        cache["key_2"] = "value_2"
+        _ = cache["key_1"]
+        cache["key_3"] = "value_3"
+        self.assertEqual(["key_1", "key_3"], list(cache._loaded[DEFAULT_NAMESPACE].keys()))
+        # Evicted from memory only
+        self.assertEqual("value_2", cache["key_2"])
+        self.assertEqual(["key_3", "key_2"], list(cache._loaded[DEFAULT_NAMESPACE].keys()))
+
+    def test_max_bytes(self):
+        cache = RecognizerCache(self.cache_file, 0, max_bytes=2500)
+        for i in range(10):
+            cache[f"key_{i}"] = "x" * 1000
+        entries, size = cache.memory_usage()[DEFAULT_NAMESPACE]
+        self.assertEqual(2, entries)
+        self.assertLessEqual(size, 2500)
+        self.assertEqual(10, len(cache))
+
+    def test_namespace_quotas(self):
+        cache = RecognizerCache(
+            self.cache_file,
+            0,
+            max_entries=5,
+            namespace_quotas={"ocr": {"max_entries": 1}},
+        )
+        ocr = cache.namespace("ocr")
+        download = cache.namespace("download")
+        ocr["ocr_1"] = "value"
+        ocr["ocr_2"] = "value"
+        self.assertEqual(["ocr_2"], list(cache._loaded["ocr"].keys()))
+        for i in range(5):
+            download[f"download_{i}"] = "value"
+        # Global limit evicts the oldest entry across namespaces
+        self.assertEqual(0, cache.memory_usage()["ocr"][0])
+        self.assertEqual(5, cache.memory_usage()["download"][0])
+        self.assertEqual("value", ocr["ocr_1"])
+
+    def test_ttl(self):
+        cache = RecognizerCache(self.cache_file, 0, policy=CACHE_POLICY_TTL, ttl=60)
+        cache["key_1"] = "value_1"
+        self.assertEqual("value_1", cache["key_1"])
+        cache._ttl = -1
+        with self.assertRaises(KeyError):
+            _ = cache["key_1"]
+        self.assertEqual({DEFAULT_NAMESPACE: (0, 0)}, cache.memory_usage())
+
+        time.sleep(0.01)
+        cache_reopened = RecognizerCache(self.cache_file, 0, policy=CACHE_POLICY_TTL, ttl=0.001)
+        with self.assertRaises(KeyError):
+            _ = cache_reopened["key_1"]
+
+    def test_ttl_contains_len(self):
+        cache = RecognizerCache(self.cache_file, 0, policy=CACHE_POLICY_TTL, ttl=60)
+        cache["key_1"] = "value_1"
+        cache["key_2"] = "value_2"
+        self.assertIn("key_1", cache)
+        self.assertEqual(2, len(cache))
+        cache._ttl = -1
+        self.assertNotIn("key_1", cache)
+        self.assertEqual(0, len(cache))
+        self.assertEqual([], list(cache))
+
+    def test_compaction(self):
+        cache = RecognizerCache(self.cache_file, 0, max_log_bytes=20000)
+        cache_other = RecognizerCache(self.cache_file, 0)
+        cache["key_kept"] = "k" * 1000
+        self.assertEqual("k" * 1000, cache_other["key_kept"])
+        for i in range(100):
+            cache["key_overwritten"] = str(i) * 1000
+        cache["key_deleted"] = "d" * 1000
+        del cache["key_deleted"]
+        self.assertLess(os.path.getsize(self.cache_file), 20000)
+        self.assertEqual(2, len(cache))
+        # Other handles index the compacted log again
+        self.assertEqual("9" * 2000, cache_other["key_overwritten"])
+        self.assertEqual("k" * 1000, RecognizerCache(self.cache_file, 0)["key_kept"])
+        self.assertNotIn("key_deleted", cache_other)
+        cache_other["key_other"] = "value_other"
+        self.assertEqual("value_other", cache["key_other"])
+        self.assertEqual("9" * 2000, cache["key_overwritten"])
+
+    def test_replaced_log_with_same_inode(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_1"] = "a" * 100
+        cache_other = RecognizerCache(self.cache_file, 0)
+        self.assertIn("key_1", cache_other)
+
+        # Another log of the same size is written over the file in place, e.g. a reused inode after compaction
+        replacement_file = os.path.join(self.temp_dir.name, "replacement.pickle")
+        replacement = RecognizerCache(replacement_file, 0)
+        replacement["key_1"] = "b" * 100
+        with open(replacement_file, "rb") as f_in, open(self.cache_file, "r+b") as f_out:
+            f_out.write(f_in.read())
+        self.assertEqual("b" * 100, cache_other["key_1"])
+
+    def test_unreadable_value_is_miss(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_1"] = "value_1"
+        cache_other = RecognizerCache(self.cache_file, 0)
+        value_offset, value_length, _, _ = cache_other._store._index["key_1"]
+        with open(self.cache_file, "r+b") as f:
+            f.seek(value_offset)
+            f.write(b"\x00" * value_length)
+        with self.assertRaises(KeyError):
+            _ = cache_other["key_1"]
+
+    def test_compaction_drops_expired(self):
+        cache = RecognizerCache(self.cache_file, 0, policy=CACHE_POLICY_TTL, ttl=0.05, max_log_bytes=5000)
+        cache["key_expired"] = "e" * 3000
+        time.sleep(0.1)
+        cache["key_1"] = "1" * 1000
+        cache["key_1"] = "1" * 1000
+        self.assertEqual(["key_1"], list(cache._store.keys()))
+
+    def test_shared_between_processes(self):
+        cache = RecognizerCache(self.cache_file, 0)
+        cache["key_parent"] = "value_parent"
+
+        processes = [multiprocessing.Process(target=write_entries, args=(self.cache_file, i)) for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(0, process.exitcode)
+
+        # Entries written by other processes are visible without reopening the cache
+        for i in range(4):
+            for j in range(25):
+                self.assertEqual(f"value_{i}_{j}", cache[f"key_{i}_{j}"])
+        self.assertEqual("value_parent", cache["key_parent"])
+        self.assertEqual(101, len(RecognizerCache(self.cache_file, 0)))
+
+
+def write_entries(cache_file, process_no):
+    cache = RecognizerCache(cache_file, 0)
+    for j in range(25):
+        cache[f"key_{process_no}_{j}"] = f"value_{process_no}_{j}"
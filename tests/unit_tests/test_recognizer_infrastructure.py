@@ -0,0 +1,298 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+import mock
+import pikepdf
+from google.api_core.exceptions import NotFound
+from requests.utils import super_len
+
+from labrep_recognizer.labrep_recognize_request import LabrepRecognizeRequest, IOFileType
+from labrep_recognizer.recognition_tools.abbyy_sheet_reader import ABBYY_OUTPUT_XLSX
+from labrep_recognizer.recognizer_infrastructure import RecognizerInfrastructure, is_bucket_error
+from labrep_recognizer.shared.recognizer_cache import RecognizerCache
+from labrep_recognizer.shared.round_trips import count_round_trips, record_round_trip
+from labrep_recognizer.shared.stage_executor import (
+    run_stages,
+    RecognitionStageError,
+    STAGE_BACKEND_ABBYY,
+    STAGE_BACKEND_GOOGLE,
+)
+from labrep_recognizer.shared.utils import stream_to_sha256, new_transfer_stream, transfer_stream_file
+from server import form
+from server.form import remove_password
+
+BUCKET_NAME = "test-bucket"
+
+
+# In-memory stand-in for the Cloud Storage client, blobs are shared by all bucket handles. API calls are counted.
+class FakeBlob:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+
+    def download_to_file(self, stream):
+        stream.write(self._client.api_call(self.name))
+
+    def download_to_filename(self, file_name):
+        with open(file_name, "wb") as f:
+            f.write(self._client.api_call(self.name))
+
+    def upload_from_file(self, stream, rewind=False, content_type=None):
+        if rewind:
+            stream.seek(0)
+        self._client.api_call()
+        self._client.blobs[self.name] = stream.read()
+
+    def upload_from_filename(self, file_name):
+        with open(file_name, "rb") as f:
+            self.upload_from_file(f)
+
+    def delete(self):
+        self._client.api_call()
+        del self._client.blobs[self.name]
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+
+    def blob(self, blob_name):
+        return FakeBlob(self._client, blob_name)
+
+
+class FakeStorageClient:
+    def __init__(self):
+        self.blobs = dict()
+        self.api_calls = 0
+        self.fail_next_call = False
+
+    def get_bucket(self, bucket_name):
+        self.api_call()
+        return FakeBucket(self, bucket_name)
+
+    def api_call(self, blob_name=None):
+        self.api_calls += 1
+        if self.fail_next_call:
+            self.fail_next_call = False
+            raise ConnectionError("Connection reset")
+        if blob_name is not None and blob_name not in self.blobs:
+            raise NotFound(f"No such object: {BUCKET_NAME}/{blob_name}")
+        return self.blobs[blob_name] if blob_name is not None else None
+
+
+def abbyy_response(status_code, json_data=None):
+    response_mock = mock.Mock()
+    response_mock.status_code = status_code
+    response_mock.reason = "reason"
+    response_mock.text = "<html>error</html>"
+    if json_data is None:
+        response_mock.json.side_effect = ValueError("not json")
+    else:
+        response_mock.json.return_value = json_data
+    return response_mock
+
+
+@mock.patch.dict(os.environ, {"recognizer_bucket_name": BUCKET_NAME})
+class RecognizerInfrastructureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.infrastructure = RecognizerInfrastructure("project", None, "http://abbyy", None)
+        self.infrastructure.storage_client = FakeStorageClient()
+
+    def test_stream_round_trip(self):
+        content = os.urandom(100000)
+        for spill_to_disk_bytes in ["1024", ""]:
+            with mock.patch.dict(os.environ, {"recognizer_spill_to_disk_bytes": spill_to_disk_bytes}):
+                uri = self.infrastructure.upload_stream_to_google_bucket(io.BytesIO(content), "dir/input.pdf")
+                self.assertEqual(f"gs://{BUCKET_NAME}/dir/input.pdf", uri)
+                with self.infrastructure.download_stream_from_google_bucket(uri) as stream:
+                    self.assertEqual(hashlib.sha256(content).hexdigest(), stream_to_sha256(stream))
+                    self.assertEqual(content, stream.read())
+
+    def test_remove_password_streams(self):
+        pdf_encrypted = io.BytesIO()
+        with pikepdf.new() as pdf:
+            pdf.add_blank_page()
+            pdf.save(pdf_encrypted, encryption=pikepdf.Encryption(owner="secret", user="secret"))
+        self.infrastructure.secret_manager_client = mock.Mock()
+
+        def remove_password_file_objects(pdf_in, pdf_out, passwd, pdf_in_name=None):
+            # pikepdf needs readinto(), which SpooledTemporaryFile has only from Python 3.11
+            for stream in [pdf_in, pdf_out]:
+                self.assertNotIsInstance(stream, tempfile.SpooledTemporaryFile)
+                self.assertTrue(hasattr(stream, "readinto"))
+            remove_password(pdf_in, pdf_out, passwd, pdf_in_name=pdf_in_name)
+
+        for spill_to_disk_bytes in ["200", ""]:
+            with mock.patch.dict(os.environ, {"recognizer_spill_to_disk_bytes": spill_to_disk_bytes}):
+                uri = self.infrastructure.upload_stream_to_google_bucket(
+                    io.BytesIO(pdf_encrypted.getvalue()), "encrypted.pdf"
+                )
+                with mock.patch.object(form, "get_google_secret", return_value="secret"), mock.patch.object(
+                    form, "remove_password", side_effect=remove_password_file_objects
+                ), mock.patch("builtins.print"):
+                    uri_removed, hash_removed = form.remove_pdf_password(self.infrastructure, uri, "secret_name")
+                with self.infrastructure.download_stream_from_google_bucket(uri_removed) as stream:
+                    self.assertEqual(hash_removed, stream_to_sha256(stream))
+                    with pikepdf.open(transfer_stream_file(stream)) as pdf:
+                        self.assertFalse(pdf.is_encrypted)
+                        self.assertEqual(1, len(pdf.pages))
+
+    def test_one_api_call_per_transfer(self):
+        storage_client = self.infrastructure.storage_client
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, "input.pdf")
+            with open(file_name, "wb") as f:
+                f.write(b"%PDF")
+            with count_round_trips() as round_trips:
+                uri = self.infrastructure.upload_pdf_to_google_bucket(file_name, "input.pdf")
+                self.assertEqual(2, storage_client.api_calls)
+                self.infrastructure.download_file_from_google_bucket(uri, temp_dir)
+                self.infrastructure.download_stream_from_google_bucket(uri).close()
+                self.infrastructure.upload_stream_to_google_bucket(io.BytesIO(b"%PDF"), "copy.pdf")
+                self.infrastructure.delete_file_from_google_bucket(f"gs://{BUCKET_NAME}/copy.pdf")
+            self.assertEqual(6, storage_client.api_calls)
+            self.assertEqual({"get_bucket": 1, "upload": 2, "download": 2, "delete": 1}, round_trips.counts())
+
+    def test_bucket_resolved_again_after_error(self):
+        storage_client = self.infrastructure.storage_client
+        self.infrastructure.upload_stream_to_google_bucket(io.BytesIO(b"%PDF"), "input.pdf")
+        storage_client.fail_next_call = True
+        with self.assertRaises(ConnectionError):
+            self.infrastructure.download_stream_from_google_bucket(f"gs://{BUCKET_NAME}/input.pdf")
+        with count_round_trips() as round_trips:
+            self.infrastructure.download_stream_from_google_bucket(f"gs://{BUCKET_NAME}/input.pdf").close()
+        self.assertEqual({"get_bucket": 1, "download": 1}, round_trips.counts())
+
+    def test_bucket_kept_after_blob_not_found(self):
+        with count_round_trips() as round_trips:
+            with self.assertRaises(NotFound):
+                self.infrastructure.download_stream_from_google_bucket(f"gs://{BUCKET_NAME}/missing.pdf")
+            self.infrastructure.upload_stream_to_google_bucket(io.BytesIO(b"%PDF"), "input.pdf")
+        self.assertEqual({"get_bucket": 1, "download": 1, "upload": 1}, round_trips.counts())
+        self.assertTrue(is_bucket_error(NotFound("The specified bucket does not exist.")))
+        self.assertTrue(is_bucket_error(ConnectionError("Connection reset")))
+
+    def test_download_stream_closed_on_error(self):
+        streams = []
+
+        def new_transfer_stream():
+            streams.append(io.BytesIO())
+            return streams[-1]
+
+        self.infrastructure.storage_client.fail_next_call = True
+        with mock.patch(
+            "labrep_recognizer.recognizer_infrastructure.new_transfer_stream", side_effect=new_transfer_stream
+        ), self.assertRaises(ConnectionError):
+            self.infrastructure.download_stream_from_google_bucket(f"gs://{BUCKET_NAME}/input.pdf")
+        self.assertTrue(streams[0].closed)
+
+    def test_transfer_stream_file(self):
+        for spill_to_disk_bytes, rolled in [("1024", True), ("", False)]:
+            with mock.patch.dict(os.environ, {"recognizer_spill_to_disk_bytes": spill_to_disk_bytes}):
+                with new_transfer_stream() as stream:
+                    stream.write(os.urandom(100000))
+                    body = transfer_stream_file(stream)
+                    # Request body size is taken without spilling an in-memory stream to disk
+                    self.assertEqual(100000, super_len(body))
+                    self.assertEqual(rolled, stream._rolled)
+                    self.assertEqual(stream_to_sha256(stream), hashlib.sha256(body.read()).hexdigest())
+
+    def test_input_stream_closed_on_stage_error(self):
+        uri = self.infrastructure.upload_stream_to_google_bucket(io.BytesIO(b"%PDF"), "input.pdf")
+        # Content hash is computed for the cache, the input stream is kept for Tika
+        self.infrastructure._cache = dict()
+        streams = []
+        download_stream_from_google_bucket = self.infrastructure.download_stream_from_google_bucket
+
+        def download_stream(download_uri):
+            streams.append(download_stream_from_google_bucket(download_uri))
+            return streams[-1]
+
+        def failing_stage():
+            raise RecognitionStageError("Error from ocr_abbyy_fr_engine")
+
+        def run_local_processing():
+            # Does not read the input stream, as when ABBYY fails first
+            request.tika_extracted_text = ""
+
+        request = LabrepRecognizeRequest(
+            self.infrastructure, [{"FILE_TYPE": IOFileType.INPUT_GS_PDF_RAW_LAB_REPORT, "FILE_PATH": uri}], True
+        )
+        request.run_abbyy = failing_stage
+        request.run_google = mock.Mock()
+        request.run_local_processing = run_local_processing
+        with mock.patch.object(self.infrastructure, "download_stream_from_google_bucket", side_effect=download_stream):
+            recognition_ok, _ = request.recognize()
+        self.assertFalse(recognition_ok)
+        self.assertEqual(1, len(streams))
+        self.assertTrue(streams[0].closed)
+        self.assertIsNone(request.input_pdf_stream)
+
+    def test_round_trips_counted_per_request(self):
+        def request(round_trips_by_request, request_no):
+            with count_round_trips() as round_trips:
+                # Stages run on the shared executors are counted for the request that started them
+                run_stages(
+                    [
+                        (STAGE_BACKEND_ABBYY, lambda: record_round_trip("ocr_abbyy")),
+                        (STAGE_BACKEND_GOOGLE, lambda: [record_round_trip("ocr_google") for _ in range(request_no)]),
+                    ],
+                    threading.Event(),
+                )
+            round_trips_by_request[request_no] = round_trips.counts()
+
+        round_trips_by_request = dict()
+        threads = [threading.Thread(target=request, args=(round_trips_by_request, i)) for i in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({i: {"ocr_abbyy": 1, "ocr_google": i} for i in range(1, 5)}, round_trips_by_request)
+
+        with count_round_trips() as outer:
+            record_round_trip("upload")
+            with count_round_trips() as inner:
+                record_round_trip("download")
+        record_round_trip("download")
+        self.assertEqual({"upload": 1, "download": 1}, outer.counts())
+        self.assertEqual({"download": 1}, inner.counts())
+
+    def test_failed_conversion_not_cached(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = RecognizerCache(os.path.join(temp_dir, "cache"))
+            infrastructure = RecognizerInfrastructure("project", None, "http://abbyy", cache)
+            ok_response = abbyy_response(
+                200,
+                {
+                    "conversionStatus": "OK",
+                    "outputFiles": [{"FILE_TYPE": ABBYY_OUTPUT_XLSX, "FILE_PATH": "gs://b/out.xlsx"}],
+                },
+            )
+            with mock.patch.object(
+                infrastructure.abbyy_client, "post", side_effect=[abbyy_response(500), ok_response]
+            ) as post, mock.patch.object(
+                infrastructure, "download_file_from_google_bucket", return_value="data/ocred/out.xlsx"
+            ):
+                conversion_ok, error_message, _ = infrastructure.ocr_abbyy_fr_engine("gs://b/in.pdf", "sha")
+                self.assertFalse(conversion_ok)
+                self.assertIn("status_code: 500", error_message)
+                self.assertEqual(
+                    (True, "", "data/ocred/out.xlsx"), infrastructure.ocr_abbyy_fr_engine("gs://b/in.pdf", "sha")
+                )
+                self.assertEqual(
+                    (True, "", "data/ocred/out.xlsx"), infrastructure.ocr_abbyy_fr_engine("gs://b/in.pdf", "sha")
+                )
+            self.assertEqual(2, post.call_count)
+
+    def test_error_response_not_parsed(self):
+        error_response = abbyy_response(502)
+        with mock.patch.object(self.infrastructure.abbyy_client, "post", return_value=error_response):
+            conversion_ok, error_message, ocred_file = self.infrastructure.ocr_abbyy_fr_engine("gs://b/in.pdf")
+        self.assertEqual((False, None), (conversion_ok, ocred_file))
+        self.assertIn("<html>error</html>", error_message)
+        error_response.json.assert_not_called()
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import unittest
+
+import mock
+
+from labrep_recognizer.shared.stage_executor import (
+    run_stages,
+    StageGroup,
+    get_stage_deadline,
+    get_short_circuit_metrics,
+    RecognitionStageError,
+    STAGE_BACKEND_ABBYY,
+    STAGE_BACKEND_GOOGLE,
+    STAGE_BACKEND_LOCAL,
+)
+
+
+class StageExecutorTestCase(unittest.TestCase):
+    def test_all_stages_run(self):
+        results = []
+        run_stages(
+            [
+                (STAGE_BACKEND_ABBYY, lambda: results.append("abbyy")),
+                (STAGE_BACKEND_GOOGLE, lambda: results.append("google")),
+                (STAGE_BACKEND_LOCAL, lambda: results.append("local")),
+            ],
+            threading.Event(),
+        )
+        self.assertEqual(["abbyy", "google", "local"], sorted(results))
+
+    def test_failure_returns_without_waiting(self):
+        cancelled = threading.Event()
+        release = threading.Event()
+        stopped = threading.Event()
+        long_stage_started = threading.Event()
+        metrics_before = get_short_circuit_metrics()
+
+        def failing_stage():
+            # Fails once the long stage is running, so it is abandoned rather than cancelled in the queue
+            long_stage_started.wait(5)
+            raise RecognitionStageError("ABBYY conversion failed")
+
+        def long_stage():
+            long_stage_started.set()
+            release.wait(5)
+            if cancelled.is_set():
+                stopped.set()
+
+        started_at = time.monotonic()
+        with self.assertRaisesRegex(RecognitionStageError, "ABBYY conversion failed"):
+            run_stages([(STAGE_BACKEND_ABBYY, failing_stage), (STAGE_BACKEND_GOOGLE, long_stage)], cancelled)
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertTrue(cancelled.is_set())
+        self.assertFalse(stopped.is_set())
+
+        release.set()
+        self.assertTrue(stopped.wait(5))
+        for _ in range(100):
+            metrics = get_short_circuit_metrics()
+            if metrics["saved_seconds"] > metrics_before["saved_seconds"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(metrics_before["requests"] + 1, metrics["requests"])
+        self.assertEqual(metrics_before["abandoned_stages"] + 1, metrics["abandoned_stages"])
+        self.assertGreater(metrics["saved_seconds"], metrics_before["saved_seconds"])
+
+    def test_stage_exception_is_raised(self):
+        def failing_stage():
+            raise IndexError("index out of range")
+
+        with self.assertRaises(IndexError):
+            run_stages([(STAGE_BACKEND_LOCAL, failing_stage)], threading.Event())
+
+    @mock.patch.dict(os.environ, {"recognizer_google_timeout": "0"})
+    def test_timeout(self):
+        cancelled = threading.Event()
+        with self.assertRaisesRegex(RecognitionStageError, "google timed out"):
+            run_stages([(STAGE_BACKEND_GOOGLE, lambda: time.sleep(0.2))], cancelled)
+        self.assertTrue(cancelled.is_set())
+
+    def test_stage_group_wait_for_backend(self):
+        release = threading.Event()
+        stage_group = StageGroup(threading.Event())
+        stage_group.start(STAGE_BACKEND_LOCAL, lambda: "text")
+        stage_group.start(STAGE_BACKEND_GOOGLE, lambda: release.wait(5))
+        stage_group.wait([STAGE_BACKEND_LOCAL])
+        stage_group.start(STAGE_BACKEND_ABBYY, release.set)
+        self.assertEqual({STAGE_BACKEND_LOCAL, STAGE_BACKEND_GOOGLE, STAGE_BACKEND_ABBYY}, stage_group.started())
+        stage_group.wait()
+        self.assertTrue(release.is_set())
+
+    def test_stage_group_restart(self):
+        runs = []
+        stage_group = StageGroup(threading.Event())
+        stage_group.start(STAGE_BACKEND_ABBYY, lambda: runs.append("xlsx"))
+        stage_group.wait()
+
+        def failing_stage():
+            time.sleep(0.05)
+            runs.append("csv")
+            raise IndexError("index out of range")
+
+        stage_group.restart(STAGE_BACKEND_ABBYY, failing_stage)
+        self.assertEqual({STAGE_BACKEND_ABBYY}, stage_group.started())
+        # Waits for the new run and raises its failure
+        with self.assertRaises(IndexError):
+            stage_group.wait()
+        self.assertEqual(["xlsx", "csv"], runs)
+
+    def test_stage_deadline(self):
+        deadlines = []
+        stage_group = StageGroup(threading.Event())
+        with mock.patch.dict(os.environ, {"recognizer_abbyy_timeout": "60"}):
+            stage_group.start(STAGE_BACKEND_ABBYY, lambda: deadlines.append(get_stage_deadline()))
+            stage_group.wait()
+        self.assertAlmostEqual(time.monotonic() + 60, deadlines[0], delta=5)
+        self.assertIsNone(get_stage_deadline())